@@ -87,6 +87,26 @@ DRY_RUN = False
 # order amend/replaces are done, you may hit a ratelimit. If so, email BitMEX if you feel you need a higher limit.
 LOOP_INTERVAL = 5
 
+# Dead man's switch. A background thread re-arms BitMEX's order/cancelAllAfter timer every HEARTBEAT_INTERVAL
+# seconds while the order loop is ticking. If the bot hangs or its host dies, the exchange cancels every order
+# on the account after CANCEL_ALL_AFTER seconds. Note that this includes orders not placed by this bot.
+# With it on, shutdown cancels from the WS order list instead of listing orders over HTTP first.
+# Set to None to disable.
+CANCEL_ALL_AFTER = 60
+HEARTBEAT_INTERVAL = 15
+
+# Stale feed protection. The WS is pinged every WS_PING_INTERVAL seconds (0 to disable). While market data arrives
+# more than MAX_FEED_LAG seconds behind its exchange timestamp, a ping goes unanswered for that long, or no market
+# data arrives for MAX_FEED_SILENCE seconds, the bot pulls its entry orders (stops and take-profits stay) and
+# stops quoting until the feed is fresh again. Set MAX_FEED_LAG to None to disable.
+# The lag is measured from the smallest gap between our clock and the exchange's timestamps since connecting, of
+# which up to MAX_CLOCK_SKEW seconds is put down to clock skew; anything above it counts as lag, so keep the clock
+# synced (NTP). Set MAX_CLOCK_SKEW to None to put the whole gap down to skew, e.g. against the simulator.
+WS_PING_INTERVAL = 5
+MAX_FEED_LAG = 5
+MAX_FEED_SILENCE = 60
+MAX_CLOCK_SKEW = 1
+
 # Wait times between orders / errors
 API_REST_INTERVAL = 1
 API_ERROR_INTERVAL = 10
@@ -98,6 +118,16 @@ DRY_BTC = 50
 # Available levels: logging.(DEBUG|INFO|WARN|ERROR)
 LOG_LEVEL = logging.DEBUG
 
+# Logs go to the console and this file (None for console only), written from a background thread.
+LOG_FILE = 'bitmex.log'
+
+# 'text', or 'json' to write LOG_FILE as one JSON object per line. The console is always text.
+LOG_FORMAT = 'text'
+
+# Most INFO and DEBUG messages per second to let through from a module, e.g. {'policies': 5, 'bitmex': 2}.
+# Warnings and errors are never dropped.
+LOG_RATE_LIMITS = {}
+
 # To uniquely identify orders placed by this bot, the bot sends a ClOrdID (Client order ID) that is attached
 # to each order so its source can be identified. This keeps the market maker from cancelling orders that are
 # manually placed, or orders placed by another bot.
@@ -107,7 +137,52 @@ LOG_LEVEL = logging.DEBUG
 # Max length is 13 characters.
 ORDERID_PREFIX = "mm_bitmex_"
 
-# If any of these files (and this file) changes, reload the bot.
+# WebSocket client library: 'websocket-client' (the default; installs with the bot, and uses wsaccel if present) or
+# 'websockets' (pip install websockets), which parses frames in C and negotiates permessage-deflate.
+# test/ws-transport-benchmark.py compares them.
+WS_TRANSPORT = 'websocket-client'
+
+# Fields kept per WS table; the rest are dropped when a message is parsed, and updates that only touch dropped
+# fields are ignored. instrument updates carry dozens of fields the bot never reads. Add any field a custom
+# strategy needs, or set to {} to keep everything.
+WS_FIELDS = {
+    'instrument': ['symbol', 'state', 'tickSize', 'multiplier', 'initMargin', 'isQuanto', 'isInverse',
+                   'underlyingToSettleMultiplier', 'quoteToSettleMultiplier', 'lastPrice', 'markPrice',
+                   'indicativeSettlePrice', 'bidPrice', 'askPrice', 'midPrice'],
+}
+
+# If set, every raw WebSocket message is appended to this file with its receive time.
+# The file can be replayed with `python -m market_maker.sim.server`.
+WS_RECORD_FILE = None
+
+# Serve latency histograms (WS parse/apply, strategy evaluation, REST round trips, tick to order, order ack)
+# in Prometheus text format on http://127.0.0.1:<port>/metrics. None to disable.
+METRICS_PORT = None
+
+# Seconds between latency summary lines in the log. 0 to disable.
+METRICS_SUMMARY_INTERVAL = 60
+
+# Sampling profiler for sanity_check, print_status and place_orders. It runs while PROFILE_FLAG_FILE exists
+# (`touch profile.flag`), or after a SIGUSR2 (`kill -USR2 <pid>`, again to stop), and rewrites PROFILE_OUTPUT
+# with collapsed stacks after every loop: `flamegraph.pl profile.collapsed > profile.svg`.
+PROFILE_OUTPUT = 'profile.collapsed'
+PROFILE_FLAG_FILE = 'profile.flag'
+# Seconds between stack samples.
+PROFILE_INTERVAL = 0.005
+
+# When the bot restarts (a watched file changed, or the WS dropped) it leaves its orders resting and snapshots
+# them here with its strategy state. The next process adopts the orders that are still open instead of
+# cancelling and re-placing them, so they keep their queue position. Shutting down any other way still cancels.
+# Set to None to always cancel.
+STATE_FILE = 'state.json'
+
+# Snapshots older than this many seconds are ignored.
+STATE_MAX_AGE = 300
+
+# If any of these files (and this file) changes, reload the bot. Edits to settings.py and settings-<symbol>.py
+# are loaded in place at the start of the next loop, keeping the connection and orders. A value of the wrong
+# type is refused, and changes to connection, logging or worker settings restart the bot instead. Other files
+# always restart it.
 WATCHED_FILES = [join('market_maker', 'market_maker.py'), join('market_maker', 'bitmex.py'), 'settings.py']
 
 
@@ -119,9 +194,58 @@ WATCHED_FILES = [join('market_maker', 'market_maker.py'), join('market_maker', '
 CONTRACTS = ['XBTUSD']
 
 
+########################################################################################################################
+# Strategy
+########################################################################################################################
+
+# Policies from market_maker/policies.py whose operators combination_strategy adds up.
+STRATEGY_POLICIES = ['policy_MACD', 'policy_BBANDS_long', 'policy_GUPPY']
+
+# Keyword arguments (indicator periods) per policy, e.g. {'policy_MACD': {'fastperiod': 8, 'slowperiod': 21}}.
+STRATEGY_PARAMS = {}
+
+# Where the policies are evaluated: 'thread' or 'process' worker pools, or 'serial' to run them on the
+# order-management thread.
+STRATEGY_EXECUTOR = 'thread'
+
+# Number of pool workers. Defaults to one per policy.
+STRATEGY_WORKERS = None
+
+# Seconds to wait for the policies each loop. A policy that misses this deadline reuses its previous signal.
+STRATEGY_DEADLINE = 2
+
+# Candle history is kept here, per symbol and binSize, and topped up from trade/bucketed as bars close, so
+# restarts begin with warm indicators. Like LOG_FILE and STATE_FILE, a relative path is taken from the directory
+# the bot is started in: by default ./candles/<symbol>/<binSize>/<column>.bin, one memory-mapped file per
+# column holding 8 bytes per bar.
+# Set to None to fetch the last 100 bars every loop instead.
+CANDLE_STORE_DIR = 'candles'
+
+# Bars per binSize to backfill on the first run, and to hand to the policies.
+CANDLE_HISTORY = 1000
+
+# The binSizes handed to the policies, each fetched from trade/bucketed separately: one request per binSize on the
+# first run, CANDLE_HISTORY bars each.
+# Set CANDLE_BASE (e.g. '1m') to fetch only base bars into the candle store and build the others from them, so every
+# series ends on the same closed bar and any multiple of the base (e.g. '15m', '4h') can be listed. The base needs
+# CANDLE_BASE_HISTORY bars to cover the slowest binSize: 150000 1m bars is about 100 daily bars, backfilled 1000
+# per request API_REST_INTERVAL apart, so about 150 requests and 2.5 minutes before the first quote. Later runs
+# only fetch the bars closed since the store was last updated.
+CANDLE_BIN_SIZES = ['1m', '5m', '1h', '1d']
+CANDLE_BASE = None
+CANDLE_BASE_HISTORY = 150000
+
+
 # STOP LIMIT
 ORDER_LIMIT_POINT = 500
 ORDER_LIMIT_STEP = 80
 ORDER_STOP_POINT = 3000
 ORDER_MOVE_CONDITION = 200
 ORDER_STOP_STEP = 50
+
+# Trail the stop and take-profit orders above as soon as a WS price update crosses a step, rather than once per
+# LOOP_INTERVAL. Amends go out once the mid is TRAILING_HYSTERESIS past the step, and at most once every
+# TRAILING_MIN_INTERVAL seconds. Set TRAILING_STOPS to False to trail from the order loop instead.
+TRAILING_STOPS = True
+TRAILING_HYSTERESIS = 10
+TRAILING_MIN_INTERVAL = 1
@@ -3,6 +3,7 @@ import time
 import hashlib
 import hmac
 from future.builtins import bytes
+from market_maker.auth.Signer import Signer
 from future.standard_library import hooks
 with hooks():  # Python 2/3 compat
     from urllib.parse import urlparse
@@ -16,6 +17,7 @@ class APIKeyAuth(AuthBase):
         """Init with Key & Secret."""
         self.apiKey = apiKey
         self.apiSecret = apiSecret
+        self.signer = Signer(apiSecret)
 
     def __call__(self, r):
         """Called when forming a request - generates api key headers."""
@@ -23,7 +25,7 @@ class APIKeyAuth(AuthBase):
         nonce = generate_nonce()
         r.headers['api-nonce'] = str(nonce)
         r.headers['api-key'] = self.apiKey
-        r.headers['api-signature'] = generate_signature(self.apiSecret, r.method, r.url, nonce, r.body or '')
+        r.headers['api-signature'] = self.signer.sign(r.method, r.url, nonce, r.body)
 
         return r
 
@@ -1,6 +1,6 @@
 from requests.auth import AuthBase
 import time
-from market_maker.auth.APIKeyAuth import generate_signature
+from market_maker.auth.Signer import Signer
 
 
 class APIKeyAuthWithExpires(AuthBase):
@@ -11,6 +11,7 @@ class APIKeyAuthWithExpires(AuthBase):
         """Init with Key & Secret."""
         self.apiKey = apiKey
         self.apiSecret = apiSecret
+        self.signer = Signer(apiSecret)
 
     def __call__(self, r):
         """
@@ -23,6 +24,6 @@ class APIKeyAuthWithExpires(AuthBase):
         expires = int(round(time.time()) + 5)  # 5s grace period in case of clock skew
         r.headers['api-expires'] = str(expires)
         r.headers['api-key'] = self.apiKey
-        r.headers['api-signature'] = generate_signature(self.apiSecret, r.method, r.url, expires, r.body or '')
+        r.headers['api-signature'] = self.signer.sign(r.method, r.url, expires, r.body)
 
         return r
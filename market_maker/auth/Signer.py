@@ -0,0 +1,38 @@
+import hashlib
+import hmac
+
+
+class Signer(object):
+
+    """Signs BitMEX requests with one API secret.
+
+    The secret is keyed into an HMAC once, and each signature works on a copy of it. See generate_signature in
+    APIKeyAuth.py for what is signed.
+    """
+
+    def __init__(self, apiSecret):
+        self.hmac = hmac.new(apiSecret.encode('utf8'), digestmod=hashlib.sha256)
+        # Scheme and host of the last URL signed, e.g. 'https://www.bitmex.com'. Requests all go to one server,
+        # so the path is whatever follows it.
+        self.origin = None
+
+    def path(self, url):
+        """The part of `url` that is signed: the path and query string."""
+        if self.origin is None or not url.startswith(self.origin) or url[len(self.origin):][:1] not in '/?':
+            self.origin = origin(url)
+        return url[len(self.origin):].split('#', 1)[0]
+
+    def sign(self, verb, url, nonce, data=b''):
+        mac = self.hmac.copy()
+        mac.update(('%s%s%d' % (verb, self.path(url), nonce)).encode('utf8'))
+        if data:
+            mac.update(data if isinstance(data, (bytes, bytearray)) else data.encode('utf8'))
+        return mac.hexdigest()
+
+
+def origin(url):
+    """Scheme and host of `url`, or '' if it's already a path."""
+    start = url.find('//')
+    start = start + 2 if start >= 0 else 0
+    ends = [i for i in (url.find(c, start) for c in '/?#') if i >= 0]
+    return url[:min(ends)] if ends else url
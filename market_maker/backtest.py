@@ -0,0 +1,274 @@
+"""Offline backtest and parameter sweep for ExchangeInterface.combination_strategy.
+
+Replays stored candles through the same policy code the bot runs live, then manages the resulting
+positions the way OrderManager does (MarketIfTouched entry, Stop and Limit closes, trailing amends).
+
+    python -m market_maker.backtest history.json --grid ORDER_STOP_POINT=1000,2000,3000 \\
+        --grid ORDER_LIMIT_POINT=300,500 --grid policy_MACD.fastperiod=8,12
+
+history.json holds the raw `trade/bucketed` rows per binSize: {"5m": [...], "1h": [...], "1d": [...]}.
+Grid names are settings (ORDER_STOP_POINT, STRATEGY_POLICIES, ...) or `<policy>.<argument>` for indicator periods.
+"""
+from __future__ import absolute_import
+import argparse
+import ast
+import itertools
+import json
+import logging
+import multiprocessing
+from concurrent import futures
+
+import numpy as np
+
+from market_maker.candle_store import parse_bars
+from market_maker.market_maker import ExchangeInterface, trailing_amend
+from market_maker.settings import settings
+from market_maker.strategy_executor import StrategyExecutor
+from market_maker.utils.dotdict import dotdict
+
+logger = logging.getLogger('root')
+
+# Settings that change the signals. Every other setting only changes how positions are managed,
+# so parameter sets that agree on these share one pass over the history.
+SIGNAL_KEYS = ['STRATEGY_POLICIES', 'STRATEGY_PARAMS']
+
+# Candle history, set in each sweep worker so it's only sent once per process
+history = None
+
+
+class BacktestExchange(ExchangeInterface):
+
+    """ExchangeInterface serving candles from history as of a replay clock instead of from BitMEX."""
+
+    def __init__(self, candles, config, step='5m', window=None, warmup=100):
+        self.dry_run = True
+        self.symbol = config.SYMBOL
+        self.strategy_executor = StrategyExecutor(config.STRATEGY_POLICIES, mode='serial',
+                                                  params=config.STRATEGY_PARAMS)
+        self.bars = candles[step]
+        self.history = candles
+        self.index = 0
+        # Like load_candles live, the policies see up to CANDLE_HISTORY closed bars per binSize.
+        self.window = window or config.CANDLE_HISTORY
+
+        # Computed once for the whole replay: for every step, how many bars of each binSize have closed.
+        # Buckets are stamped with their close time, so a bucket is usable once its timestamp has passed.
+        self.closed = {}
+        for binSize, columns in candles.items():
+            closed = np.searchsorted(columns['timestamp'], self.bars['timestamp'], side='right')
+            if closed[-1] < warmup:
+                raise ValueError("Need at least %d closed %s candles to backtest, have %d" %
+                                 (warmup, binSize, closed[-1]))
+            self.closed[binSize] = closed
+        self.first_step = max(int(np.argmax(closed >= warmup)) for closed in self.closed.values())
+
+    def load_candles(self):
+        # Slices are views, and carry the timestamps so the signal cache reuses the slower binSizes' signals.
+        candles = {}
+        for binSize, columns in self.history.items():
+            end = self.closed[binSize][self.index]
+            start = max(0, end - self.window)
+            candles[binSize] = {column: columns[column][start:end] for column in ('timestamp', 'close', 'volume')}
+        return candles
+
+    def get_ticker(self, symbol=None):
+        price = float(self.bars['close'][self.index])
+        self.current_price = price
+        return {'last': price, 'buy': price, 'sell': price, 'mid': price}
+
+    def signals(self):
+        """Run combination_strategy at every step. Returns an array of 1/-1/0, 0 during warm-up."""
+        signals = np.zeros(len(self.bars['timestamp']), dtype='i1')
+        for index in range(self.first_step, len(signals)):
+            self.index = index
+            signals[index] = self.combination_strategy()
+        return signals
+
+
+def simulate(bars, signals, config, fee=0.00075):
+    """Trade the signals on `bars` and return PnL (XBT, inverse contracts) and drawdown."""
+    quantity = config.ORDER_START_SIZE
+    position = 0
+    entry_price = None
+    entry = None
+    closes = []
+    balance = 0.0
+    peak = 0.0
+    max_drawdown = 0.0
+    trades = 0
+    wins = 0
+
+    def fees(qty, price):
+        return -fee * abs(qty) / price
+
+    for i in range(len(signals)):
+        bar_open, high, low, close = (bars['open'][i], bars['high'][i], bars['low'][i], bars['close'][i])
+
+        if position:
+            # Closes rest from the previous step. If the bar reaches both, assume the stop went first.
+            exit_price = None
+            for order in sorted(closes, key=lambda o: o['ordType'] != 'Stop'):
+                if order['ordType'] == 'Stop':
+                    if order['side'] == 'Sell' and low <= order['stopPx']:
+                        exit_price = min(bar_open, order['stopPx'])
+                    elif order['side'] == 'Buy' and high >= order['stopPx']:
+                        exit_price = max(bar_open, order['stopPx'])
+                elif order['side'] == 'Sell' and high >= order['price']:
+                    exit_price = max(bar_open, order['price'])
+                elif order['side'] == 'Buy' and low <= order['price']:
+                    exit_price = min(bar_open, order['price'])
+                if exit_price is not None:
+                    break
+
+            if exit_price is not None:
+                pnl = position * (1 / entry_price - 1 / exit_price)
+                balance += pnl + fees(position, exit_price)
+                trades += 1
+                wins += pnl > 0
+                position = 0
+                closes = []
+            else:
+                for order in closes:
+                    amend = trailing_amend(order, entry_price, close, config)
+                    if amend:
+                        order.update(amend)
+
+        elif entry:
+            # MarketIfTouched entry
+            triggered = None
+            if entry['side'] == 'Buy' and high >= entry['stopPx']:
+                triggered = max(bar_open, entry['stopPx'])
+            elif entry['side'] == 'Sell' and low <= entry['stopPx']:
+                triggered = min(bar_open, entry['stopPx'])
+            if triggered is not None:
+                position = quantity if entry['side'] == 'Buy' else -quantity
+                entry_price = triggered
+                balance += fees(position, entry_price)
+                closes = entry['closes']
+                entry = None
+
+        if not position and signals[i]:
+            # Same orders as OrderManager.market_order; a new signal replaces an untriggered entry.
+            mid = close
+            if signals[i] > 0:
+                entry = {'side': 'Buy', 'stopPx': mid + 10, 'closes': [
+                    {'ordType': 'Stop', 'side': 'Sell', 'stopPx': mid - config.ORDER_STOP_POINT},
+                    {'ordType': 'Limit', 'side': 'Sell', 'price': mid + config.ORDER_LIMIT_POINT}]}
+            else:
+                entry = {'side': 'Sell', 'stopPx': mid - 10, 'closes': [
+                    {'ordType': 'Stop', 'side': 'Buy', 'stopPx': mid + config.ORDER_STOP_POINT},
+                    {'ordType': 'Limit', 'side': 'Buy', 'price': mid - config.ORDER_LIMIT_POINT}]}
+
+        equity = balance + (position * (1 / entry_price - 1 / close) if position else 0)
+        peak = max(peak, equity)
+        max_drawdown = max(max_drawdown, peak - equity)
+
+    return {
+        'pnl': balance,
+        'max_drawdown': max_drawdown,
+        'trades': trades,
+        'win_rate': float(wins) / trades if trades else 0.0,
+        'open_position': position,
+    }
+
+
+def make_config(params):
+    """Copy the settings and apply one parameter set."""
+    config = dotdict({key: value for key, value in settings.items() if key.isupper()})
+    config['STRATEGY_PARAMS'] = {name: dict(kwargs) for name, kwargs in (settings.STRATEGY_PARAMS or {}).items()}
+    for key, value in params.items():
+        if '.' in key:
+            policy, argument = key.split('.', 1)
+            config.STRATEGY_PARAMS.setdefault(policy, {})[argument] = value
+        else:
+            config[key] = value
+    return config
+
+
+def init_worker(candles):
+    global history
+    history = candles
+    logger.setLevel(logging.WARNING)
+
+
+def run_signals(config, step, window):
+    exchange = BacktestExchange(history, config, step=step, window=window)
+    return exchange.signals()
+
+
+def run_simulation(signals, config, step, fee):
+    return simulate(history[step], signals, config, fee=fee)
+
+
+def sweep(candles, grid, step='5m', window=None, workers=None, fee=0.00075):
+    """Backtest every combination in `grid` ({name: [values]}) across all CPU cores.
+
+    Returns one result dict per parameter set, best PnL first."""
+    names = list(grid)
+    combos = [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+    configs = [make_config(combo) for combo in combos]
+
+    groups = {}
+    for i, config in enumerate(configs):
+        key = json.dumps([config[name] for name in SIGNAL_KEYS], sort_keys=True)
+        groups.setdefault(key, []).append(i)
+
+    results = [None] * len(combos)
+    with futures.ProcessPoolExecutor(max_workers=workers or multiprocessing.cpu_count(),
+                                     mp_context=multiprocessing.get_context('fork'),
+                                     initializer=init_worker, initargs=(candles,)) as pool:
+        signal_jobs = {key: pool.submit(run_signals, configs[members[0]], step, window)
+                       for key, members in groups.items()}
+        simulation_jobs = {}
+        for key, members in groups.items():
+            signals = signal_jobs[key].result()
+            for i in members:
+                simulation_jobs[i] = pool.submit(run_simulation, signals, configs[i], step, fee)
+        for i, job in simulation_jobs.items():
+            results[i] = dict(job.result(), params=combos[i])
+
+    return sorted(results, key=lambda result: result['pnl'], reverse=True)
+
+
+def load_history(path):
+    """Load {binSize: [trade/bucketed rows]} into chronological columns per binSize."""
+    with open(path) as f:
+        raw = json.load(f)
+    return {binSize: bucket_columns(rows) for binSize, rows in raw.items()}
+
+
+def bucket_columns(rows):
+    return parse_bars(sorted(rows, key=lambda row: row['timestamp']))
+
+
+def parse_grid(specs):
+    grid = {}
+    for spec in specs:
+        name, values = spec.split('=', 1)
+        grid[name.strip()] = ast.literal_eval('[' + values + ']')
+    return grid
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Backtest combination_strategy over stored candles')
+    parser.add_argument('history', help='JSON file of trade/bucketed rows per binSize')
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help='Values to sweep for a setting or <policy>.<argument>. Repeat for more parameters.')
+    parser.add_argument('--step', default='5m', help='binSize the replay steps through (default 5m)')
+    parser.add_argument('--window', type=int, default=None,
+                        help='Candles per binSize the policies see (default CANDLE_HISTORY, as live)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--fee', type=float, default=0.00075, help='Fee per fill as a fraction of notional')
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    results = sweep(load_history(args.history), parse_grid(args.grid), step=args.step, window=args.window,
+                    workers=args.workers, fee=args.fee)
+    for result in results:
+        print("PnL: %+.6f XBT, Max Drawdown: %.6f XBT, Trades: %d, Win Rate: %.0f%%, Params: %s" %
+              (result['pnl'], result['max_drawdown'], result['trades'], result['win_rate'] * 100,
+               json.dumps(result['params'])))
+
+
+if __name__ == '__main__':
+    run()
@@ -4,11 +4,9 @@ import requests
 import time
 import datetime
 import json
-import base64
-import uuid
 import logging
 from market_maker.auth import APIKeyAuthWithExpires
-from market_maker.utils import constants, errors
+from market_maker.utils import constants, encoding, errors, metrics
 from market_maker.ws.ws_thread import BitMEXWebsocket
 
 
@@ -18,7 +16,7 @@ class BitMEX(object):
     """BitMEX API Connector."""
 
     def __init__(self, base_url=None, symbol=None, apiKey=None, apiSecret=None,
-                 orderIDPrefix='mm_bitmex_', shouldWSAuth=True, postOnly=False, timeout=7):
+                 orderIDPrefix='mm_bitmex_', shouldWSAuth=True, postOnly=False, timeout=7, waitForWS=True):
         """Init connector."""
         self.logger = logging.getLogger('root')
         self.base_url = base_url
@@ -30,9 +28,12 @@ class BitMEX(object):
                             )
         self.apiKey = apiKey
         self.apiSecret = apiSecret
+        # Signs every authenticated request; keeps the keyed HMAC between calls
+        self.auth = APIKeyAuthWithExpires(apiKey, apiSecret)
         if len(orderIDPrefix) > 13:
             raise ValueError("settings.ORDERID_PREFIX must be at most 13 characters long!")
         self.orderIDPrefix = orderIDPrefix
+        self.clOrdIDs = encoding.ClOrdIDs(orderIDPrefix)
         self.retries = 0  # initialize counter
 
         # Prepare HTTPS session
@@ -44,7 +45,8 @@ class BitMEX(object):
 
         # Create websocket for streaming data
         self.ws = BitMEXWebsocket()
-        self.ws.connect(base_url, symbol, shouldAuth=shouldWSAuth)
+        self.ws.connect(base_url, symbol, shouldAuth=shouldWSAuth, wait=waitForWS,
+                        orderIDPrefix=orderIDPrefix)
 
         self.timeout = timeout
 
@@ -54,6 +56,10 @@ class BitMEX(object):
     def exit(self):
         self.ws.exit()
 
+    def wait_for_ws(self):
+        """With waitForWS=False, block until the WS data images are in. Needed before any data method."""
+        self.ws.wait_for_partials()
+
     #
     # Public methods
     #
@@ -174,29 +180,34 @@ class BitMEX(object):
 
         endpoint = "order"
         # Generate a unique clOrdID with our prefix so we can identify it.
-        clOrdID = self.orderIDPrefix + base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
+        clOrdID = next(self.clOrdIDs)
         postdict = {
             'symbol': self.symbol,
             'orderQty': quantity,
             'price': price,
             'clOrdID': clOrdID
         }
+        metrics.expect_ack(clOrdID)
         return self._curl_bitmex(path=endpoint, postdict=postdict, verb="POST")
 
     @authentication_required
     def amend_bulk_orders(self, orders):
         """Amend multiple orders."""
+        for order in orders:
+            metrics.expect_ack(order['orderID'])
         # Note rethrow; if this fails, we want to catch it and re-tick
         return self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='PUT', rethrow_errors=True)
 
     @authentication_required
     def create_bulk_orders(self, orders):
         """Create multiple orders."""
+        extra = {'symbol': self.symbol}
+        if self.postOnly:
+            extra['execInst'] = 'ParticipateDoNotInitiate'
+        # New dicts, so the caller's orders aren't changed under it
+        orders = [dict(order, clOrdID=next(self.clOrdIDs), **extra) for order in orders]
         for order in orders:
-            order['clOrdID'] = self.orderIDPrefix + base64.b64encode(uuid.uuid4().bytes).decode('utf8').rstrip('=\n')
-            order['symbol'] = self.symbol
-            if self.postOnly:
-                order['execInst'] = 'ParticipateDoNotInitiate'
+            metrics.expect_ack(order['clOrdID'])
         return self._curl_bitmex(path='order/bulk', postdict={'orders': orders}, verb='POST')
 
     @authentication_required
@@ -204,6 +215,11 @@ class BitMEX(object):
         """Get open orders."""
         return self.ws.open_orders(self.orderIDPrefix)
 
+    @authentication_required
+    def own_orders(self):
+        """Our open orders indexed by side and price, see ws/order_index.py."""
+        return self.ws.own_orders
+
     @authentication_required
     def http_open_orders(self):
         """Get open orders via HTTP. Used on close to ensure we catch them all."""
@@ -220,21 +236,31 @@ class BitMEX(object):
         return [o for o in orders if str(o['clOrdID']).startswith(self.orderIDPrefix)]
 
     @authentication_required
-    def http_get_trade_bucket(self, binSize='5m', count=100, reverse=True):
+    def http_get_trade_bucket(self, binSize='5m', count=100, reverse=True, startTime=None, partial=False):
         """Get trade_bucket via HTTP. """
         path = "trade/bucketed"
+        query = {
+            'symbol': self.symbol,
+            'count': count,
+            'binSize': binSize,
+            'reverse': reverse,
+            'partial': partial
+        }
+        if startTime:
+            query['startTime'] = startTime
         trade_buckets = self._curl_bitmex(
             path=path,
-            query={
-                'symbol': self.symbol,
-                'count': count,
-                'binSize': binSize,
-                'reverse': reverse
-            },
+            query=query,
             verb="GET"
         )
         return trade_buckets
 
+    @authentication_required
+    def cancel_all_after(self, timeout):
+        """Cancel every order on the account in `timeout` milliseconds unless called again first. 0 disarms."""
+        return self._curl_bitmex(path='order/cancelAllAfter', postdict={'timeout': timeout}, verb='POST',
+                                 rethrow_errors=True)
+
     @authentication_required
     def cancel(self, orderID):
         """Cancel an existing order."""
@@ -242,6 +268,8 @@ class BitMEX(object):
         postdict = {
             'orderID': orderID,
         }
+        for ID in (orderID if isinstance(orderID, list) else [orderID]):
+            metrics.expect_ack(ID)
         return self._curl_bitmex(path=path, postdict=postdict, verb="DELETE")
 
     @authentication_required
@@ -275,9 +303,6 @@ class BitMEX(object):
         if max_retries is None:
             max_retries = 0 if verb in ['POST', 'PUT'] else 3
 
-        # Auth: API Key/Secret
-        auth = APIKeyAuthWithExpires(self.apiKey, self.apiSecret)
-
         def exit_or_throw(e):
             if rethrow_errors:
                 raise e
@@ -293,10 +318,13 @@ class BitMEX(object):
         # Make the request
         response = None
         try:
-            self.logger.info("sending req to %s: %s" % (url, json.dumps(postdict or query or '')))
-            req = requests.Request(verb, url, json=postdict, auth=auth, params=query)
+            self.logger.info("sending req to %s: %s", url, postdict or query or '')
+            # Serialized once: these exact bytes are signed and sent.
+            body = encoding.dumps(postdict) if postdict else None
+            req = requests.Request(verb, url, data=body, auth=self.auth, params=query)
             prepped = self.session.prepare_request(req)
-            response = self.session.send(prepped, timeout=timeout)
+            with metrics.timer('rest_request', verb=verb, path=path):
+                response = self.session.send(prepped, timeout=timeout)
             # Make non-200s throw
             response.raise_for_status()
 
@@ -0,0 +1,200 @@
+"""Append-only on-disk candle history, one memory-mapped file per column, and bars resampled from it."""
+from __future__ import absolute_import
+import logging
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+logger = logging.getLogger('root')
+
+BIN_SECONDS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+UNIT_SECONDS = {'m': 60, 'h': 3600, 'd': 86400}
+COLUMNS = [('timestamp', 'i8'), ('open', 'f8'), ('high', 'f8'), ('low', 'f8'), ('close', 'f8'),
+           ('volume', 'f8'), ('vwap', 'f8')]
+BAR = np.dtype(COLUMNS)
+# Most bins trade/bucketed returns per request
+PAGE_SIZE = 1000
+
+
+class CandleStore(object):
+
+    """Closed trade/bucketed bars for one symbol and binSize.
+
+    Each column is a file of fixed-width values, `<directory>/<symbol>/<binSize>/<column>.bin`, that only ever
+    grows, so reading the latest bars is a memory map and a slice. Timestamps are epoch seconds of the bar's close,
+    as the API stamps them. Missing bars are forward-filled from the previous close with zero volume.
+    """
+
+    def __init__(self, directory, symbol, binSize):
+        self.binSize = binSize
+        self.seconds = BIN_SECONDS[binSize]
+        self.path = os.path.join(directory, symbol, binSize)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.maps = {}
+        self.length = self.repair()
+
+    def file(self, column):
+        return os.path.join(self.path, column + '.bin')
+
+    def repair(self):
+        """Drop a partly written last bar, e.g. after a crash between appending two columns."""
+        length = min(os.path.getsize(self.file(column)) // np.dtype(dtype).itemsize
+                     if os.path.exists(self.file(column)) else 0 for column, dtype in COLUMNS)
+        for column, dtype in COLUMNS:
+            with open(self.file(column), 'ab') as f:
+                f.truncate(length * np.dtype(dtype).itemsize)
+        return length
+
+    def columns(self, count=None):
+        """The last `count` bars (all by default) as read-only arrays per column, oldest first."""
+        if self.length == 0:
+            return {column: np.empty(0, dtype=dtype) for column, dtype in COLUMNS}
+        if not self.maps or len(self.maps['timestamp']) != self.length:
+            # Appends don't move existing bytes, so arrays handed out from an older map stay valid.
+            self.maps = {column: np.memmap(self.file(column), dtype=dtype, mode='r', shape=(self.length,))
+                         for column, dtype in COLUMNS}
+        start = max(self.length - count, 0) if count else 0
+        return {column: values[start:] for column, values in self.maps.items()}
+
+    def last_timestamp(self):
+        if self.length == 0:
+            return None
+        return int(self.columns(1)['timestamp'][0])
+
+    def append(self, rows):
+        """Append trade/bucketed rows newer than the last stored bar. Returns the number of bars written."""
+        last = self.last_timestamp()
+        lastClose = float(self.columns(1)['close'][0]) if last is not None else None
+        new = parse_bars(rows)
+        if last is not None:
+            new = new[new['timestamp'] > last]
+        bars = []
+        for bar in new.tolist():
+            stamp = bar[0]
+            while last is not None and stamp - last > self.seconds:
+                # No bucket for this bin, so nothing traded: carry the close forward.
+                last += self.seconds
+                bars.append((last, lastClose, lastClose, lastClose, lastClose, 0.0, lastClose))
+            bars.append(bar)
+            last, lastClose = stamp, bar[4]
+        if not bars:
+            return 0
+
+        records = np.array(bars, dtype=BAR)
+        for column, dtype in COLUMNS:
+            with open(self.file(column), 'ab') as f:
+                f.write(np.ascontiguousarray(records[column]).tobytes())
+        self.length += len(bars)
+        return len(bars)
+
+    def update(self, fetch, history=1000, pause=0):
+        """Store every bar closed since the last one stored, or the last `history` bars if empty.
+
+        fetch(startTime, count) returns trade/bucketed rows oldest first. Long gaps are backfilled a page at a
+        time, `pause` seconds apart."""
+        now = int(time.time())
+        last = self.last_timestamp()
+        if last is not None and now < last + self.seconds:
+            return 0
+        if last is None:
+            start = (now // self.seconds - history + 1) * self.seconds
+        else:
+            start = last + self.seconds
+
+        added = 0
+        while True:
+            rows = fetch(startTime=format_timestamp(start), count=PAGE_SIZE)
+            appended = self.append(rows or [])
+            added += appended
+            if not appended or len(rows) < PAGE_SIZE:
+                break
+            logger.info("Backfilled %s candles up to %s", self.binSize, format_timestamp(self.last_timestamp()))
+            start = self.last_timestamp() + self.seconds
+            time.sleep(pause)
+        return added
+
+
+def parse_bars(rows):
+    """trade/bucketed rows, newest or oldest first, as a chronological structured array of COLUMNS.
+
+    Columns are filled straight from the rows; missing prices (e.g. vwap on an empty bin) become NaN."""
+    bars = np.empty(len(rows), dtype=BAR)
+    if not len(rows):
+        return bars
+    if rows[0]['timestamp'] > rows[-1]['timestamp']:
+        # The API's default, reverse=true
+        rows = rows[::-1]
+    # ISO seconds, without the '.000Z' numpy won't take
+    bars['timestamp'] = np.array([row['timestamp'][:19] for row in rows], dtype='datetime64[s]').astype('i8')
+    for column, dtype in COLUMNS[1:]:
+        bars[column] = [row.get(column) for row in rows]
+    return bars
+
+
+class Resampler(object):
+
+    """Bars of any binSize ('5m', '4h', '1d'...) built from a finer base series such as the 1m store.
+
+    Each update only resamples the base bars after the last bar it built, and keeps the newest `limit` bars.
+    Only bins the base series covers completely are emitted, so every derived series ends on the same closed
+    base bar.
+    """
+
+    def __init__(self, binSize, baseSize, limit=None):
+        self.binSize = binSize
+        self.seconds = bin_seconds(binSize)
+        self.baseSeconds = bin_seconds(baseSize)
+        if self.seconds % self.baseSeconds:
+            raise ValueError("Can't build %s bars from %s bars" % (binSize, baseSize))
+        self.limit = limit
+        self.bars = np.empty(0, dtype=BAR)
+
+    def update(self, base):
+        """Add the bins closed in `base` (chronological columns) since the last update. Returns all bars."""
+        start = 0
+        if len(self.bars):
+            start = np.searchsorted(base['timestamp'], self.bars['timestamp'][-1], side='right')
+        new = resample({column: base[column][start:] for column, dtype in COLUMNS}, self.seconds, self.baseSeconds)
+        if len(new):
+            bars = np.concatenate((self.bars, new))
+            self.bars = bars[-self.limit:] if self.limit else bars
+        return self.bars
+
+
+def resample(base, seconds, baseSeconds):
+    """Aggregate chronological base bars into `seconds` bins, keeping only the bins the base fully covers.
+
+    Bars are stamped with their close time like the API's: a bin closing at T holds the base bars stamped
+    (T - seconds, T]. vwap is the volume-weighted mean of the base bars' vwaps."""
+    stamps = np.asarray(base['timestamp'])
+    if not len(stamps):
+        return np.empty(0, dtype=BAR)
+    closes = -(-stamps // seconds) * seconds
+    starts = np.flatnonzero(np.concatenate(([True], closes[1:] != closes[:-1])))
+    counts = np.diff(np.append(starts, len(stamps)))
+    ends = starts + counts - 1
+
+    bars = np.empty(len(starts), dtype=BAR)
+    bars['timestamp'] = closes[starts]
+    bars['open'] = base['open'][starts]
+    bars['high'] = np.maximum.reduceat(base['high'], starts)
+    bars['low'] = np.minimum.reduceat(base['low'], starts)
+    bars['close'] = base['close'][ends]
+    volume = np.add.reduceat(base['volume'], starts)
+    bars['volume'] = volume
+    turnover = np.add.reduceat(np.nan_to_num(base['vwap'] * base['volume']), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bars['vwap'] = np.where(volume > 0, turnover / volume, np.nan)
+    return bars[counts == seconds // baseSeconds]
+
+
+def bin_seconds(binSize):
+    """'5m' -> 300, '4h' -> 14400, '1d' -> 86400."""
+    return int(binSize[:-1]) * UNIT_SECONDS[binSize[-1]]
+
+
+def format_timestamp(seconds):
+    return datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%dT%H:%M:%S.000Z')
@@ -0,0 +1,54 @@
+"""Dead man's switch: keeps BitMEX's order/cancelAllAfter timer armed while the order loop is alive."""
+from __future__ import absolute_import
+import logging
+import threading
+import time
+
+logger = logging.getLogger('root')
+
+
+class Heartbeat(object):
+
+    """Re-arms cancelAllAfter every `interval` seconds from its own thread, with a `timeout` in seconds.
+
+    The order loop calls `beat()` every tick. If it stops ticking for `timeout` seconds, the heartbeat stops re-arming
+    and the exchange cancels every order on the account, however the process died or hung.
+    """
+
+    def __init__(self, bitmex, timeout, interval):
+        self.bitmex = bitmex
+        self.timeout = timeout
+        self.interval = interval
+        self.alive = time.time()
+        self.stalled = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='Heartbeat')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def beat(self):
+        self.alive = time.time()
+
+    def run(self):
+        while not self.stopped.is_set():
+            idle = time.time() - self.alive
+            if idle < self.timeout:
+                if self.stalled:
+                    logger.info("Order loop is ticking again, re-arming cancelAllAfter.")
+                    self.stalled = False
+                try:
+                    self.bitmex.cancel_all_after(int(self.timeout * 1000))
+                except Exception as e:
+                    logger.warning("Unable to arm cancelAllAfter: %s", e)
+            elif not self.stalled:
+                logger.error("Order loop hasn't ticked for %.0fs. Letting cancelAllAfter cancel all orders.", idle)
+                self.stalled = True
+            self.stopped.wait(self.interval)
+
+    def stop(self, disarm=True):
+        """Stop re-arming. Unless `disarm` is False, also switch the exchange-side timer off."""
+        self.stopped.set()
+        # A request in flight could otherwise re-arm the timer after we disarm it.
+        self.thread.join(self.bitmex.timeout + 1)
+        if disarm:
+            self.bitmex.cancel_all_after(0)
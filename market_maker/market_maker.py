@@ -1,23 +1,22 @@
 # -*- coding: utf-8 -*- # 
 from __future__ import absolute_import
-from time import sleep
+from time import sleep, time
 import sys
 from datetime import datetime
-from os.path import getmtime
 import random
 import requests
 import atexit
+import functools
 import signal
-import talib
-import pandas as pd
-import numpy as np
-from market_maker import bitmex
-from market_maker.settings import settings
-from market_maker.utils import log, constants, errors, math
-
-# Used for reloading the bot - saves modified times of key files
+from concurrent import futures
+from market_maker import bitmex, heartbeat, snapshot, trailing
+from market_maker.strategy_executor import StrategyExecutor
+from market_maker.tick_context import TickContext
+from market_maker.trailing import trailing_amend
+from market_maker.settings import settings, settings_files, reload_settings, command_line_symbol
+from market_maker.utils import log, constants, errors, math, metrics, profiler, watcher
+
 import os
-watched_files_mtimes = [(f, getmtime(f)) for f in settings.WATCHED_FILES]
 
 
 #
@@ -27,20 +26,38 @@ logger = log.setup_custom_logger('root')
 
 
 class ExchangeInterface:
+
+    # Candle history loading in the background, see __init__
+    preloaded_candles = None
+    # Arrival time of the market data the current tick acts on, until its first order goes out
+    tick_data_received = None
+
     def __init__(self, dry_run=False):
         self.dry_run = dry_run
-        if len(sys.argv) > 1:
-            self.symbol = sys.argv[1]
-        else:
-            self.symbol = settings.SYMBOL
+        self.symbol = command_line_symbol() or settings.SYMBOL
         self.bitmex = bitmex.BitMEX(base_url=settings.BASE_URL, symbol=self.symbol,
                                     apiKey=settings.API_KEY, apiSecret=settings.API_SECRET,
                                     orderIDPrefix=settings.ORDERID_PREFIX, postOnly=settings.POST_ONLY,
-                                    timeout=settings.TIMEOUT)
+                                    timeout=settings.TIMEOUT, waitForWS=False)
+        self.strategy_executor = StrategyExecutor(settings.STRATEGY_POLICIES, mode=settings.STRATEGY_EXECUTOR,
+                                                  workers=settings.STRATEGY_WORKERS,
+                                                  deadline=settings.STRATEGY_DEADLINE,
+                                                  params=settings.STRATEGY_PARAMS)
+        self.candle_stores = None
+        # binSize -> Resampler building it from settings.CANDLE_BASE, see load_candles
+        self.resamplers = {}
+        # Getter results for the current tick, see start_tick
+        self.context = TickContext(self.bitmex.ws)
+
+        # Fetch the candle history (and import the indicator libraries) while the WS partials come down.
+        loader = futures.ThreadPoolExecutor(max_workers=1)
+        self.preloaded_candles = loader.submit(self.load_candles)
+        loader.shutdown(wait=False)
+        self.bitmex.wait_for_ws()
 
     def cancel_order(self, order):
         tickLog = self.get_instrument()['tickLog']
-        logger.info("Canceling: %s %d @ %.*f" % (order['side'], order['orderQty'], tickLog, order['price']))
+        logger.info("Canceling: %s %d @ %.*f", order['side'], order['orderQty'], tickLog, order['price'])
         while True:
             try:
                 self.bitmex.cancel(order['orderID'])
@@ -63,7 +80,7 @@ class ExchangeInterface:
         orders = self.bitmex.http_open_orders()
 
         for order in orders:
-            logger.info("Canceling: %s %d @ %.*f" % (order['side'], order['orderQty'], tickLog, order['price']))
+            logger.info("Canceling: %s %d @ %.*f", order['side'], order['orderQty'], tickLog, order['price'])
 
         if len(orders):
             self.bitmex.cancel([order['orderID'] for order in orders])
@@ -71,6 +88,9 @@ class ExchangeInterface:
         sleep(settings.API_REST_INTERVAL)
 
     def get_portfolio(self):
+        return self.context.get('get_portfolio', ('position', 'instrument'), self.calc_portfolio)
+
+    def calc_portfolio(self):
         contracts = settings.CONTRACTS
         portfolio = {}
         for symbol in contracts:
@@ -103,6 +123,9 @@ class ExchangeInterface:
 
     def calc_delta(self):
         """Calculate currency delta for portfolio"""
+        return self.context.get('calc_delta', ('position', 'instrument'), self.calc_portfolio_delta)
+
+    def calc_portfolio_delta(self):
         portfolio = self.get_portfolio()
         spot_delta = 0
         mark_delta = 0
@@ -133,36 +156,30 @@ class ExchangeInterface:
     def get_instrument(self, symbol=None):
         if symbol is None:
             symbol = self.symbol
-        return self.bitmex.instrument(symbol)
+        return self.context.get('get_instrument', ('instrument',), lambda: self.bitmex.instrument(symbol), symbol)
 
     def get_margin(self):
         if self.dry_run:
             return {'marginBalance': float(settings.DRY_BTC), 'availableFunds': float(settings.DRY_BTC)}
-        return self.bitmex.funds()
+        return self.context.get('get_margin', ('margin',), self.bitmex.funds)
 
     def get_orders(self):
         if self.dry_run:
             return []
-        return self.bitmex.open_orders()
+        return self.context.get('get_orders', ('order',), self.bitmex.open_orders)
 
     def get_highest_buy(self):
-        buys = [o for o in self.get_orders() if o['side'] == 'Buy']
-        if not len(buys):
-            return {'price': -2**32}
-        highest_buy = max(buys or [], key=lambda o: o['price'])
-        return highest_buy if highest_buy else {'price': -2**32}
+        highest_buy = None if self.dry_run else self.bitmex.own_orders().best('Buy')
+        return highest_buy or {'price': -2**32}
 
     def get_lowest_sell(self):
-        sells = [o for o in self.get_orders() if o['side'] == 'Sell']
-        if not len(sells):
-            return {'price': 2**32}
-        lowest_sell = min(sells or [], key=lambda o: o['price'])
-        return lowest_sell if lowest_sell else {'price': 2**32}  # ought to be enough for anyone
+        lowest_sell = None if self.dry_run else self.bitmex.own_orders().best('Sell')
+        return lowest_sell or {'price': 2**32}  # ought to be enough for anyone
 
     def get_position(self, symbol=None):
         if symbol is None:
             symbol = self.symbol
-        return self.bitmex.position(symbol)
+        return self.context.get('get_position', ('position',), lambda: self.bitmex.position(symbol), symbol)
     
     def get_market_depth(self, symbol=None):
         if symbol is None:
@@ -174,10 +191,11 @@ class ExchangeInterface:
             symbol = self.symbol
         return self.bitmex.market_depth_10(symbol)
     
-    def get_trade_bucket(self, binSize='5m', count=100, reverse=True):
+    def get_trade_bucket(self, binSize='5m', count=100, reverse=True, startTime=None):
         return self.bitmex.http_get_trade_bucket(binSize=binSize,
                                                  count=count,
-                                                 reverse=reverse)
+                                                 reverse=reverse,
+                                                 startTime=startTime)
     
     def get_quote_5m(self, symbol=None):
         if symbol is None:
@@ -214,8 +232,8 @@ class ExchangeInterface:
             elif trade.get('side') == 'Buy':
                 buy_size += trade.get('size', 0)
                 buy_price = trade.get('price', 0)
-        logger.info('sell_size: %s, buy_size: %s, sell_price: %s, buy_price: %s' %
-                    (sell_size, buy_size, sell_price, buy_price))
+        logger.info('sell_size: %s, buy_size: %s, sell_price: %s, buy_price: %s',
+                    sell_size, buy_size, sell_price, buy_price)
         return {
             'sell_size': sell_size,
             'buy_size': buy_size,
@@ -236,6 +254,7 @@ class ExchangeInterface:
     def get_ticker(self, symbol=None):
         if symbol is None:
             symbol = self.symbol
+        # Already a cached read of the WS top of book, see ws/top_of_book.py
         ticker = self.bitmex.ticker_data(symbol)
         self.current_price = ticker['mid']
         return ticker
@@ -244,6 +263,30 @@ class ExchangeInterface:
         """Check that websockets are still open."""
         return not self.bitmex.ws.exited
 
+    def feed_problem(self):
+        """Why the market data can't be trusted to quote on (see settings.MAX_FEED_LAG), or None."""
+        if settings.MAX_FEED_LAG is None:
+            return None
+        ws = self.bitmex.ws
+        if ws.lag > settings.MAX_FEED_LAG:
+            return "market data is arriving %.1fs behind the exchange" % ws.lag
+        unanswered = ws.ping_pending()
+        if unanswered > settings.MAX_FEED_LAG:
+            return "ping unanswered for %.1fs" % unanswered
+        silent = time() - ws.market_received if ws.market_received is not None else 0
+        if silent > settings.MAX_FEED_SILENCE:
+            return "no market data for %.0fs" % silent
+        return None
+
+    def cancel_entry_orders(self):
+        """Cancel our open orders except the stops and take-profits (execInst Close) protecting the position."""
+        if self.dry_run:
+            return
+        orders = [order for order in self.get_orders() if 'Close' not in (order.get('execInst') or '')]
+        logger.info("Canceling %d entry orders.", len(orders))
+        if orders:
+            self.bitmex.cancel([order['orderID'] for order in orders])
+
     def check_market_open(self):
         instrument = self.get_instrument()
         if instrument["state"] != "Open" and instrument["state"] != "Closed":
@@ -257,23 +300,36 @@ class ExchangeInterface:
             raise errors.MarketEmptyError("Orderbook is empty, cannot quote")
 
     def amend_bulk_orders(self, orders):
+        self.record_tick_to_order()
         if self.dry_run:
             return orders
         return self.bitmex.amend_bulk_orders(orders)
 
     def create_bulk_orders(self, orders):
+        self.record_tick_to_order()
         if self.dry_run:
             return orders
         return self.bitmex.create_bulk_orders(orders)
 
     def cancel_bulk_orders(self, orders):
+        self.record_tick_to_order()
         if self.dry_run:
             return orders
         return self.bitmex.cancel([order['orderID'] for order in orders])
+
+    def start_tick(self):
+        """Note when the newest market data arrived, for the tick_to_order latency, and start a new tick cache."""
+        self.tick_data_received = self.bitmex.ws.market_received
+        self.context.reset()
+
+    def record_tick_to_order(self):
+        if self.tick_data_received is not None:
+            metrics.observe('tick_to_order', time() - self.tick_data_received)
+            self.tick_data_received = None
     
     def calc_MACD(self, fastperiod=12, slowperiod=26, signalperiod=9):
-        ohlcv_candles = self.candles_5m
-        close_values = ohlcv_candles.close.values[::-1]
+        import talib
+        close_values = self.candles['5m']['close']
         macd, signal, hist = talib.MACD(close_values, 
                                         fastperiod = fastperiod, 
                                         slowperiod = slowperiod, 
@@ -284,532 +340,82 @@ class ExchangeInterface:
 
         return {'macd': macd, 'signal': signal, 'hist': hist,
                 'RSI': RSI, 'MOM': MOM}
-    
+
+    def load_candles(self):
+        """Fetch the candle series the policies read, as chronological columns per binSize."""
+        # Unused here, but importing it pulls in talib ahead of the first evaluation.
+        from market_maker import policies
+        from market_maker.candle_store import CandleStore, Resampler, parse_bars
+        base = settings.CANDLE_BASE if settings.CANDLE_STORE_DIR else None
+        if self.candle_stores is None and settings.CANDLE_STORE_DIR:
+            self.candle_stores = {binSize: CandleStore(settings.CANDLE_STORE_DIR, self.symbol, binSize)
+                                  for binSize in ([base] if base else settings.CANDLE_BIN_SIZES)}
+            self.resamplers = {binSize: Resampler(binSize, base, limit=settings.CANDLE_HISTORY)
+                               for binSize in settings.CANDLE_BIN_SIZES if base and binSize != base}
+
+        candles = {}
+        if base:
+            # One fetch; every other binSize is built from the base series.
+            store = self.candle_stores[base]
+            store.update(functools.partial(self.get_trade_bucket, binSize=base, reverse=False),
+                         history=settings.CANDLE_BASE_HISTORY, pause=settings.API_REST_INTERVAL)
+            series = store.columns(settings.CANDLE_BASE_HISTORY)
+            for binSize in settings.CANDLE_BIN_SIZES:
+                if binSize == base:
+                    candles[binSize] = store.columns(settings.CANDLE_HISTORY)
+                else:
+                    candles[binSize] = self.resamplers[binSize].update(series)
+            return candles
+
+        for binSize in settings.CANDLE_BIN_SIZES:
+            if self.candle_stores:
+                store = self.candle_stores[binSize]
+                store.update(functools.partial(self.get_trade_bucket, binSize=binSize, reverse=False),
+                             history=settings.CANDLE_HISTORY, pause=settings.API_REST_INTERVAL)
+                candles[binSize] = store.columns(settings.CANDLE_HISTORY)
+                continue
+            candles[binSize] = parse_bars(self.get_trade_bucket(binSize=binSize))
+        return candles
+
     def combination_strategy(self, ):
-        operator = 0
         try:
-            self.candles_1m = pd.DataFrame(self.get_trade_bucket(binSize='1m'))
-            self.candles_5m = pd.DataFrame(self.get_trade_bucket(binSize='5m'))
-            self.candles_1h = pd.DataFrame(self.get_trade_bucket(binSize='1h'))
-            self.candles_1d = pd.DataFrame(self.get_trade_bucket(binSize='1d'))
+            with metrics.timer('candle_load'):
+                if self.preloaded_candles is not None:
+                    preloaded, self.preloaded_candles = self.preloaded_candles, None
+                    self.candles = preloaded.result()
+                else:
+                    self.candles = self.load_candles()
         except Exception as e:
             logger.exception(e)
             return 0
-        
-        operator += self.policy_MACD()
-        
-        #operator += self.policy_EMA()
-        
-        #operator += self.policy_BBANDS_short()
-        
-        operator += self.policy_BBANDS_long()
-        
-        operator += self.policy_GUPPY()
-        
-        if operator >= 10 and self.price_limit(1) > 0:
+
+        price = self.get_ticker()['mid']
+        with metrics.timer('strategy_evaluation'):
+            signals = self.strategy_executor.evaluate(self.candles, price)
+        operator = sum(signals.values())
+
+        if operator >= 10 and self.strategy_executor.call('price_limit', self.candles, price, 1) > 0:
             return 1
-        elif operator <= -10 and self.price_limit(-1) < 0:
+        elif operator <= -10 and self.strategy_executor.call('price_limit', self.candles, price, -1) < 0:
             return -1
         return 0
-    
-    def volume_limit(self, volume):
-        volume_values = np.array(volume[::-1], dtype='f8')
-        volume_macd, volume_signal, volume_hist = \
-                             talib.MACD(volume_values, 
-                                        fastperiod = 12, 
-                                        slowperiod = 26, 
-                                        signalperiod = 9)
-        volume_hist_1 = volume_hist[-1]
-        volume_hist_2 = volume_hist[-2]
-        logger.info('volume_hist_1: %s, volume_hist_2: %s' %
-                    (volume_hist_1, volume_hist_2))
-        if volume_hist_1 > 0:
-            return True
-        return False
-    
-    def price_limit(self, flags):
-        '''
-            近期高位不做多，低位不做空
-        '''
-        close_values_1h = self.candles_1h.close.values[::-1]
-        EMA_PRICE = talib.EMA(close_values_1h, timeperiod=3)
-        logger.info('the 1h ema_3 is: %s' % EMA_PRICE[-1])
-        
-        if flags < 0 and self.current_price > EMA_PRICE[-1] - 50:
-            return -1
-        if flags > 0 and self.current_price < EMA_PRICE[-1] + 50:
-            return 1
-        return 0
-
-    def policy_GUPPY(self, ):
-        '''
-            顾比均线策略，选取3、5、8、10、12、15作为短期均线，
-            30、35、40、45、50、60位长期均线。
-            1. 1h看趋势，5m入场
-            2. 1h短期均线在长期均线上方则为多头趋势，否则为空头趋势
-            3. 5m如果短期穿过长期则为做多信号，要求短线展开
-            4. 5m volume MACD，hist正数代表放量，可以入场
-            5. 5m MACD的hist值处于正值为多头信号，反之空头
-        '''
-        logger.info('================begin GUPPY policy====================')
-        close_values_1h = self.candles_1h.close.values[::-1]
-        TREND_FAST_3 = talib.EMA(close_values_1h, timeperiod=3)
-        TREND_FAST_5 = talib.EMA(close_values_1h, timeperiod=5)
-        TREND_FAST_8 = talib.EMA(close_values_1h, timeperiod=8)
-        TREND_FAST_10 = talib.EMA(close_values_1h, timeperiod=10)
-        TREND_FAST_12 = talib.EMA(close_values_1h, timeperiod=12)
-        TREND_FAST_15 = talib.EMA(close_values_1h, timeperiod=15)
-        
-        TREND_SLOW_30 = talib.EMA(close_values_1h, timeperiod=30)
-        TREND_SLOW_35 = talib.EMA(close_values_1h, timeperiod=35)
-        TREND_SLOW_40 = talib.EMA(close_values_1h, timeperiod=40)
-        TREND_SLOW_45 = talib.EMA(close_values_1h, timeperiod=45)
-        TREND_SLOW_50 = talib.EMA(close_values_1h, timeperiod=50)
-        TREND_SLOW_60 = talib.EMA(close_values_1h, timeperiod=60)
-        
-        close_values_5m = self.candles_5m.close.values[::-1]
-        macd_5m, signal_5m, hist_5m = talib.MACD(close_values_5m, 
-                                        fastperiod = 12, 
-                                        slowperiod = 26, 
-                                        signalperiod = 9)
-        
-        volume_limit = self.volume_limit(self.candles_5m.volume.values)
-        
-        SIG_FAST_3 = talib.EMA(close_values_5m, timeperiod=3)
-        SIG_FAST_5 = talib.EMA(close_values_5m, timeperiod=5)
-        SIG_FAST_8 = talib.EMA(close_values_5m, timeperiod=8)
-        SIG_FAST_10 = talib.EMA(close_values_5m, timeperiod=10)
-        SIG_FAST_12 = talib.EMA(close_values_5m, timeperiod=12)
-        SIG_FAST_15 = talib.EMA(close_values_5m, timeperiod=15)
-        
-        SIG_SLOW_30 = talib.EMA(close_values_5m, timeperiod=30)
-        SIG_SLOW_35 = talib.EMA(close_values_5m, timeperiod=35)
-        SIG_SLOW_40 = talib.EMA(close_values_5m, timeperiod=40)
-        SIG_SLOW_45 = talib.EMA(close_values_5m, timeperiod=45)
-        SIG_SLOW_50 = talib.EMA(close_values_5m, timeperiod=50)
-        SIG_SLOW_60 = talib.EMA(close_values_5m, timeperiod=60)
-        
-        policy_data = {
-            'TREND_FAST': [TREND_FAST_3[-1],
-                           TREND_FAST_5[-1],
-                           TREND_FAST_8[-1],
-                           TREND_FAST_10[-1],
-                           TREND_FAST_12[-1],
-                           TREND_FAST_15[-1],
-                           ],
-            'TREND_SLOW': [TREND_SLOW_30[-1],
-                           TREND_SLOW_35[-1],
-                           TREND_SLOW_40[-1],
-                           TREND_SLOW_45[-1],
-                           TREND_SLOW_50[-1],
-                           TREND_SLOW_60[-1],
-                           ],
-            
-            'SIG_FAST': [SIG_FAST_3[-1],
-                           SIG_FAST_5[-1],
-                           SIG_FAST_8[-1],
-                           SIG_FAST_10[-1],
-                           SIG_FAST_12[-1],
-                           SIG_FAST_15[-1],
-                           ],
-            'SIG_SLOW': [SIG_SLOW_30[-1],
-                           SIG_SLOW_35[-1],
-                           SIG_SLOW_40[-1],
-                           SIG_SLOW_45[-1],
-                           SIG_SLOW_50[-1],
-                           SIG_SLOW_60[-1],
-                           ],
-            
-            'SIG_FAST_PRE': [SIG_FAST_3[-2],
-                           SIG_FAST_5[-2],
-                           SIG_FAST_8[-2],
-                           SIG_FAST_10[-2],
-                           SIG_FAST_12[-2],
-                           SIG_FAST_15[-2],
-                           ],
-            'SIG_SLOW_PRE': [SIG_SLOW_30[-2],
-                           SIG_SLOW_35[-2],
-                           SIG_SLOW_40[-2],
-                           SIG_SLOW_45[-2],
-                           SIG_SLOW_50[-2],
-                           SIG_SLOW_60[-2],
-                           ],
-            
-            'volume_limit': volume_limit,
-            'hist_5m': hist_5m[-1],
-            'trend': 0,
-            'exchange_sig': 0,
-            'operator': 0,
-        }
-        
-        def list_com(fast_list, slow_list):
-            '''
-                如果fast_list的所有值大于slow_list里的所有值，返回1
-                如果fast_list的所有值小于slow_list里的所有值，返回-1
-                其他返回0
-            '''
-            buy_tmp = 0
-            sell_tmp = 0
-            for fast in fast_list:
-                for slow in slow_list:
-                    if fast > slow:
-                        buy_tmp += 1
-                    else:
-                        sell_tmp += 1
-            
-            if buy_tmp == 36:
-                return 1
-            if sell_tmp == 36:
-                return -1
-            return 0
-        
-        def near_com(flags):
-            cross_sig = 0
-            pass_sig = 0
-            for i in range(-1, -21, -1):
-                slow_list = [
-                    SIG_SLOW_30[i],
-                    SIG_SLOW_35[i],
-                    SIG_SLOW_40[i],
-                    SIG_SLOW_45[i],
-                    SIG_SLOW_50[i],
-                    SIG_SLOW_60[i],
-                ]
-                fast_list = [
-                    SIG_FAST_3[i],
-                    SIG_FAST_5[i],
-                    SIG_FAST_8[i],
-                    SIG_FAST_10[i],
-                    SIG_FAST_12[i],
-                    SIG_FAST_15[i],
-                ]
-
-                if pass_sig==0 and list_com(fast_list, slow_list) == flags:
-                    pass_sig = abs(i)
-                    logger.info('pass_sig=%s:fast_list:%s,slow_list:%s' % (i, fast_list, slow_list))
-                if cross_sig==0 and list_com(fast_list, slow_list) == -flags:
-                    cross_sig = abs(i)
-                    logger.info('cross_sig=%s:fast_list:%s,slow_list:%s' % (i, fast_list, slow_list))
-            
-            if pass_sig and cross_sig and pass_sig < cross_sig:
-                return flags
-
-            return 0
-
-        logger.info('policy_data: %s' % policy_data)
-
-        if list_com(policy_data['TREND_FAST'], policy_data['TREND_SLOW']) > 0:
-            policy_data['trend'] = 1
-        elif list_com(policy_data['TREND_FAST'], policy_data['TREND_SLOW']) < 0:
-            policy_data['trend'] = -1
 
-        if policy_data['trend'] > 0 and volume_limit and \
-           policy_data['hist_5m'] > 2 and near_com(1) == 1:
-            # 做多信号
-            policy_data['exchange_sig'] = 1
 
-        if policy_data['trend'] < 0 and volume_limit and \
-           policy_data['hist_5m'] < -2 and near_com(-1) == -1:
-            # 做空信号
-            policy_data['exchange_sig'] = -1
-        
-        if policy_data['exchange_sig'] > 0:
-            logger.info('=========Buy Opportunity!=========')
-            policy_data['operator'] += 10
-        elif policy_data['exchange_sig'] < 0:
-            policy_data['operator'] -= 10
-            logger.info('=========Sell Opportunity!=========')
-        else:
-            logger.info('=========No Opportunity!=========')
-        logger.info('policy_data: %s' % policy_data)
-        logger.info('================end GUPPY policy====================')
-        return policy_data['operator']
-
-    
-    def policy_BBANDS_long(self, ):
-        '''
-            布林线，MACD，volume MACD混合策略（由于指标迟滞性，改为做反弹） 
-            1. 1h布林线，布林宽度BB width，宽度大于0.03时才入场，避免横盘（上轨-下轨）/中轨
-            2. 布林%B指标>1为多，小于<0为空。（收盘-下轨）/（上轨-下轨）
-            3. 1h MACD的hist值处于正值为多头趋势，反之空头
-            4. volume MACD，hist正数代表放量，可以入场
-            5. 所有指标使用1h线，100条
-            6. MACD参数为12，26，9
-        '''
-        logger.info('================begin BBANDS_long policy====================')
-        volume_values_1h = np.array(self.candles_1h.volume.values[::-1], dtype='f8')
-        volume_macd_1h, volume_signal_1h, volume_hist_1h = \
-                             talib.MACD(volume_values_1h, 
-                                        fastperiod = 12, 
-                                        slowperiod = 26, 
-                                        signalperiod = 9)
-        close_values_1h = self.candles_1h.close.values[::-1]
-        upper, middle, lower = \
-            talib.BBANDS(close_values_1h,
-                         timeperiod=20,
-                         # number of non-biased standard deviations from the mean
-                         nbdevup=2,
-                         nbdevdn=2,
-                         # Moving average type: simple moving average here
-                         matype=0)
-        macd_1h, signal_1h, hist_1h = talib.MACD(close_values_1h, 
-                                        fastperiod = 12, 
-                                        slowperiod = 26, 
-                                        signalperiod = 9)
-        ticker = self.get_ticker()
-        
-        policy_data = {
-            'volume_hist_1h': volume_hist_1h[-1],
-            'hist_1h': hist_1h[-1],
-            'upper': upper[-1],
-            'middle': middle[-1],
-            'lower': lower[-1],
-            'boll_w': (upper[-1] - lower[-1])/middle[-1],
-            'boll_b':  (close_values_1h[-1] - lower[-1])/(upper[-1] - lower[-1]),  
-            'exchange_sig': 0,
-            'operator': 0,
-            'price': ticker['mid']
-        }
-        if policy_data['volume_hist_1h'] > 0 and policy_data['hist_1h'] > 0 and \
-           policy_data['boll_w'] > 0.03 and policy_data['boll_b'] > 1.3:
-            # 做空
-            policy_data['exchange_sig'] = -1
-        if policy_data['volume_hist_1h'] > 0 and policy_data['hist_1h'] < 0 and \
-           policy_data['boll_w'] > 0.03 and policy_data['boll_b'] < -0.3:
-            # 做多
-            policy_data['exchange_sig'] = 1
-
-        if policy_data['exchange_sig'] > 0:
-            logger.info('=========Buy Opportunity!=========')
-            policy_data['operator'] += 10
-        elif policy_data['exchange_sig'] < 0:
-            policy_data['operator'] -= 10
-            logger.info('=========Sell Opportunity!=========')
-        else:
-            logger.info('=========No Opportunity!=========')
-        logger.info('policy_data: %s' % policy_data)
-        logger.info('================end BBANDS_long policy====================')
-        return policy_data['operator']
-    
-    
-    def policy_BBANDS_short(self, ):
-        '''
-            布林线短线策略
-            1. 5m BBAND 参数20，2，5m MACD 12，26，9
-            2. 价格处于下轨附近，并且开口较大（宽度大于0.01），MACD出现金叉，且第二根hist值大于3，则做多
-            3. 反之做空
-            4. 5m放量才入场
-        '''
-        logger.info('================begin BBANDS_short policy====================')
-        
-        volume_limit = self.volume_limit(self.candles_1m.volume.values)
-        
-        close_values_5m = self.candles_1m.close.values[::-1]
-        upper, middle, lower = \
-            talib.BBANDS(close_values_5m,
-                         timeperiod=20,
-                         # number of non-biased standard deviations from the mean
-                         nbdevup=2,
-                         nbdevdn=2,
-                         # Moving average type: simple moving average here
-                         matype=0)
-        macd_5m, signal_5m, hist_5m = talib.MACD(close_values_5m, 
-                                        fastperiod = 12, 
-                                        slowperiod = 26, 
-                                        signalperiod = 9)
-        ticker = self.get_ticker()
-        policy_data = {
-            'upper': upper[-1],
-            'middle': middle[-1],
-            'lower': lower[-1],
-            'hist_5m_5': hist_5m[-5],
-            'hist_5m_4': hist_5m[-4],
-            'hist_5m_3': hist_5m[-3],
-            'hist_5m_2': hist_5m[-2],
-            'hist_5m_1': hist_5m[-1],
-            'volume_limit': volume_limit,
-            'boll_w': (upper[-1] - lower[-1])/middle[-1],
-            'boll_b':  (close_values_5m[-1] - lower[-1])/(upper[-1] - lower[-1]),  
-            'exchange_sig': 0,
-            'operator': 0,
-            'price': ticker['mid']
-        }
-        if policy_data['hist_5m_2'] < 0 and policy_data['hist_5m_1'] < 0 and \
-           policy_data['hist_5m_5'] > policy_data['hist_5m_4'] and \
-           policy_data['hist_5m_4'] > policy_data['hist_5m_3'] and \
-           policy_data['hist_5m_3'] > policy_data['hist_5m_2'] and \
-           policy_data['hist_5m_2'] > policy_data['hist_5m_1'] and \
-           abs(policy_data['hist_5m_1']) > 1 and policy_data['hist_5m_3'] > 0 and\
-           policy_data['boll_w'] > 0.005 and volume_limit:
-            # 做空
-            policy_data['exchange_sig'] = -1
-        if policy_data['hist_5m_2'] > 0 and policy_data['hist_5m_1'] > 0 and \
-           policy_data['hist_5m_5'] < policy_data['hist_5m_4'] and \
-           policy_data['hist_5m_4'] < policy_data['hist_5m_3'] and \
-           policy_data['hist_5m_3'] < policy_data['hist_5m_2'] and \
-           policy_data['hist_5m_2'] < policy_data['hist_5m_1'] and \
-           abs(policy_data['hist_5m_1']) > 1 and policy_data['hist_5m_3'] < 0 and\
-           policy_data['boll_w'] > 0.005 and volume_limit:
-            # 做多
-            policy_data['exchange_sig'] = 1
-    
-        if policy_data['exchange_sig'] > 0:
-            logger.info('=========Buy Opportunity!=========')
-            policy_data['operator'] += 10
-        elif policy_data['exchange_sig'] < 0:
-            policy_data['operator'] -= 10
-            logger.info('=========Sell Opportunity!=========')
-        else:
-            logger.info('=========No Opportunity!=========')
-        
-        logger.info('policy_data: %s' % policy_data)  
-        logger.info('================end BBANDS_short policy====================')
-        return policy_data['operator']
-    
-    def policy_MACD(self):
-        '''
-            1. 1d MACD看长线趋势，hist连着3次上涨为多头趋势，否则为空头
-            2. 1h MACD看短线趋势，hist连着5次上涨为多头趋势，否则为空头
-            3. 5m MACD为入场信号，macd近期出现（3根柱子以内）金叉为做多信号，
-               且hist连着3次上涨，且当前hist大于1，否则做空。
-            4. 金叉标准：macd上穿signal，且hist为正。
-            5. 死叉标准：macd下穿signal，且hist为负。
-            6. 5m放量入场
-        '''
-
-        logger.info('================begin MACD Comp policy====================')
-        close_values_1d = self.candles_1d.close.values[::-1]
-        macd_1d, signal_1d, hist_1d = talib.MACD(close_values_1d, 
-                                        fastperiod = 12, 
-                                        slowperiod = 26, 
-                                        signalperiod = 9)
-        close_values_1h = self.candles_1h.close.values[::-1]
-        macd_1h, signal_1h, hist_1h = talib.MACD(close_values_1h, 
-                                        fastperiod = 12, 
-                                        slowperiod = 26, 
-                                        signalperiod = 9)
-        close_values_5m = self.candles_5m.close.values[::-1]
-        macd_5m, signal_5m, hist_5m = talib.MACD(close_values_5m, 
-                                        fastperiod = 12, 
-                                        slowperiod = 26, 
-                                        signalperiod = 9)
-        
-        volume_limit = self.volume_limit(self.candles_5m.volume.values)
-    
-        policy_data = {
-            'hist_1d_3': hist_1d[-3],
-            'hist_1d_2': hist_1d[-2],
-            'hist_1d_1': hist_1d[-1],
-            'hist_1h_5': hist_1h[-5],
-            'hist_1h_4': hist_1h[-4],
-            'hist_1h_3': hist_1h[-3],
-            'hist_1h_2': hist_1h[-2],
-            'hist_1h_1': hist_1h[-1],
-            'macd_5m_4': macd_5m[-4],
-            'macd_5m_3': macd_5m[-3],
-            'macd_5m_2': macd_5m[-2],
-            'macd_5m_1': macd_5m[-1],
-            'signal_5m_4': signal_5m[-4],
-            'signal_5m_3': signal_5m[-3],
-            'signal_5m_2': signal_5m[-2],
-            'signal_5m_1': signal_5m[-1],
-            'hist_5m_4': hist_5m[-4],
-            'hist_5m_3': hist_5m[-3],
-            'hist_5m_2': hist_5m[-2],
-            'hist_5m_1': hist_5m[-1],
-            'volume_limit': volume_limit,
-            'long_trend': 0,
-            'short_trend': 0,
-            'exchange_sig': 0,
-            'operator': 0
-        }
-        
-        # 长线趋势判断
-        if policy_data['hist_1d_3'] > policy_data['hist_1d_2'] and \
-           policy_data['hist_1d_2'] > policy_data['hist_1d_1']:
-            # 长线空头趋势
-            policy_data['long_trend'] = -1
-        if policy_data['hist_1d_3'] < policy_data['hist_1d_2'] and \
-           policy_data['hist_1d_2'] < policy_data['hist_1d_1']:
-            # 长线多头趋势
-            policy_data['long_trend'] = 1
-        if policy_data['hist_1h_3'] > policy_data['hist_1h_2'] and \
-           policy_data['hist_1h_2'] > policy_data['hist_1h_1']:
-            # 短线空头趋势
-            policy_data['short_trend'] = -1
-        if policy_data['hist_1h_3'] < policy_data['hist_1h_2'] and \
-           policy_data['hist_1h_2'] < policy_data['hist_1h_1']:
-            # 短线多头趋势
-            policy_data['short_trend'] = 1
-        
-        if policy_data['hist_5m_4'] > 0 and \
-           policy_data['hist_5m_1'] < 0 and \
-           policy_data['hist_5m_3'] > policy_data['hist_5m_2'] and \
-           policy_data['hist_5m_2'] > policy_data['hist_5m_1'] and \
-           policy_data['hist_5m_1'] < -1 and policy_data['short_trend'] < 0 and \
-           policy_data['long_trend'] < 0 and volume_limit:
-            # 空头信号
-            policy_data['exchange_sig'] = -1
-        if policy_data['hist_5m_4'] < 0 and \
-           policy_data['hist_5m_1'] > 0 and \
-           policy_data['hist_5m_3'] < policy_data['hist_5m_2'] and \
-           policy_data['hist_5m_2'] < policy_data['hist_5m_1'] and \
-           policy_data['hist_5m_1'] > 1 and policy_data['short_trend'] > 0 and \
-           policy_data['long_trend'] > 0 and volume_limit:
-            # 多头信号
-            policy_data['exchange_sig'] = 1
-        
-        if policy_data['exchange_sig'] > 0:
-            logger.info('=========Buy Opportunity!=========')
-            policy_data['operator'] += 10
-        elif policy_data['exchange_sig'] < 0:
-            policy_data['operator'] -= 10
-            logger.info('=========Sell Opportunity!=========')
-        else:
-            logger.info('=========No Opportunity!=========')
-
-        logger.info('policy_data: %s' % policy_data)  
-        logger.info('================end MACD Comp policy====================')
-        return policy_data['operator']
-    
-    def policy_EMA(self):
-        '''
-            1. H1周期的EMA5与EMA80作为趋势判断，EMA5大于EMA80为做多趋势，EMA小于EMA80为做空趋势
-            2. M5周期EMA5上穿EMA80为做多信号，需与1趋势相同；
-            3. M5周期EMA5下穿EMA80为做空信号，需与1趋势相同；
-        '''
-        close_values_1h = self.candles_1h.close.values[::-1]
-        EMA_FAST_1h = talib.EMA(close_values_1h, timeperiod=5)
-        EMA_SLOW_1h = talib.EMA(close_values_1h, timeperiod=80)
-        
-        close_values_5m = self.candles_5m.close.values[::-1]
-        EMA_FAST_5m = talib.EMA(close_values_5m, timeperiod=5)
-        EMA_SLOW_5m = talib.EMA(close_values_5m, timeperiod=80)
-
-        logger.info('================begin EMA policy====================')
-        logger.info('EMA_FAST_1h[-1]: %s, EMA_SLOW_1h[-1]: %s,'
-                    'EMA_FAST_5m[-2]: %s, EMA_SLOW_5m[-2]: %s,'
-                    'EMA_FAST_5m[-1]: %s, EMA_SLOW_5m[-1]: %s' %
-                    (EMA_FAST_1h[-1], EMA_SLOW_1h[-1], EMA_FAST_5m[-2],
-                     EMA_SLOW_5m[-2], EMA_FAST_5m[-1], EMA_SLOW_5m[-1]))
-        if EMA_FAST_1h[-1] > EMA_SLOW_1h[-1] and \
-           EMA_FAST_5m[-2] < EMA_SLOW_5m[-2] and \
-           EMA_FAST_5m[-1] > EMA_SLOW_5m[-1]:
-            # buy
-            logger.info('=========Buy Opportunity!=========')
-            return 10
-        if EMA_FAST_1h[-1] < EMA_SLOW_1h[-1] and \
-           EMA_FAST_5m[-2] > EMA_SLOW_5m[-2] and \
-           EMA_FAST_5m[-1] < EMA_SLOW_5m[-1]:
-            # sell
-            logger.info('=========Sell Opportunity!=========')
-            return -10
-        logger.info('=========No Opportunity!=========')
-        logger.info('================end EMA policy====================')
-        return 0
+class OrderManager:
 
+    # Set by restart(): exit leaves our orders resting and saves a snapshot for the next process to adopt, then
+    # re-executes the bot so that process is guaranteed to exist.
+    restarting = False
+    # Dead man's switch, see settings.CANCEL_ALL_AFTER
+    heartbeat = None
+    # Trails stop and take-profit orders from the WS thread, see settings.TRAILING_STOPS
+    trailing = None
+    # exit() runs from the SIGTERM handler and again from atexit; only the first call does anything. A second
+    # SIGTERM during shutdown returns into the shutdown already running rather than cutting it short.
+    exited = False
+    # Set while the feed is stale and our entry orders are pulled, see sanity_check
+    quotes_pulled = False
 
-class OrderManager:
     def __init__(self):
         self.exchange = ExchangeInterface(settings.DRY_RUN)
         # Once exchange is created, register exit handler that will always cancel orders
@@ -817,7 +423,7 @@ class OrderManager:
         atexit.register(self.exit)
         signal.signal(signal.SIGTERM, self.exit)
 
-        logger.info("Using symbol %s." % self.exchange.symbol)
+        logger.info("Using symbol %s.", self.exchange.symbol)
 
         if settings.DRY_RUN:
             logger.info("Initializing dry run. Orders printed below represent what would be posted to BitMEX.")
@@ -828,11 +434,30 @@ class OrderManager:
         self.instrument = self.exchange.get_instrument()
         self.starting_qty = self.exchange.get_delta()
         self.running_qty = self.starting_qty
+        self.last_summary = time()
+        if settings.CANCEL_ALL_AFTER and not settings.DRY_RUN:
+            self.heartbeat = heartbeat.Heartbeat(self.exchange.bitmex, settings.CANCEL_ALL_AFTER,
+                                                 settings.HEARTBEAT_INTERVAL)
+        if settings.TRAILING_STOPS and not settings.DRY_RUN:
+            self.trailing = trailing.TrailingStops(self.exchange.bitmex)
+        # Settings reloaded by the file watcher, swapped in at the start of the next tick
+        self.pending_settings = None
+        self.restart_requested = False
+        self.watcher = watcher.FileWatcher(set(settings.WATCHED_FILES + settings_files), self.on_file_change)
+        self.restore_state()
+        if settings.METRICS_PORT:
+            metrics.serve(settings.METRICS_PORT)
+            logger.info("Serving latency metrics on http://127.0.0.1:%d/metrics", settings.METRICS_PORT)
+        self.profiler = profiler.Profiler(settings.PROFILE_OUTPUT, settings.PROFILE_INTERVAL,
+                                          settings.PROFILE_FLAG_FILE)
+        if hasattr(signal, 'SIGUSR2'):
+            signal.signal(signal.SIGUSR2, self.profiler.toggle)
         #self.reset()
 
     def reset(self):
         self.exchange.cancel_all_orders()
-        self.sanity_check()
+        if not self.sanity_check():
+            return
         self.print_status()
 
         # Create orders and converge.
@@ -847,17 +472,17 @@ class OrderManager:
         tickLog = self.exchange.get_instrument()['tickLog']
         self.start_XBt = margin["marginBalance"]
         
-        logger.info("Current XBT Balance: %.6f" % XBt_to_XBT(self.start_XBt))
-        logger.info("Current Contract Position: %d" % self.running_qty)
+        logger.info("Current XBT Balance: %.6f", XBt_to_XBT(self.start_XBt))
+        logger.info("Current Contract Position: %d", self.running_qty)
         if settings.CHECK_POSITION_LIMITS:
-            logger.info("Position limits: %d/%d" % (settings.MIN_POSITION, settings.MAX_POSITION))
+            logger.info("Position limits: %d/%d", settings.MIN_POSITION, settings.MAX_POSITION)
         if position['currentQty'] != 0:
-            logger.info("Avg Cost Price: %.*f" % (tickLog, float(position['avgCostPrice'])))
-            logger.info("Avg Entry Price: %.*f" % (tickLog, float(position['avgEntryPrice'])))
-        logger.info("Contracts Traded This Run: %d" % (self.running_qty - self.starting_qty))
-        logger.info("Total Contract Delta: %.4f XBT" % self.exchange.calc_delta()['spot'])
+            logger.info("Avg Cost Price: %.*f", tickLog, float(position['avgCostPrice']))
+            logger.info("Avg Entry Price: %.*f", tickLog, float(position['avgEntryPrice']))
+        logger.info("Contracts Traded This Run: %d", self.running_qty - self.starting_qty)
+        logger.info("Total Contract Delta: %.4f XBT", self.exchange.calc_delta()['spot'])
         logger.info("==============================================")
-        logger.info("Current Depth: %s" % self.exchange.get_market_depth_10())
+        logger.info("Current Depth: %s", self.exchange.get_market_depth_10())
         #logger.info("Current trade_current: %s" % self.exchange.get_trade_current())
         #logger.info("Current trade_1m: %s" % self.exchange.get_trade_1m())
         #logger.info("Current trade_5m: %s" % self.exchange.get_trade_5m())
@@ -865,7 +490,7 @@ class OrderManager:
         #logger.info("Current trade_1h: %s" % self.exchange.get_trade_1h())
         #logger.info("Current quote_1h: %s" % self.exchange.get_quote_1h())
         logger.info("==============================================")
-        logger.info("Current get_position: %s" % self.exchange.get_position())
+        logger.info("Current get_position: %s", self.exchange.get_position())
         #logger.info("Current get_trade_bucket: %s" % self.exchange.get_trade_bucket())
         #logger.info("Current calc_MACD: %s" % self.exchange.calc_MACD())
 
@@ -896,12 +521,11 @@ class OrderManager:
         # Midpoint, used for simpler order placement.
         self.start_position_mid = ticker["mid"]
         logger.info(
-            "%s Ticker: Buy: %.*f, Sell: %.*f" %
-            (self.instrument['symbol'], tickLog, ticker["buy"], tickLog, ticker["sell"])
+            "%s Ticker: Buy: %.*f, Sell: %.*f",
+            self.instrument['symbol'], tickLog, ticker["buy"], tickLog, ticker["sell"]
         )
-        logger.info('Start Positions: Buy: %.*f, Sell: %.*f, Mid: %.*f' %
-                    (tickLog, self.start_position_buy, tickLog, self.start_position_sell,
-                     tickLog, self.start_position_mid))
+        logger.info('Start Positions: Buy: %.*f, Sell: %.*f, Mid: %.*f',
+                    tickLog, self.start_position_buy, tickLog, self.start_position_sell, tickLog, self.start_position_mid)
         return ticker
 
     def get_price_offset(self, index):
@@ -951,7 +575,7 @@ class OrderManager:
         #quote_5m = self.exchange.get_quote_5m()
         #quote_1h = self.exchange.get_quote_1h()
         portfolio = self.exchange.get_portfolio()
-        logger.info('portfolio: %s' % portfolio)
+        logger.info('portfolio: %s', portfolio)
         current_trade_info = self.exchange.calc_trade_side()
 
         bids_num = 0
@@ -976,10 +600,10 @@ class OrderManager:
                 bid_ask_sig = 'buy'
             logger.info('bids_num: %s, asks_num: %s, bid_one: %s, '
                         'ask_one: %s, markPrice: %s, lastPrice: %s, '
-                        'bid_ask_sig: %s' %
-                        (bids_num, asks_num, bids[0][1], asks[0][1],
-                         portfolio['XBTUSD'].get('markPrice'),
-                         self.start_position_mid, bid_ask_sig))
+                        'bid_ask_sig: %s',
+                        bids_num, asks_num, bids[0][1], asks[0][1],
+                        portfolio['XBTUSD'].get('markPrice'),
+                        self.start_position_mid, bid_ask_sig)
         else:
             return
         bid_ask_sig = ''
@@ -1001,7 +625,7 @@ class OrderManager:
         position = self.exchange.get_position()
         if not position:
             return
-        logger.info('orders: %s' % orders)
+        logger.info('orders: %s', list(orders))
         if position.get('isOpen'):
             position_price = position.get('avgEntryPrice')
             liquidation_price = position.get('liquidationPrice')
@@ -1011,7 +635,8 @@ class OrderManager:
                 open_side = 'buy'
             else:
                 open_side = 'sell'
-            self.update_stop_limit_order(position_price)
+            if not self.trailing:
+                self.update_stop_limit_order(position_price)
         elif orders:
             limit_order = []
             for i in range(len(orders)):
@@ -1059,49 +684,23 @@ class OrderManager:
                 if order_stop:
                     self.exchange.create_bulk_orders(order_stop)
                     sleep(3)
-                logger.info('========Order update!===order_stop:%s, order_limit%s===' %
-                            (order_stop, order_limit))
+                logger.info('========Order update!===order_stop:%s, order_limit%s===',
+                            order_stop, order_limit)
     
 
     def update_stop_limit_order(self, position_price, open_side=None,
                                 quantity=None):
         exist_orders = self.exchange.get_orders()
-        new_limit_price = 0
-        new_stop_price = 0
         update_orders = []
-        logger.info('update_stop_limit_order, exist_orders: %s' % exist_orders)
+        logger.info('update_stop_limit_order, exist_orders: %s', exist_orders)
         for order in exist_orders:
-            # kong dan zhi ying
-            if order.get('ordType') == 'Limit' and order.get('side') == 'Buy':
-                sell_limit = self.start_position_mid - settings.ORDER_LIMIT_STEP
-                if sell_limit < order.get('price'):
-                    update_orders.append({'orderID': order.get('orderID'),
-                                          'price': sell_limit-10})
-            # kong dan zhi sun
-            if order.get('ordType') == 'Stop' and order.get('side') == 'Buy':
-                move_con = position_price - self.start_position_mid
-                if move_con >= settings.ORDER_MOVE_CONDITION and \
-                   order.get('stopPx') - self.start_position_mid > settings.ORDER_STOP_STEP:
-                    new_stop_price = self.start_position_mid + settings.ORDER_STOP_STEP
-                    update_orders.append({'orderID': order.get('orderID'),
-                                          'stopPx': new_stop_price}) 
-            # duo dan zhi ying
-            if order.get('ordType') == 'Limit' and order.get('side') == 'Sell':
-                buy_limit = self.start_position_mid + settings.ORDER_LIMIT_STEP
-                if buy_limit > order.get('price'):
-                    update_orders.append({'orderID': order.get('orderID'),
-                                          'price': buy_limit+10})
-            # duo dan zhi sun
-            if order.get('ordType') == 'Stop' and order.get('side') == 'Sell':
-                move_con = self.start_position_mid - position_price
-                if move_con >= settings.ORDER_MOVE_CONDITION and \
-                   self.start_position_mid - order.get('stopPx') > settings.ORDER_STOP_STEP:
-                    new_stop_price = self.start_position_mid - settings.ORDER_STOP_STEP
-                    update_orders.append({'orderID': order.get('orderID'),
-                                          'stopPx': new_stop_price})                    
+            amend = trailing_amend(order, position_price, self.start_position_mid)
+            if amend:
+                amend['orderID'] = order.get('orderID')
+                update_orders.append(amend)
         if update_orders:
             self.exchange.amend_bulk_orders(update_orders)
-            logger.info('Update orders: %s' % update_orders)
+            logger.info('Update orders: %s', update_orders)
     
     def market_order(self, index):
         quantity = settings.ORDER_START_SIZE
@@ -1257,12 +856,13 @@ class OrderManager:
         if len(to_amend) > 0:
             for amended_order in reversed(to_amend):
                 reference_order = [o for o in existing_orders if o['orderID'] == amended_order['orderID']][0]
-                logger.info("Amending %4s: %d @ %.*f to %d @ %.*f (%+.*f)" % (
+                logger.info(
+                    "Amending %4s: %d @ %.*f to %d @ %.*f (%+.*f)",
                     amended_order['side'],
                     reference_order['leavesQty'], tickLog, reference_order['price'],
                     (amended_order['orderQty'] - reference_order['cumQty']), tickLog, amended_order['price'],
                     tickLog, (amended_order['price'] - reference_order['price'])
-                ))
+                )
             # This can fail if an order has closed in the time we were processing.
             # The API will send us `invalid ordStatus`, which means that the order's status (Filled/Canceled)
             # made it not amendable.
@@ -1280,16 +880,16 @@ class OrderManager:
                     sys.exit()
 
         if len(to_create) > 0:
-            logger.info("Creating %d orders:" % (len(to_create)))
+            logger.info("Creating %d orders:", len(to_create))
             for order in reversed(to_create):
-                logger.info("%4s %d @ %.*f" % (order['side'], order['orderQty'], tickLog, order['price']))
+                logger.info("%4s %d @ %.*f", order['side'], order['orderQty'], tickLog, order['price'])
             self.exchange.create_bulk_orders(to_create)
 
         # Could happen if we exceed a delta limit
         if len(to_cancel) > 0:
-            logger.info("Canceling %d orders:" % (len(to_cancel)))
+            logger.info("Canceling %d orders:", len(to_cancel))
             for order in reversed(to_cancel):
-                logger.info("%4s %d @ %.*f" % (order['side'], order['leavesQty'], tickLog, order['price']))
+                logger.info("%4s %d @ %.*f", order['side'], order['leavesQty'], tickLog, order['price'])
             self.exchange.cancel_bulk_orders(to_cancel)
 
     ###
@@ -1315,7 +915,19 @@ class OrderManager:
     ##
 
     def sanity_check(self):
-        """Perform checks before placing orders."""
+        """Perform checks before placing orders. Returns False if we shouldn't quote this tick."""
+
+        # Don't quote on stale prices: pull the entry orders until the feed catches up.
+        problem = self.exchange.feed_problem()
+        if problem:
+            if not self.quotes_pulled:
+                logger.error("Stale market data (%s), pulling quotes.", problem)
+                self.exchange.cancel_entry_orders()
+                self.quotes_pulled = True
+            return False
+        if self.quotes_pulled:
+            logger.info("Market data is fresh again, quoting.")
+            self.quotes_pulled = False
 
         # Check if OB is empty - if so, can't quote.
         self.exchange.check_if_orderbook_empty()
@@ -1337,40 +949,143 @@ class OrderManager:
         # Messaging if the position limits are reached
         if self.long_position_limit_exceeded():
             logger.info("Long delta limit exceeded")
-            logger.info("Current Position: %.f, Maximum Position: %.f" %
-                        (self.exchange.get_delta(), settings.MAX_POSITION))
+            logger.info("Current Position: %.f, Maximum Position: %.f",
+                        self.exchange.get_delta(), settings.MAX_POSITION)
 
         if self.short_position_limit_exceeded():
             logger.info("Short delta limit exceeded")
-            logger.info("Current Position: %.f, Minimum Position: %.f" %
-                        (self.exchange.get_delta(), settings.MIN_POSITION))
+            logger.info("Current Position: %.f, Minimum Position: %.f",
+                        self.exchange.get_delta(), settings.MIN_POSITION)
+        return True
 
     ###
     # Running
     ###
 
+    def on_file_change(self, path):
+        """Watcher thread: load a changed settings file, or ask for a restart if code changed."""
+        if path not in map(os.path.abspath, settings_files):
+            logger.info("%s changed, restarting.", path)
+            self.restart_requested = True
+            return
+        try:
+            values, problems, restart = reload_settings()
+        except Exception as e:
+            logger.error("Not reloading settings, %s has an error: %s", path, e)
+            return
+        if problems:
+            logger.error("Not reloading settings from %s: %s", path, '; '.join(problems))
+        elif restart:
+            logger.info("%s changed, restarting.", ', '.join(restart))
+            self.restart_requested = True
+        else:
+            self.pending_settings = values
+
     def check_file_change(self):
-        """Restart if any files we're watching have changed."""
-        for f, mtime in watched_files_mtimes:
-            if getmtime(f) > mtime:
-                self.restart()
+        """Swap in settings reloaded since the last tick, and restart if any other watched file changed."""
+        values, self.pending_settings = self.pending_settings, None
+        if values is not None:
+            changed = sorted(key for key, value in values.items()
+                             if key.isupper() and settings.get(key) != value)
+        # Nothing to do when the file went back to the values in effect, e.g. after a rejected edit was reverted.
+        if values is not None and changed:
+            settings.swap(values)
+            executor = self.exchange.strategy_executor
+            executor.params = settings.STRATEGY_PARAMS or {}
+            executor.deadline = settings.STRATEGY_DEADLINE
+            logger.info("Reloaded settings: %s", ', '.join('%s=%r' % (key, values[key]) for key in changed))
+        if self.restart_requested:
+            self.restart()
 
     def check_connection(self):
         """Ensure the WS connections are still open."""
         return self.exchange.is_open()
 
-    def exit(self):
+    def save_state(self):
+        """Snapshot our resting orders and strategy state for the next process. Returns the orders kept."""
+        orders = [snapshot.order_state(order) for order in self.exchange.get_orders()]
+        snapshot.save(settings.STATE_FILE, {
+            'symbol': self.exchange.symbol,
+            'start_time': self.start_time.isoformat(),
+            'starting_qty': self.starting_qty,
+            'orders': orders,
+            'signals': self.exchange.strategy_executor.signals,
+        })
+        return orders
+
+    def restore_state(self):
+        """Pick up the snapshot a restart left behind, adopting the orders that are still open."""
+        if not settings.STATE_FILE:
+            return
+        state = snapshot.load(settings.STATE_FILE, settings.STATE_MAX_AGE)
+        if state is None or state.get('symbol') != self.exchange.symbol:
+            return
+        self.start_time = datetime.fromisoformat(state['start_time'])
+        self.starting_qty = state['starting_qty']
+        signals = self.exchange.strategy_executor.signals
+        for name, value in state['signals'].items():
+            if name in signals:
+                signals[name] = value
+
+        adopted, gone, unknown = snapshot.adopt(state['orders'], self.exchange.get_orders())
+        logger.info("Resumed from %s: adopted %d open orders, %d filled or cancelled since, %d not in the snapshot.",
+                    settings.STATE_FILE, len(adopted), len(gone), len(unknown))
+        for order in gone:
+            logger.info("No longer open: %s %s %s @ %s", order['clOrdID'], order['side'], order.get('orderQty'),
+                        order.get('price', order.get('stopPx')))
+        os.remove(settings.STATE_FILE)
+
+    def exit(self, *args):
+        if self.exited:
+            return
+        self.exited = True
+        if self.trailing:
+            self.trailing.stop()
+        if self.restarting and settings.STATE_FILE:
+            try:
+                orders = self.save_state()
+                logger.info("Restarting. Leaving %d open orders for the next process to adopt.", len(orders))
+                if self.heartbeat:
+                    # Left armed: if the next process doesn't come up in time, the orders are cancelled.
+                    self.heartbeat.stop(disarm=False)
+                self.exchange.strategy_executor.shutdown()
+                self.exchange.bitmex.exit()
+                self.reexec()
+                # Only reached if the exec failed: nothing will adopt the orders.
+                self.restarting = False
+            except Exception as e:
+                logger.info("Unable to save state, cancelling orders instead: %s", e)
+
         logger.info("Shutting down. All open orders will be cancelled.")
         try:
+            self.exchange.strategy_executor.shutdown()
+            if self.heartbeat:
+                # Stop re-arming but leave the timer armed, so the orders still go if the cancel below fails.
+                self.heartbeat.stop(disarm=False)
             self.exchange.cancel_all_orders()
+            if self.heartbeat:
+                self.exchange.bitmex.cancel_all_after(0)
             self.exchange.bitmex.exit()
         except errors.AuthenticationError as e:
             logger.info("Was not authenticated; could not cancel orders.")
         except Exception as e:
-            logger.info("Unable to cancel orders: %s" % e)
+            logger.info("Unable to cancel orders: %s", e)
 
+        if self.restarting:
+            self.reexec()
         sys.exit()
 
+    def reexec(self):
+        """Replace this process with a fresh one running the same command line."""
+        logger.info("Starting a new process: %s %s", sys.executable, ' '.join(sys.argv))
+        # The writer thread doesn't survive the exec; flush what it still has queued.
+        log.stop_listener()
+        try:
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+        except OSError as e:
+            # The log writer is stopped by now
+            sys.stderr.write("Unable to start a new process: %s\n" % e)
+
     def run_loop(self):
         while True:
             sys.stdout.write("-----\n")
@@ -1385,14 +1100,41 @@ class OrderManager:
                 logger.error("Realtime data connection unexpectedly closed, restarting.")
                 self.restart()
 
-            self.sanity_check()  # Ensures health of mm - several cut-out points here
-            self.print_status()  # Print skew, delta, etc
-            self.place_orders()  # Creates desired orders and converges to existing orders
+            self.exchange.start_tick()
+            if self.heartbeat:
+                self.heartbeat.beat()
+            if settings.METRICS_SUMMARY_INTERVAL and time() - self.last_summary >= settings.METRICS_SUMMARY_INTERVAL:
+                logger.info(metrics.summary())
+                logger.info(self.exchange.context.report())
+                logger.info(self.exchange.strategy_executor.report())
+                logger.info(self.exchange.bitmex.ws.traffic())
+                self.last_summary = time()
+
+            self.check_profiler()
+            with self.profiler.section('sanity_check'):
+                quoting = self.sanity_check()  # Ensures health of mm - several cut-out points here
+            if not quoting:
+                continue
+            with self.profiler.section('print_status'):
+                self.print_status()  # Print skew, delta, etc
+            with self.profiler.section('place_orders'):
+                self.place_orders()  # Creates desired orders and converges to existing orders
+
+    def check_profiler(self):
+        """Start or stop the sampling profiler if it was toggled, and write out the last tick's samples."""
+        enabled = self.profiler.enabled
+        self.profiler.tick()
+        if self.profiler.enabled and not enabled:
+            logger.info("Profiling enabled, writing collapsed stacks to %s", self.profiler.output)
+        elif enabled and not self.profiler.enabled:
+            logger.info("Profiling disabled after %d ticks, stacks written to %s",
+                        self.profiler.ticks, self.profiler.output)
 
     def restart(self):
+        """Hand over to a new process: save our orders for it to adopt (see STATE_FILE), or cancel them, then exec."""
         logger.info("Restarting the market maker...")
-        sys.exit()
-        #os.execv(sys.executable, [sys.executable] + sys.argv)
+        self.restarting = True
+        self.exit()
 
 #
 # Helpers
@@ -1414,7 +1156,7 @@ def margin(instrument, quantity, price):
 
 
 def run():
-    logger.info('BitMEX Market Maker Version: %s\n' % constants.VERSION)
+    logger.info('BitMEX Market Maker Version: %s\n', constants.VERSION)
 
     om = OrderManager()
     # Try/except just keeps ctrl-c from printing an ugly stacktrace
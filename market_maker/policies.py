@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*- #
+"""Signal policies used by ExchangeInterface.combination_strategy.
+
+Every policy is a plain function of `candles`, a mapping of binSize ('1m', '5m', '1h', '1d') to columns
+('close', 'volume', ...) in chronological order, and returns an operator: 10 for buy, -10 for sell, 0 otherwise.
+Keeping them free of exchange state lets them run in worker threads or processes.
+Indicator periods are keyword arguments, set per policy with settings.STRATEGY_PARAMS.
+A policy declares the binSizes it reads with @reads, so its signal can be reused until one of them closes a bar.
+"""
+from __future__ import absolute_import
+import logging
+import talib
+import numpy as np
+
+logger = logging.getLogger('root')
+
+
+def reads(*binSizes, **kwargs):
+    """Declare the candle series a policy reads, and with price=True that its result also depends on `price`.
+
+    StrategyExecutor reuses the last signal of a declared policy while those inputs are unchanged; undeclared
+    policies run every tick."""
+    def declare(policy):
+        policy.binSizes = binSizes
+        policy.usesPrice = kwargs.get('price', False)
+        return policy
+    return declare
+
+
+def calc_volume_limit(volume):
+    volume_values = np.asarray(volume, dtype='f8')
+    volume_macd, volume_signal, volume_hist = \
+                         talib.MACD(volume_values,
+                                    fastperiod = 12,
+                                    slowperiod = 26,
+                                    signalperiod = 9)
+    volume_hist_1 = volume_hist[-1]
+    volume_hist_2 = volume_hist[-2]
+    logger.info('volume_hist_1: %s, volume_hist_2: %s', volume_hist_1, volume_hist_2)
+    if volume_hist_1 > 0:
+        return True
+    return False
+
+
+@reads('1h', price=True)
+def price_limit(candles, price, flags):
+    '''
+        近期高位不做多，低位不做空
+    '''
+    close_values_1h = candles['1h']['close']
+    EMA_PRICE = talib.EMA(close_values_1h, timeperiod=3)
+    logger.info('the 1h ema_3 is: %s', EMA_PRICE[-1])
+
+    if flags < 0 and price > EMA_PRICE[-1] - 50:
+        return -1
+    if flags > 0 and price < EMA_PRICE[-1] + 50:
+        return 1
+    return 0
+
+
+@reads('1h', '5m')
+def policy_GUPPY(candles, price=None):
+    '''
+        顾比均线策略，选取3、5、8、10、12、15作为短期均线，
+        30、35、40、45、50、60位长期均线。
+        1. 1h看趋势，5m入场
+        2. 1h短期均线在长期均线上方则为多头趋势，否则为空头趋势
+        3. 5m如果短期穿过长期则为做多信号，要求短线展开
+        4. 5m volume MACD，hist正数代表放量，可以入场
+        5. 5m MACD的hist值处于正值为多头信号，反之空头
+    '''
+    logger.info('================begin GUPPY policy====================')
+    close_values_1h = candles['1h']['close']
+    TREND_FAST_3 = talib.EMA(close_values_1h, timeperiod=3)
+    TREND_FAST_5 = talib.EMA(close_values_1h, timeperiod=5)
+    TREND_FAST_8 = talib.EMA(close_values_1h, timeperiod=8)
+    TREND_FAST_10 = talib.EMA(close_values_1h, timeperiod=10)
+    TREND_FAST_12 = talib.EMA(close_values_1h, timeperiod=12)
+    TREND_FAST_15 = talib.EMA(close_values_1h, timeperiod=15)
+
+    TREND_SLOW_30 = talib.EMA(close_values_1h, timeperiod=30)
+    TREND_SLOW_35 = talib.EMA(close_values_1h, timeperiod=35)
+    TREND_SLOW_40 = talib.EMA(close_values_1h, timeperiod=40)
+    TREND_SLOW_45 = talib.EMA(close_values_1h, timeperiod=45)
+    TREND_SLOW_50 = talib.EMA(close_values_1h, timeperiod=50)
+    TREND_SLOW_60 = talib.EMA(close_values_1h, timeperiod=60)
+
+    close_values_5m = candles['5m']['close']
+    macd_5m, signal_5m, hist_5m = talib.MACD(close_values_5m,
+                                    fastperiod = 12,
+                                    slowperiod = 26,
+                                    signalperiod = 9)
+
+    volume_limit = calc_volume_limit(candles['5m']['volume'])
+
+    SIG_FAST_3 = talib.EMA(close_values_5m, timeperiod=3)
+    SIG_FAST_5 = talib.EMA(close_values_5m, timeperiod=5)
+    SIG_FAST_8 = talib.EMA(close_values_5m, timeperiod=8)
+    SIG_FAST_10 = talib.EMA(close_values_5m, timeperiod=10)
+    SIG_FAST_12 = talib.EMA(close_values_5m, timeperiod=12)
+    SIG_FAST_15 = talib.EMA(close_values_5m, timeperiod=15)
+
+    SIG_SLOW_30 = talib.EMA(close_values_5m, timeperiod=30)
+    SIG_SLOW_35 = talib.EMA(close_values_5m, timeperiod=35)
+    SIG_SLOW_40 = talib.EMA(close_values_5m, timeperiod=40)
+    SIG_SLOW_45 = talib.EMA(close_values_5m, timeperiod=45)
+    SIG_SLOW_50 = talib.EMA(close_values_5m, timeperiod=50)
+    SIG_SLOW_60 = talib.EMA(close_values_5m, timeperiod=60)
+
+    policy_data = {
+        'TREND_FAST': [TREND_FAST_3[-1],
+                       TREND_FAST_5[-1],
+                       TREND_FAST_8[-1],
+                       TREND_FAST_10[-1],
+                       TREND_FAST_12[-1],
+                       TREND_FAST_15[-1],
+                       ],
+        'TREND_SLOW': [TREND_SLOW_30[-1],
+                       TREND_SLOW_35[-1],
+                       TREND_SLOW_40[-1],
+                       TREND_SLOW_45[-1],
+                       TREND_SLOW_50[-1],
+                       TREND_SLOW_60[-1],
+                       ],
+
+        'SIG_FAST': [SIG_FAST_3[-1],
+                       SIG_FAST_5[-1],
+                       SIG_FAST_8[-1],
+                       SIG_FAST_10[-1],
+                       SIG_FAST_12[-1],
+                       SIG_FAST_15[-1],
+                       ],
+        'SIG_SLOW': [SIG_SLOW_30[-1],
+                       SIG_SLOW_35[-1],
+                       SIG_SLOW_40[-1],
+                       SIG_SLOW_45[-1],
+                       SIG_SLOW_50[-1],
+                       SIG_SLOW_60[-1],
+                       ],
+
+        'SIG_FAST_PRE': [SIG_FAST_3[-2],
+                       SIG_FAST_5[-2],
+                       SIG_FAST_8[-2],
+                       SIG_FAST_10[-2],
+                       SIG_FAST_12[-2],
+                       SIG_FAST_15[-2],
+                       ],
+        'SIG_SLOW_PRE': [SIG_SLOW_30[-2],
+                       SIG_SLOW_35[-2],
+                       SIG_SLOW_40[-2],
+                       SIG_SLOW_45[-2],
+                       SIG_SLOW_50[-2],
+                       SIG_SLOW_60[-2],
+                       ],
+
+        'volume_limit': volume_limit,
+        'hist_5m': hist_5m[-1],
+        'trend': 0,
+        'exchange_sig': 0,
+        'operator': 0,
+    }
+
+    def list_com(fast_list, slow_list):
+        '''
+            如果fast_list的所有值大于slow_list里的所有值，返回1
+            如果fast_list的所有值小于slow_list里的所有值，返回-1
+            其他返回0
+        '''
+        buy_tmp = 0
+        sell_tmp = 0
+        for fast in fast_list:
+            for slow in slow_list:
+                if fast > slow:
+                    buy_tmp += 1
+                else:
+                    sell_tmp += 1
+
+        if buy_tmp == 36:
+            return 1
+        if sell_tmp == 36:
+            return -1
+        return 0
+
+    def near_com(flags):
+        cross_sig = 0
+        pass_sig = 0
+        for i in range(-1, -21, -1):
+            slow_list = [
+                SIG_SLOW_30[i],
+                SIG_SLOW_35[i],
+                SIG_SLOW_40[i],
+                SIG_SLOW_45[i],
+                SIG_SLOW_50[i],
+                SIG_SLOW_60[i],
+            ]
+            fast_list = [
+                SIG_FAST_3[i],
+                SIG_FAST_5[i],
+                SIG_FAST_8[i],
+                SIG_FAST_10[i],
+                SIG_FAST_12[i],
+                SIG_FAST_15[i],
+            ]
+
+            if pass_sig==0 and list_com(fast_list, slow_list) == flags:
+                pass_sig = abs(i)
+                logger.info('pass_sig=%s:fast_list:%s,slow_list:%s', i, fast_list, slow_list)
+            if cross_sig==0 and list_com(fast_list, slow_list) == -flags:
+                cross_sig = abs(i)
+                logger.info('cross_sig=%s:fast_list:%s,slow_list:%s', i, fast_list, slow_list)
+
+        if pass_sig and cross_sig and pass_sig < cross_sig:
+            return flags
+
+        return 0
+
+    # A copy, since policy_data is still filled in below and the message is formatted later
+    logger.info('policy_data: %s', dict(policy_data))
+
+    if list_com(policy_data['TREND_FAST'], policy_data['TREND_SLOW']) > 0:
+        policy_data['trend'] = 1
+    elif list_com(policy_data['TREND_FAST'], policy_data['TREND_SLOW']) < 0:
+        policy_data['trend'] = -1
+
+    if policy_data['trend'] > 0 and volume_limit and \
+       policy_data['hist_5m'] > 2 and near_com(1) == 1:
+        # 做多信号
+        policy_data['exchange_sig'] = 1
+
+    if policy_data['trend'] < 0 and volume_limit and \
+       policy_data['hist_5m'] < -2 and near_com(-1) == -1:
+        # 做空信号
+        policy_data['exchange_sig'] = -1
+
+    if policy_data['exchange_sig'] > 0:
+        logger.info('=========Buy Opportunity!=========')
+        policy_data['operator'] += 10
+    elif policy_data['exchange_sig'] < 0:
+        policy_data['operator'] -= 10
+        logger.info('=========Sell Opportunity!=========')
+    else:
+        logger.info('=========No Opportunity!=========')
+    logger.info('policy_data: %s', policy_data)
+    logger.info('================end GUPPY policy====================')
+    return policy_data['operator']
+
+
+@reads('1h')
+def policy_BBANDS_long(candles, price=None, timeperiod=20, nbdev=2, fastperiod=12, slowperiod=26,
+                       signalperiod=9):
+    '''
+        布林线，MACD，volume MACD混合策略（由于指标迟滞性，改为做反弹）
+        1. 1h布林线，布林宽度BB width，宽度大于0.03时才入场，避免横盘（上轨-下轨）/中轨
+        2. 布林%B指标>1为多，小于<0为空。（收盘-下轨）/（上轨-下轨）
+        3. 1h MACD的hist值处于正值为多头趋势，反之空头
+        4. volume MACD，hist正数代表放量，可以入场
+        5. 所有指标使用1h线，100条
+        6. MACD参数为12，26，9
+    '''
+    logger.info('================begin BBANDS_long policy====================')
+    volume_values_1h = np.asarray(candles['1h']['volume'], dtype='f8')
+    volume_macd_1h, volume_signal_1h, volume_hist_1h = \
+                         talib.MACD(volume_values_1h,
+                                    fastperiod = 12,
+                                    slowperiod = 26,
+                                    signalperiod = 9)
+    close_values_1h = candles['1h']['close']
+    upper, middle, lower = \
+        talib.BBANDS(close_values_1h,
+                     timeperiod=timeperiod,
+                     # number of non-biased standard deviations from the mean
+                     nbdevup=nbdev,
+                     nbdevdn=nbdev,
+                     # Moving average type: simple moving average here
+                     matype=0)
+    macd_1h, signal_1h, hist_1h = talib.MACD(close_values_1h,
+                                    fastperiod = fastperiod,
+                                    slowperiod = slowperiod,
+                                    signalperiod = signalperiod)
+
+    policy_data = {
+        'volume_hist_1h': volume_hist_1h[-1],
+        'hist_1h': hist_1h[-1],
+        'upper': upper[-1],
+        'middle': middle[-1],
+        'lower': lower[-1],
+        'boll_w': (upper[-1] - lower[-1])/middle[-1],
+        'boll_b':  (close_values_1h[-1] - lower[-1])/(upper[-1] - lower[-1]),
+        'exchange_sig': 0,
+        'operator': 0,
+        'price': price
+    }
+    if policy_data['volume_hist_1h'] > 0 and policy_data['hist_1h'] > 0 and \
+       policy_data['boll_w'] > 0.03 and policy_data['boll_b'] > 1.3:
+        # 做空
+        policy_data['exchange_sig'] = -1
+    if policy_data['volume_hist_1h'] > 0 and policy_data['hist_1h'] < 0 and \
+       policy_data['boll_w'] > 0.03 and policy_data['boll_b'] < -0.3:
+        # 做多
+        policy_data['exchange_sig'] = 1
+
+    if policy_data['exchange_sig'] > 0:
+        logger.info('=========Buy Opportunity!=========')
+        policy_data['operator'] += 10
+    elif policy_data['exchange_sig'] < 0:
+        policy_data['operator'] -= 10
+        logger.info('=========Sell Opportunity!=========')
+    else:
+        logger.info('=========No Opportunity!=========')
+    logger.info('policy_data: %s', policy_data)
+    logger.info('================end BBANDS_long policy====================')
+    return policy_data['operator']
+
+
+@reads('1m')
+def policy_BBANDS_short(candles, price=None, timeperiod=20, nbdev=2, fastperiod=12, slowperiod=26,
+                        signalperiod=9):
+    '''
+        布林线短线策略
+        1. 5m BBAND 参数20，2，5m MACD 12，26，9
+        2. 价格处于下轨附近，并且开口较大（宽度大于0.01），MACD出现金叉，且第二根hist值大于3，则做多
+        3. 反之做空
+        4. 5m放量才入场
+    '''
+    logger.info('================begin BBANDS_short policy====================')
+
+    volume_limit = calc_volume_limit(candles['1m']['volume'])
+
+    close_values_5m = candles['1m']['close']
+    upper, middle, lower = \
+        talib.BBANDS(close_values_5m,
+                     timeperiod=timeperiod,
+                     # number of non-biased standard deviations from the mean
+                     nbdevup=nbdev,
+                     nbdevdn=nbdev,
+                     # Moving average type: simple moving average here
+                     matype=0)
+    macd_5m, signal_5m, hist_5m = talib.MACD(close_values_5m,
+                                    fastperiod = fastperiod,
+                                    slowperiod = slowperiod,
+                                    signalperiod = signalperiod)
+    policy_data = {
+        'upper': upper[-1],
+        'middle': middle[-1],
+        'lower': lower[-1],
+        'hist_5m_5': hist_5m[-5],
+        'hist_5m_4': hist_5m[-4],
+        'hist_5m_3': hist_5m[-3],
+        'hist_5m_2': hist_5m[-2],
+        'hist_5m_1': hist_5m[-1],
+        'volume_limit': volume_limit,
+        'boll_w': (upper[-1] - lower[-1])/middle[-1],
+        'boll_b':  (close_values_5m[-1] - lower[-1])/(upper[-1] - lower[-1]),
+        'exchange_sig': 0,
+        'operator': 0,
+        'price': price
+    }
+    if policy_data['hist_5m_2'] < 0 and policy_data['hist_5m_1'] < 0 and \
+       policy_data['hist_5m_5'] > policy_data['hist_5m_4'] and \
+       policy_data['hist_5m_4'] > policy_data['hist_5m_3'] and \
+       policy_data['hist_5m_3'] > policy_data['hist_5m_2'] and \
+       policy_data['hist_5m_2'] > policy_data['hist_5m_1'] and \
+       abs(policy_data['hist_5m_1']) > 1 and policy_data['hist_5m_3'] > 0 and\
+       policy_data['boll_w'] > 0.005 and volume_limit:
+        # 做空
+        policy_data['exchange_sig'] = -1
+    if policy_data['hist_5m_2'] > 0 and policy_data['hist_5m_1'] > 0 and \
+       policy_data['hist_5m_5'] < policy_data['hist_5m_4'] and \
+       policy_data['hist_5m_4'] < policy_data['hist_5m_3'] and \
+       policy_data['hist_5m_3'] < policy_data['hist_5m_2'] and \
+       policy_data['hist_5m_2'] < policy_data['hist_5m_1'] and \
+       abs(policy_data['hist_5m_1']) > 1 and policy_data['hist_5m_3'] < 0 and\
+       policy_data['boll_w'] > 0.005 and volume_limit:
+        # 做多
+        policy_data['exchange_sig'] = 1
+
+    if policy_data['exchange_sig'] > 0:
+        logger.info('=========Buy Opportunity!=========')
+        policy_data['operator'] += 10
+    elif policy_data['exchange_sig'] < 0:
+        policy_data['operator'] -= 10
+        logger.info('=========Sell Opportunity!=========')
+    else:
+        logger.info('=========No Opportunity!=========')
+
+    logger.info('policy_data: %s', policy_data)
+    logger.info('================end BBANDS_short policy====================')
+    return policy_data['operator']
+
+
+@reads('1d', '1h', '5m')
+def policy_MACD(candles, price=None, fastperiod=12, slowperiod=26, signalperiod=9):
+    '''
+        1. 1d MACD看长线趋势，hist连着3次上涨为多头趋势，否则为空头
+        2. 1h MACD看短线趋势，hist连着5次上涨为多头趋势，否则为空头
+        3. 5m MACD为入场信号，macd近期出现（3根柱子以内）金叉为做多信号，
+           且hist连着3次上涨，且当前hist大于1，否则做空。
+        4. 金叉标准：macd上穿signal，且hist为正。
+        5. 死叉标准：macd下穿signal，且hist为负。
+        6. 5m放量入场
+    '''
+
+    logger.info('================begin MACD Comp policy====================')
+    close_values_1d = candles['1d']['close']
+    macd_1d, signal_1d, hist_1d = talib.MACD(close_values_1d,
+                                    fastperiod = fastperiod,
+                                    slowperiod = slowperiod,
+                                    signalperiod = signalperiod)
+    close_values_1h = candles['1h']['close']
+    macd_1h, signal_1h, hist_1h = talib.MACD(close_values_1h,
+                                    fastperiod = fastperiod,
+                                    slowperiod = slowperiod,
+                                    signalperiod = signalperiod)
+    close_values_5m = candles['5m']['close']
+    macd_5m, signal_5m, hist_5m = talib.MACD(close_values_5m,
+                                    fastperiod = fastperiod,
+                                    slowperiod = slowperiod,
+                                    signalperiod = signalperiod)
+
+    volume_limit = calc_volume_limit(candles['5m']['volume'])
+
+    policy_data = {
+        'hist_1d_3': hist_1d[-3],
+        'hist_1d_2': hist_1d[-2],
+        'hist_1d_1': hist_1d[-1],
+        'hist_1h_5': hist_1h[-5],
+        'hist_1h_4': hist_1h[-4],
+        'hist_1h_3': hist_1h[-3],
+        'hist_1h_2': hist_1h[-2],
+        'hist_1h_1': hist_1h[-1],
+        'macd_5m_4': macd_5m[-4],
+        'macd_5m_3': macd_5m[-3],
+        'macd_5m_2': macd_5m[-2],
+        'macd_5m_1': macd_5m[-1],
+        'signal_5m_4': signal_5m[-4],
+        'signal_5m_3': signal_5m[-3],
+        'signal_5m_2': signal_5m[-2],
+        'signal_5m_1': signal_5m[-1],
+        'hist_5m_4': hist_5m[-4],
+        'hist_5m_3': hist_5m[-3],
+        'hist_5m_2': hist_5m[-2],
+        'hist_5m_1': hist_5m[-1],
+        'volume_limit': volume_limit,
+        'long_trend': 0,
+        'short_trend': 0,
+        'exchange_sig': 0,
+        'operator': 0
+    }
+
+    # 长线趋势判断
+    if policy_data['hist_1d_3'] > policy_data['hist_1d_2'] and \
+       policy_data['hist_1d_2'] > policy_data['hist_1d_1']:
+        # 长线空头趋势
+        policy_data['long_trend'] = -1
+    if policy_data['hist_1d_3'] < policy_data['hist_1d_2'] and \
+       policy_data['hist_1d_2'] < policy_data['hist_1d_1']:
+        # 长线多头趋势
+        policy_data['long_trend'] = 1
+    if policy_data['hist_1h_3'] > policy_data['hist_1h_2'] and \
+       policy_data['hist_1h_2'] > policy_data['hist_1h_1']:
+        # 短线空头趋势
+        policy_data['short_trend'] = -1
+    if policy_data['hist_1h_3'] < policy_data['hist_1h_2'] and \
+       policy_data['hist_1h_2'] < policy_data['hist_1h_1']:
+        # 短线多头趋势
+        policy_data['short_trend'] = 1
+
+    if policy_data['hist_5m_4'] > 0 and \
+       policy_data['hist_5m_1'] < 0 and \
+       policy_data['hist_5m_3'] > policy_data['hist_5m_2'] and \
+       policy_data['hist_5m_2'] > policy_data['hist_5m_1'] and \
+       policy_data['hist_5m_1'] < -1 and policy_data['short_trend'] < 0 and \
+       policy_data['long_trend'] < 0 and volume_limit:
+        # 空头信号
+        policy_data['exchange_sig'] = -1
+    if policy_data['hist_5m_4'] < 0 and \
+       policy_data['hist_5m_1'] > 0 and \
+       policy_data['hist_5m_3'] < policy_data['hist_5m_2'] and \
+       policy_data['hist_5m_2'] < policy_data['hist_5m_1'] and \
+       policy_data['hist_5m_1'] > 1 and policy_data['short_trend'] > 0 and \
+       policy_data['long_trend'] > 0 and volume_limit:
+        # 多头信号
+        policy_data['exchange_sig'] = 1
+
+    if policy_data['exchange_sig'] > 0:
+        logger.info('=========Buy Opportunity!=========')
+        policy_data['operator'] += 10
+    elif policy_data['exchange_sig'] < 0:
+        policy_data['operator'] -= 10
+        logger.info('=========Sell Opportunity!=========')
+    else:
+        logger.info('=========No Opportunity!=========')
+
+    logger.info('policy_data: %s', policy_data)
+    logger.info('================end MACD Comp policy====================')
+    return policy_data['operator']
+
+
+@reads('1h', '5m')
+def policy_EMA(candles, price=None, fastperiod=5, slowperiod=80):
+    '''
+        1. H1周期的EMA5与EMA80作为趋势判断，EMA5大于EMA80为做多趋势，EMA小于EMA80为做空趋势
+        2. M5周期EMA5上穿EMA80为做多信号，需与1趋势相同；
+        3. M5周期EMA5下穿EMA80为做空信号，需与1趋势相同；
+    '''
+    close_values_1h = candles['1h']['close']
+    EMA_FAST_1h = talib.EMA(close_values_1h, timeperiod=fastperiod)
+    EMA_SLOW_1h = talib.EMA(close_values_1h, timeperiod=slowperiod)
+
+    close_values_5m = candles['5m']['close']
+    EMA_FAST_5m = talib.EMA(close_values_5m, timeperiod=fastperiod)
+    EMA_SLOW_5m = talib.EMA(close_values_5m, timeperiod=slowperiod)
+
+    logger.info('================begin EMA policy====================')
+    logger.info('EMA_FAST_1h[-1]: %s, EMA_SLOW_1h[-1]: %s,'
+                'EMA_FAST_5m[-2]: %s, EMA_SLOW_5m[-2]: %s,'
+                'EMA_FAST_5m[-1]: %s, EMA_SLOW_5m[-1]: %s',
+                EMA_FAST_1h[-1], EMA_SLOW_1h[-1], EMA_FAST_5m[-2],
+                EMA_SLOW_5m[-2], EMA_FAST_5m[-1], EMA_SLOW_5m[-1])
+    if EMA_FAST_1h[-1] > EMA_SLOW_1h[-1] and \
+       EMA_FAST_5m[-2] < EMA_SLOW_5m[-2] and \
+       EMA_FAST_5m[-1] > EMA_SLOW_5m[-1]:
+        # buy
+        logger.info('=========Buy Opportunity!=========')
+        return 10
+    if EMA_FAST_1h[-1] < EMA_SLOW_1h[-1] and \
+       EMA_FAST_5m[-2] > EMA_SLOW_5m[-2] and \
+       EMA_FAST_5m[-1] < EMA_SLOW_5m[-1]:
+        # sell
+        logger.info('=========Sell Opportunity!=========')
+        return -10
+    logger.info('=========No Opportunity!=========')
+    logger.info('================end EMA policy====================')
+    return 0
@@ -1,12 +1,23 @@
 from __future__ import absolute_import
 
 import importlib
+import numbers
 import os
+import runpy
 import sys
 
 from market_maker.utils.dotdict import dotdict
 import market_maker._settings_base as baseSettings
 
+# Settings that are only read at startup (connections, worker pools, files held open). Changing one of these
+# needs a restart rather than a reload.
+RESTART_SETTINGS = ('BASE_URL', 'API_KEY', 'API_SECRET', 'SYMBOL', 'ORDERID_PREFIX', 'POST_ONLY', 'TIMEOUT',
+                    'DRY_RUN', 'STRATEGY_POLICIES', 'STRATEGY_EXECUTOR', 'STRATEGY_WORKERS', 'CANDLE_STORE_DIR',
+                    'CANDLE_BASE', 'CANDLE_BIN_SIZES', 'CANDLE_HISTORY',
+                    'LOG_LEVEL', 'LOG_FILE', 'LOG_FORMAT', 'LOG_RATE_LIMITS', 'WS_RECORD_FILE', 'METRICS_PORT',
+                    'PROFILE_OUTPUT', 'PROFILE_INTERVAL', 'PROFILE_FLAG_FILE', 'STATE_FILE', 'WATCHED_FILES',
+                    'TRAILING_STOPS', 'CANCEL_ALL_AFTER', 'HEARTBEAT_INTERVAL', 'WS_FIELDS', 'WS_TRANSPORT')
+
 
 def import_path(fullpath):
     """
@@ -22,9 +33,90 @@ def import_path(fullpath):
     return module
 
 
+class Settings(object):
+
+    """The assembled settings, read as `settings.NAME`.
+
+    A reload builds a complete new set of values and `swap`s it in with one reference assignment, so a reader
+    sees either the old settings or the new ones, never a mix.
+    """
+
+    def __init__(self, values):
+        object.__setattr__(self, 'values', dotdict(values))
+
+    def __getattr__(self, attr):
+        return self.values.get(attr)
+
+    def __setattr__(self, attr, value):
+        self.values[attr] = value
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def items(self):
+        return self.values.items()
+
+    def swap(self, values):
+        object.__setattr__(self, 'values', dotdict(values))
+
+
+def reload_values():
+    """Read settings.py and settings-<symbol>.py again from source, on top of the base settings."""
+    values = dict(vars(baseSettings))
+    for path in settings_files:
+        # run_path compiles the current source, where a reimport could pick up a stale .pyc.
+        values.update(runpy.run_path(path))
+    return values
+
+
+def reload_settings():
+    """(new values, problems, settings that need a restart). Only swap the values in if both lists are empty."""
+    values = reload_values()
+    return values, validate(settings.values, values), needs_restart(settings.values, values)
+
+
+def validate(old, new):
+    """Settings in `new` whose value is of a different type than before."""
+    problems = []
+    for key, value in sorted(new.items()):
+        if not key.isupper() or key not in old:
+            continue
+        previous = old[key]
+        if previous is not None and value is not None and not same_type(previous, value):
+            problems.append("%s should be a %s, not %r" % (key, type(previous).__name__, value))
+    return problems
+
+
+def needs_restart(old, new):
+    return [key for key in RESTART_SETTINGS if old.get(key) != new.get(key)]
+
+
+def same_type(previous, value):
+    if isinstance(previous, bool) or isinstance(value, bool):
+        return isinstance(previous, bool) and isinstance(value, bool)
+    if isinstance(previous, numbers.Number):
+        return isinstance(value, numbers.Number)
+    return isinstance(value, type(previous))
+
+
+def command_line_symbol():
+    """The symbol the bot was started with (`marketmaker XBTUSD`), or None.
+
+    Other entry points, such as the backtest and the simulator, take a file or an option first; those aren't symbols."""
+    if len(sys.argv) < 2 or sys.argv[1].startswith('-') or os.path.exists(sys.argv[1]):
+        return None
+    return sys.argv[1]
+
+
 userSettings = import_path(os.path.join('.', 'settings'))
 symbolSettings = None
-symbol = sys.argv[1] if len(sys.argv) > 1 else None
+symbol = command_line_symbol()
 if symbol:
     print("Importing symbol settings for %s..." % symbol)
     try:
@@ -32,6 +124,9 @@ if symbol:
     except Exception as e:
         print("Unable to find settings-%s.py." % symbol)
 
+# The files a reload reads, in order
+settings_files = [module.__file__ for module in (userSettings, symbolSettings) if module is not None]
+
 # Assemble settings.
 settings = {}
 settings.update(vars(baseSettings))
@@ -40,4 +135,4 @@ if symbolSettings:
     settings.update(vars(symbolSettings))
 
 # Main export
-settings = dotdict(settings)
+settings = Settings(settings)
@@ -0,0 +1,314 @@
+"""Matching engine for the local exchange simulator.
+
+Holds one account trading one inverse contract (like XBTUSD). Market data comes in through `on_quote` and
+`on_trade`; resting orders are matched against it. Every change to orders, executions, the position or the margin
+is reported to `publish(table, action, rows)` in the same shape the BitMEX realtime API uses.
+"""
+from __future__ import absolute_import
+import datetime
+import threading
+import uuid
+
+XBt_TO_XBT = 100000000
+TAKER_FEE = 0.00075
+MAKER_FEE = -0.00025
+
+
+class OrderError(Exception):
+    """Raised for requests BitMEX would reject. The message matches the API's error message."""
+    pass
+
+
+class MatchingEngine(object):
+
+    def __init__(self, symbol, balance=1.0, publish=None):
+        self.symbol = symbol
+        self.publish = publish or (lambda table, action, rows: None)
+        self.lock = threading.RLock()
+        self.orders = {}
+        # Orders that have rested in the book, and so earn the maker rebate when filled
+        self.resting = set()
+        self.bid = None
+        self.ask = None
+        self.last = None
+        self.clock = now()
+
+        self.walletBalance = int(balance * XBt_TO_XBT)
+        self.position = {'account': 0, 'symbol': symbol, 'currency': 'XBt', 'currentQty': 0, 'avgCostPrice': None,
+                         'avgEntryPrice': None, 'liquidationPrice': None, 'markPrice': None, 'homeNotional': 0,
+                         'realisedPnl': 0, 'unrealisedPnl': 0, 'isOpen': False, 'leverage': 0}
+
+    #
+    # Account images
+    #
+    def open_orders(self):
+        with self.lock:
+            return [dict(o) for o in self.orders.values() if o['leavesQty'] > 0 and not terminated(o)]
+
+    def all_orders(self):
+        with self.lock:
+            return [dict(o) for o in self.orders.values()]
+
+    def positions(self):
+        with self.lock:
+            return [dict(self.position)]
+
+    def margins(self):
+        with self.lock:
+            return [self.margin()]
+
+    def margin(self):
+        unrealised = self.position['unrealisedPnl']
+        marginBalance = self.walletBalance + unrealised
+        return {'account': 0, 'currency': 'XBt', 'walletBalance': self.walletBalance,
+                'unrealisedPnl': unrealised, 'marginBalance': marginBalance, 'availableFunds': marginBalance,
+                'timestamp': self.clock}
+
+    #
+    # Market data
+    #
+    def on_quote(self, bid, ask, timestamp=None):
+        with self.lock:
+            self.clock = timestamp or now()
+            self.bid, self.ask = bid, ask
+            self.match()
+
+    def on_trade(self, price, timestamp=None):
+        with self.lock:
+            self.clock = timestamp or now()
+            self.last = price
+            self.mark()
+            self.match(tradePrice=price)
+
+    #
+    # Order entry
+    #
+    def place(self, orders):
+        with self.lock:
+            placed = []
+            try:
+                for o in orders:
+                    placed.append(self.new_order(o))
+            except OrderError:
+                # Bulk requests are all or nothing
+                for o in placed:
+                    del self.orders[o['orderID']]
+                raise
+            self.publish('order', 'insert', [dict(o) for o in placed])
+            self.match()
+            self.resting.update(o['orderID'] for o in placed)
+            return [dict(self.orders[o['orderID']]) for o in placed]
+
+    def amend(self, amends):
+        with self.lock:
+            amended = []
+            for amend in amends:
+                order = self.find(amend)
+                if terminated(order):
+                    raise OrderError('Invalid ordStatus')
+                change = {k: amend[k] for k in ('price', 'stopPx') if k in amend}
+                if 'orderQty' in amend:
+                    change['orderQty'] = abs(amend['orderQty'])
+                    change['leavesQty'] = change['orderQty'] - order['cumQty']
+                if 'leavesQty' in amend:
+                    change['leavesQty'] = amend['leavesQty']
+                    change['orderQty'] = order['cumQty'] + amend['leavesQty']
+                change['timestamp'] = change['transactTime'] = self.clock
+                order.update(change)
+                amended.append(order)
+                self.publish('order', 'update', [dict(change, orderID=order['orderID'])])
+            self.match()
+            return [dict(o) for o in amended]
+
+    def cancel(self, orderIDs=None, clOrdIDs=None):
+        with self.lock:
+            targets = [self.find({'orderID': i}) for i in as_list(orderIDs)]
+            targets += [self.find({'clOrdID': i}) for i in as_list(clOrdIDs)]
+            return [self.close_order(o, 'Canceled') for o in targets if not terminated(o)]
+
+    def cancel_all(self):
+        with self.lock:
+            return [self.close_order(o, 'Canceled') for o in list(self.orders.values()) if not terminated(o)]
+
+    def find(self, ids):
+        if ids.get('orderID') in self.orders:
+            return self.orders[ids['orderID']]
+        for order in self.orders.values():
+            if ids.get('clOrdID') and order['clOrdID'] == ids['clOrdID']:
+                return order
+        raise OrderError('Not Found')
+
+    def new_order(self, request):
+        qty = request.get('orderQty')
+        side = request.get('side') or ('Buy' if (qty or 0) > 0 else 'Sell')
+        ordType = request.get('ordType') or ('Limit' if 'price' in request else 'Market')
+        execInst = request.get('execInst', '')
+        if qty is None and 'Close' in execInst:
+            qty = abs(self.position['currentQty'])
+        qty = abs(qty or 0)
+        if ordType in ('Limit', 'StopLimit', 'LimitIfTouched') and not request.get('price'):
+            raise OrderError('Invalid price')
+        if ordType in ('Stop', 'StopLimit', 'MarketIfTouched', 'LimitIfTouched') and not request.get('stopPx'):
+            raise OrderError('Invalid stopPx')
+        if request.get('clOrdID') and any(o['clOrdID'] == request['clOrdID'] for o in self.orders.values()):
+            raise OrderError('Duplicate clOrdID')
+
+        order = {
+            'orderID': str(uuid.uuid4()),
+            'clOrdID': request.get('clOrdID', ''),
+            'account': 0,
+            'symbol': request.get('symbol', self.symbol),
+            'side': side,
+            'orderQty': qty,
+            'price': request.get('price'),
+            'stopPx': request.get('stopPx'),
+            'ordType': ordType,
+            'execInst': execInst,
+            'ordStatus': 'New',
+            'triggered': '',
+            'leavesQty': qty,
+            'cumQty': 0,
+            'avgPx': None,
+            'text': 'Submitted via API.',
+            'transactTime': self.clock,
+            'timestamp': self.clock,
+        }
+        self.orders[order['orderID']] = order
+        if 'ParticipateDoNotInitiate' in execInst and ordType == 'Limit' and self.crosses(order):
+            self.close_order(order, 'Canceled', publish=False)
+            order['text'] = 'Canceled: Order had execInst of ParticipateDoNotInitiate'
+        return order
+
+    #
+    # Matching
+    #
+    def crosses(self, order):
+        if order['side'] == 'Buy':
+            return self.ask is not None and order['price'] >= self.ask
+        return self.bid is not None and order['price'] <= self.bid
+
+    def triggered(self, order):
+        # Stops trigger moving against the order's side, touched orders moving towards it.
+        price = self.last if 'LastPrice' in order['execInst'] else self.position['markPrice'] or self.last
+        if price is None:
+            return False
+        rising = order['ordType'] in ('Stop', 'StopLimit')
+        if order['side'] == 'Sell':
+            rising = not rising
+        return price >= order['stopPx'] if rising else price <= order['stopPx']
+
+    def match(self, tradePrice=None):
+        for order in list(self.orders.values()):
+            if terminated(order):
+                continue
+            if order['ordType'] in ('Stop', 'MarketIfTouched', 'StopLimit', 'LimitIfTouched') and not order['triggered']:
+                if not self.triggered(order):
+                    continue
+                order['triggered'] = 'StopOrderTriggered'
+                self.publish('order', 'update', [{'orderID': order['orderID'], 'triggered': order['triggered']}])
+
+            if order['ordType'] in ('Market', 'Stop', 'MarketIfTouched'):
+                price = self.ask if order['side'] == 'Buy' else self.bid
+                if price is not None:
+                    self.fill(order, price, TAKER_FEE)
+            elif self.crosses(order):
+                # Marketable on arrival or after the book moved through it
+                price = self.ask if order['side'] == 'Buy' else self.bid
+                self.fill(order, min(price, order['price']) if order['side'] == 'Buy' else max(price, order['price']),
+                          MAKER_FEE if order['orderID'] in self.resting else TAKER_FEE)
+            elif tradePrice is not None and ((order['side'] == 'Buy' and tradePrice < order['price']) or
+                                             (order['side'] == 'Sell' and tradePrice > order['price'])):
+                # Someone traded through our level, so we'd have been filled.
+                self.fill(order, order['price'], MAKER_FEE)
+
+    def fill(self, order, price, feeRate):
+        qty = order['leavesQty']
+        if 'Close' in order['execInst']:
+            # Close orders only ever reduce the position.
+            closable = -self.position['currentQty'] if order['side'] == 'Buy' else self.position['currentQty']
+            qty = min(qty, max(closable, 0))
+            if qty == 0:
+                return self.close_order(order, 'Canceled')
+        signedQty = qty if order['side'] == 'Buy' else -qty
+        fee = int(round(feeRate * qty / price * XBt_TO_XBT))
+
+        order['cumQty'] += qty
+        order['leavesQty'] = 0
+        order['avgPx'] = price
+        order['ordStatus'] = 'Filled'
+        order['timestamp'] = order['transactTime'] = self.clock
+        self.publish('execution', 'insert', [{
+            'execID': str(uuid.uuid4()), 'orderID': order['orderID'], 'clOrdID': order['clOrdID'],
+            'symbol': order['symbol'], 'side': order['side'], 'lastQty': qty, 'lastPx': price,
+            'orderQty': order['orderQty'], 'cumQty': order['cumQty'], 'leavesQty': 0, 'ordType': order['ordType'],
+            'ordStatus': 'Filled', 'execType': 'Trade', 'execComm': fee, 'timestamp': self.clock,
+        }])
+        self.publish('order', 'update', [{k: order[k] for k in ('orderID', 'ordStatus', 'cumQty', 'leavesQty',
+                                                                  'avgPx', 'timestamp', 'transactTime')}])
+        self.walletBalance -= fee
+        self.trade_position(signedQty, price)
+
+    def close_order(self, order, status, publish=True):
+        order['ordStatus'] = status
+        order['leavesQty'] = 0
+        order['timestamp'] = order['transactTime'] = self.clock
+        if publish:
+            self.publish('order', 'update', [{'orderID': order['orderID'], 'ordStatus': status, 'leavesQty': 0,
+                                              'timestamp': self.clock}])
+        return dict(order)
+
+    #
+    # Position keeping, inverse contract: PnL in XBT is qty * (1 / entry - 1 / exit)
+    #
+    def trade_position(self, signedQty, price):
+        position = self.position
+        current = position['currentQty']
+        entry = position['avgEntryPrice']
+        if current and (current > 0) != (signedQty > 0):
+            closed = min(abs(signedQty), abs(current)) * (1 if current > 0 else -1)
+            pnl = int(round(closed * (1.0 / entry - 1.0 / price) * XBt_TO_XBT))
+            self.walletBalance += pnl
+            position['realisedPnl'] += pnl
+            current -= closed
+            signedQty += closed
+            if current == 0:
+                entry = None
+        if signedQty:
+            # Entry price of a combined inverse position is the contract-weighted harmonic mean.
+            value = (abs(current) / entry if current else 0) + abs(signedQty) / price
+            current += signedQty
+            entry = abs(current) / value
+
+        position['currentQty'] = current
+        position['avgEntryPrice'] = position['avgCostPrice'] = entry
+        position['isOpen'] = current != 0
+        position['liquidationPrice'] = None if not current else (entry / 2 if current > 0 else entry * 2)
+        self.mark(force=True)
+
+    def mark(self, force=False):
+        position = self.position
+        price = self.last or position['markPrice']
+        if price is None or (not force and not position['currentQty']):
+            return
+        current = position['currentQty']
+        position['markPrice'] = price
+        position['homeNotional'] = float(current) / price
+        position['unrealisedPnl'] = int(round(current * (1.0 / position['avgEntryPrice'] - 1.0 / price) *
+                                              XBt_TO_XBT)) if current else 0
+        position['timestamp'] = self.clock
+        self.publish('position', 'update', [dict(position)])
+        self.publish('margin', 'update', [self.margin()])
+
+
+def terminated(order):
+    return order['ordStatus'] in ('Filled', 'Canceled', 'Rejected')
+
+
+def as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def now():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
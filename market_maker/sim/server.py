@@ -0,0 +1,462 @@
+"""Local stand-in for the BitMEX REST and realtime APIs.
+
+Replays market data recorded with settings.WS_RECORD_FILE, matches the bot's orders against it with
+`market_maker.sim.engine` and serves the results over HTTP and WebSocket on one port:
+
+    python -m market_maker.sim.server recording.txt --candles history.json --speed 10 --port 8080
+
+Then point the bot at it with BASE_URL = "http://localhost:8080/api/v1/", and MAX_CLOCK_SKEW = None since the
+replayed timestamps are behind the clock. `--speed` replays the recording faster than real time; lower
+LOOP_INTERVAL to match. `--candles` takes the same file as market_maker.backtest and serves
+it from trade/bucketed; without it buckets are built from the recorded trades.
+"""
+from __future__ import absolute_import
+import argparse
+import base64
+import calendar
+import hashlib
+import json
+import logging
+import struct
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from market_maker.sim.engine import MatchingEngine, OrderError
+
+logger = logging.getLogger('root')
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Tables replayed from the recording, and the keys each table is identified by
+MARKET_TABLES = ['instrument', 'quote', 'trade', 'orderBook10', 'orderBookL2']
+TABLE_KEYS = {
+    'instrument': ['symbol'],
+    'orderBook10': ['symbol'],
+    'orderBookL2': ['symbol', 'id', 'side'],
+    'quote': [],
+    'trade': [],
+    'order': ['orderID'],
+    'execution': ['execID'],
+    'position': ['account', 'symbol', 'currency'],
+    'margin': ['account', 'currency'],
+}
+MAX_TABLE_LEN = 200
+
+BIN_SECONDS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+
+# Used when the recording has no instrument partial. Shaped like XBTUSD.
+DEFAULT_INSTRUMENT = {
+    'state': 'Open', 'typ': 'FFWCSX', 'tickSize': 0.5, 'lotSize': 1, 'isQuanto': False, 'isInverse': True,
+    'multiplier': -100000000, 'underlyingToSettleMultiplier': -100000000, 'quoteToSettleMultiplier': None,
+    'initMargin': 0.01, 'maintMargin': 0.005, 'settlCurrency': 'XBt', 'underlying': 'XBT', 'quoteCurrency': 'USD',
+}
+
+
+class ExchangeSimulator(object):
+
+    def __init__(self, recording, symbol='XBTUSD', candles=None, speed=1.0, balance=1.0):
+        self.recording = recording
+        self.symbol = symbol
+        self.speed = speed
+        # Lock order is always engine.lock, then self.lock
+        self.lock = threading.RLock()
+        self.clients = []
+        self.engine = MatchingEngine(symbol, balance=balance, publish=self.publish)
+        self.tables = {'instrument': [dict(DEFAULT_INSTRUMENT, symbol=symbol)]}
+        self.candles = candles or {}
+        self.bars = {binSize: {} for binSize in BIN_SECONDS}
+        self.finished = False
+        # Pending order/cancelAllAfter timer
+        self.deadman = None
+
+    #
+    # Replay
+    #
+    def start(self):
+        thread = threading.Thread(target=self.replay)
+        thread.daemon = True
+        thread.start()
+
+    def replay(self):
+        started = None
+        for received, raw in read_recording(self.recording):
+            if started is None:
+                started = (received, time.time())
+            wait = started[1] + (received - started[0]) / self.speed - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.on_market_message(json.loads(raw))
+        self.finished = True
+        logger.info("Recording finished; the simulator keeps serving the last state.")
+
+    def on_market_message(self, message):
+        table = message.get('table')
+        action = message.get('action')
+        rows = [row for row in message.get('data', []) if row.get('symbol', self.symbol) == self.symbol]
+        if table not in MARKET_TABLES or not rows:
+            # Our own account tables come from the engine, not the recording.
+            return
+
+        if table == 'instrument':
+            # Static fields only; prices follow the replayed quotes and trades below.
+            if action == 'partial':
+                with self.lock:
+                    self.tables['instrument'] = [dict(DEFAULT_INSTRUMENT, **rows[0])]
+            return
+
+        with self.lock:
+            self.apply(table, action, rows)
+            if action != 'partial':
+                self.broadcast(table, action, rows)
+
+        if table == 'quote':
+            row = rows[-1]
+            self.engine.on_quote(row['bidPrice'], row['askPrice'], row['timestamp'])
+            self.update_instrument({'bidPrice': row['bidPrice'], 'askPrice': row['askPrice'],
+                                    'midPrice': (row['bidPrice'] + row['askPrice']) / 2.0})
+        elif table == 'trade':
+            for row in rows:
+                self.record_trade(row)
+                self.engine.on_trade(row['price'], row['timestamp'])
+            price = rows[-1]['price']
+            self.update_instrument({'lastPrice': price, 'markPrice': price, 'indicativeSettlePrice': price})
+
+    def apply(self, table, action, rows):
+        keys = TABLE_KEYS.get(table, [])
+        current = self.tables.get(table, [])
+        if action == 'partial':
+            current = list(rows)
+        elif action == 'insert':
+            current = (current + rows)[-MAX_TABLE_LEN:]
+        elif action in ('update', 'delete'):
+            current = list(current)
+            for row in rows:
+                for i, item in enumerate(current):
+                    if all(item.get(k) == row.get(k) for k in keys):
+                        if action == 'update':
+                            current[i] = dict(item, **row)
+                        else:
+                            del current[i]
+                        break
+        self.tables[table] = current
+
+    def update_instrument(self, change):
+        with self.lock:
+            instrument = dict(self.tables['instrument'][0], timestamp=self.engine.clock, **change)
+            self.tables['instrument'] = [instrument]
+            self.broadcast('instrument', 'update', [dict(change, symbol=self.symbol, timestamp=self.engine.clock)])
+
+    def record_trade(self, trade):
+        closeTime = epoch(trade['timestamp'])
+        with self.lock:
+            for binSize, seconds in BIN_SECONDS.items():
+                # Buckets are stamped with the time they close
+                stamp = (int(closeTime) // seconds + 1) * seconds
+                bar = self.bars[binSize].get(stamp)
+                if bar is None:
+                    bar = self.bars[binSize][stamp] = {
+                        'timestamp': iso(stamp), 'symbol': self.symbol, 'open': trade['price'],
+                        'high': trade['price'], 'low': trade['price'], 'close': trade['price'],
+                        'trades': 0, 'volume': 0, 'vwap': None, 'homeNotional': 0, 'foreignNotional': 0}
+                bar['high'] = max(bar['high'], trade['price'])
+                bar['low'] = min(bar['low'], trade['price'])
+                bar['close'] = trade['price']
+                bar['trades'] += 1
+                bar['foreignNotional'] += trade['size']
+                bar['homeNotional'] += float(trade['size']) / trade['price']
+                bar['volume'] += trade['size']
+                bar['vwap'] = bar['foreignNotional'] / bar['homeNotional']
+
+    def buckets(self, binSize, count=100, reverse=False, startTime=None, partial=False):
+        now = epoch(self.engine.clock)
+        if binSize in self.candles:
+            rows = sorted(self.candles[binSize], key=lambda row: row['timestamp'])
+        else:
+            with self.lock:
+                rows = [self.bars[binSize][stamp] for stamp in sorted(self.bars[binSize])]
+        rows = [row for row in rows if partial or epoch(row['timestamp']) <= now]
+        if startTime:
+            rows = [row for row in rows if epoch(row['timestamp']) >= epoch(startTime)]
+            return rows[::-1][-count:] if reverse else rows[:count]
+        rows = rows[-count:]
+        return rows[::-1] if reverse else rows
+
+    #
+    # Realtime
+    #
+    def publish(self, table, action, rows):
+        """Called by the engine, with the engine lock held."""
+        with self.lock:
+            self.broadcast(table, action, rows)
+
+    def broadcast(self, table, action, rows):
+        message = json.dumps({'table': table, 'action': action, 'data': rows})
+        for client in list(self.clients):
+            if table in client.tables:
+                client.send(message)
+
+    def accept(self, client):
+        """Send the welcome message and partials, then start streaming updates to the client."""
+        with self.engine.lock, self.lock:
+            client.send(json.dumps({'info': 'Welcome to the BitMEX Realtime API.', 'version': 'simulator',
+                                    'timestamp': self.engine.clock}))
+            for subscription, table in client.subscriptions:
+                client.send(json.dumps({'success': True, 'subscribe': subscription,
+                                        'request': {'op': 'subscribe', 'args': [subscription]}}))
+                client.send(json.dumps({'table': table, 'action': 'partial', 'keys': TABLE_KEYS.get(table, []),
+                                        'types': {}, 'foreignKeys': {}, 'attributes': {},
+                                        'filter': {'symbol': self.symbol}, 'data': self.image(table)}))
+            self.clients.append(client)
+
+    def disconnect(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def image(self, table):
+        if table == 'order':
+            return self.engine.open_orders()
+        if table == 'position':
+            return self.engine.positions()
+        if table == 'margin':
+            return self.engine.margins()
+        return list(self.tables.get(table, []))
+
+    #
+    # REST
+    #
+    def request(self, verb, path, query, body):
+        if path == 'order' and verb == 'GET':
+            return self.get_orders(query)
+        if path == 'order' and verb == 'POST':
+            return self.engine.place([body])[0]
+        if path == 'order' and verb == 'PUT':
+            return self.engine.amend([body])[0]
+        if path == 'order' and verb == 'DELETE':
+            return self.engine.cancel(orderIDs=body.get('orderID'), clOrdIDs=body.get('clOrdID'))
+        if path == 'order/bulk' and verb == 'POST':
+            return self.engine.place(body['orders'])
+        if path == 'order/bulk' and verb == 'PUT':
+            return self.engine.amend(body['orders'])
+        if path == 'order/all' and verb == 'DELETE':
+            return self.engine.cancel_all()
+        if path == 'order/cancelAllAfter' and verb == 'POST':
+            return self.cancel_all_after(int(body.get('timeout', 0)))
+        if path == 'position' and verb == 'GET':
+            return self.engine.positions()
+        if path == 'position/leverage' and verb == 'POST':
+            return self.engine.positions()[0]
+        if path == 'user/margin' and verb == 'GET':
+            return self.engine.margins()[0]
+        if path == 'instrument' and verb == 'GET':
+            with self.lock:
+                return list(self.tables['instrument'])
+        if path == 'trade/bucketed' and verb == 'GET':
+            return self.buckets(query['binSize'], count=int(query.get('count', 100)),
+                                reverse=str(query.get('reverse')).lower() == 'true',
+                                startTime=query.get('startTime'),
+                                partial=str(query.get('partial')).lower() == 'true')
+        raise OrderError('Not Found')
+
+    def cancel_all_after(self, timeout):
+        """Dead man's switch: cancel all orders `timeout` ms from now, unless re-armed. 0 disarms."""
+        with self.lock:
+            if self.deadman is not None:
+                self.deadman.cancel()
+                self.deadman = None
+            now = time.time()
+            if timeout <= 0:
+                return {'now': iso(now)}
+            self.deadman = threading.Timer(timeout / 1000.0, self.deadman_fired)
+            self.deadman.daemon = True
+            self.deadman.start()
+            return {'now': iso(now), 'cancelTime': iso(now + timeout / 1000.0)}
+
+    def deadman_fired(self):
+        logger.info("cancelAllAfter expired, cancelling all orders.")
+        self.engine.cancel_all()
+
+    def get_orders(self, query):
+        orders = self.engine.all_orders()
+        for key, value in json.loads(query.get('filter') or '{}').items():
+            if key == 'ordStatus.isTerminated':
+                orders = [o for o in orders if (o['ordStatus'] in ('Filled', 'Canceled', 'Rejected')) == value]
+            else:
+                values = value if isinstance(value, list) else [value]
+                orders = [o for o in orders if o.get(key) in values]
+        if str(query.get('reverse')).lower() == 'true':
+            orders = orders[::-1]
+        return orders[:int(query.get('count', 100))]
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            return self.upgrade()
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def do_PUT(self):
+        self.route('PUT')
+
+    def do_DELETE(self):
+        self.route('DELETE')
+
+    def route(self, verb):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        path = url.path.split('/api/v1/', 1)[-1].strip('/')
+        try:
+            self.respond(200, self.server.simulator.request(verb, path, query, body))
+        except OrderError as e:
+            self.respond(404 if str(e) == 'Not Found' else 400,
+                         {'error': {'message': str(e), 'name': 'HTTPError'}})
+
+    def respond(self, status, payload):
+        data = json.dumps(payload).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def upgrade(self):
+        accept = base64.b64encode(hashlib.sha1((self.headers['Sec-WebSocket-Key'] + WS_GUID).encode()).digest())
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept.decode())
+        self.end_headers()
+        self.wfile.flush()
+
+        query = parse_qs(urlparse(self.path).query)
+        subscriptions = [s for s in ','.join(query.get('subscribe', [])).split(',') if s]
+        client = WebSocketClient(self.connection, self.rfile, subscriptions)
+        simulator = self.server.simulator
+        simulator.accept(client)
+        try:
+            client.serve()
+        finally:
+            simulator.disconnect(client)
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+
+class WebSocketClient(object):
+
+    """Server side of one RFC 6455 connection. Just enough for the bot: text frames, ping/pong and close."""
+
+    def __init__(self, sock, rfile, subscriptions):
+        self.sock = sock
+        self.rfile = rfile
+        self.subscriptions = [(s, s.split(':')[0]) for s in subscriptions]
+        self.tables = set(table for s, table in self.subscriptions)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, text, opcode=0x1):
+        payload = text.encode('utf8') if isinstance(text, str) else text
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.sock.sendall(header + payload)
+            except OSError:
+                self.closed = True
+
+    def serve(self):
+        while not self.closed:
+            frame = self.read_frame()
+            if frame is None:
+                break
+            opcode, payload = frame
+            if opcode == 0x8:
+                self.send(payload[:2], opcode=0x8)
+                break
+            elif opcode == 0x9:
+                self.send(payload, opcode=0xA)
+            elif opcode == 0x1 and payload == b'ping':
+                # BitMEX answers a text "ping" with a text "pong"
+                self.send('pong')
+        self.closed = True
+
+    def read_frame(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if header[1] & 0x80 else None
+        payload = self.rfile.read(length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return opcode, payload
+
+
+def read_recording(path):
+    """Yield (receive time, raw message) from a file written with settings.WS_RECORD_FILE."""
+    with open(path) as f:
+        for line in f:
+            received, raw = line.rstrip('\n').split(' ', 1)
+            yield float(received), raw
+
+
+def epoch(timestamp):
+    return calendar.timegm(datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%fZ').timetuple())
+
+
+def iso(seconds):
+    return datetime.utcfromtimestamp(seconds).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def run():
+    parser = argparse.ArgumentParser(description='Local BitMEX REST and WebSocket simulator')
+    parser.add_argument('recording', help='Market data recorded with settings.WS_RECORD_FILE')
+    parser.add_argument('--candles', help='JSON file of trade/bucketed rows per binSize, as used by the backtester')
+    parser.add_argument('--symbol', default='XBTUSD')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed multiplier (default 1.0)')
+    parser.add_argument('--balance', type=float, default=1.0, help='Starting wallet balance in XBT (default 1.0)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+    candles = None
+    if args.candles:
+        with open(args.candles) as f:
+            candles = json.load(f)
+    simulator = ExchangeSimulator(args.recording, symbol=args.symbol, candles=candles, speed=args.speed,
+                                  balance=args.balance)
+    server = ThreadingHTTPServer((args.host, args.port), SimulatorHandler)
+    server.daemon_threads = True
+    server.simulator = simulator
+    simulator.start()
+    logger.info("Simulating BitMEX on http://%s:%d/api/v1/", args.host, args.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,60 @@
+"""What the order manager needs to pick up where it left off after a restart, kept in a small JSON file."""
+from __future__ import absolute_import
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger('root')
+
+# Bumped when the layout changes; snapshots from another version are ignored.
+VERSION = 1
+# Order fields kept per resting order
+ORDER_FIELDS = ('orderID', 'clOrdID', 'side', 'ordType', 'orderQty', 'leavesQty', 'price', 'stopPx', 'execInst')
+
+
+def save(path, state):
+    """Write `state` atomically, so a crash mid-write leaves the previous snapshot in place."""
+    state = dict(state, version=VERSION, time=time.time())
+    temp = path + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(state, f, default=str)
+    os.replace(temp, path)
+
+
+def load(path, max_age):
+    """The snapshot at `path`, or None if there isn't one, it can't be read, or it is older than `max_age` seconds."""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning("Ignoring unreadable state snapshot %s: %s", path, e)
+        return None
+    if state.get('version') != VERSION:
+        logger.warning("Ignoring state snapshot %s from another version", path)
+        return None
+    age = time.time() - state.get('time', 0)
+    if age > max_age:
+        logger.info("Ignoring state snapshot %s, it is %.0fs old", path, age)
+        return None
+    return state
+
+
+def order_state(order):
+    return {field: order.get(field) for field in ORDER_FIELDS if order.get(field) is not None}
+
+
+def adopt(saved, live):
+    """Match the saved orders against the ones open now, by clOrdID.
+
+    Returns (adopted, gone, unknown): live orders we saved, saved orders no longer open (filled or cancelled
+    while we were down) and live orders with our prefix that the snapshot didn't know about.
+    """
+    saved = {order['clOrdID']: order for order in saved}
+    live = {order['clOrdID']: order for order in live}
+    adopted = [live[clOrdID] for clOrdID in live if clOrdID in saved]
+    gone = [saved[clOrdID] for clOrdID in saved if clOrdID not in live]
+    unknown = [live[clOrdID] for clOrdID in live if clOrdID not in saved]
+    return adopted, gone, unknown
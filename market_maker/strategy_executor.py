@@ -0,0 +1,207 @@
+"""Evaluate strategy policies off the order-management thread."""
+from __future__ import absolute_import
+import collections
+import logging
+import multiprocessing
+from concurrent import futures
+from multiprocessing import shared_memory
+
+logger = logging.getLogger('root')
+
+
+class StrategyExecutor(object):
+
+    """Runs policies from `market_maker.policies` in a worker pool with a deadline per tick.
+
+    mode is 'thread', 'process' or 'serial'. In process mode the candle columns are copied once per tick
+    into a shared memory block and the workers map them without pickling the arrays.
+    If a policy misses the deadline its previous signal is reused and the miss is counted in `misses`.
+    Policies declared with @policies.reads are only run again once one of their candle series has a new closed
+    bar (or, for those that use it, the price moved); until then their cached signal counts as a hit.
+    """
+
+    def __init__(self, policy_names, mode='thread', workers=None, deadline=2, params=None):
+        self.policy_names = list(policy_names)
+        # Keyword arguments per policy name, e.g. {'policy_MACD': {'fastperiod': 8}}
+        self.params = params or {}
+        self.mode = mode
+        self.deadline = deadline
+        self.signals = {name: 0 for name in self.policy_names}
+        self.misses = collections.Counter()
+        # Futures still running from earlier ticks, and the shared memory they read from
+        self.running = {}
+        self.shared = []
+        # (name, *args) -> (inputs key, signal) of the last successful run, and the key each running future was given
+        self.cache = {}
+        self.running_keys = {}
+        self.hits = collections.Counter()
+        self.computed = collections.Counter()
+
+        workers = workers or len(self.policy_names)
+        if mode == 'thread':
+            self.pool = futures.ThreadPoolExecutor(max_workers=workers)
+        elif mode == 'process':
+            # fork so the children don't re-run the bot's entry script
+            self.pool = futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context('fork'))
+        elif mode == 'serial':
+            self.pool = None
+        else:
+            raise ValueError("Unknown STRATEGY_EXECUTOR mode: %s" % mode)
+
+    def evaluate(self, candles, price):
+        """Return {policy name: operator} for this tick."""
+        from market_maker import policies
+        if self.pool is None:
+            for name in self.policy_names:
+                self.signals[name] = self.call(name, candles, price, **self.params.get(name, {}))
+            return dict(self.signals)
+
+        self.release_shared()
+        if self.mode == 'process':
+            block, layout = share_candles(candles)
+            self.shared.append(block)
+            submit = lambda name: self.pool.submit(run_shared_policy, name, block.name, layout, price,
+                                                   self.params.get(name, {}))
+        else:
+            submit = lambda name: self.pool.submit(getattr(policies, name), candles, price,
+                                                   **self.params.get(name, {}))
+
+        submitted = {}
+        keys = {}
+        for name in self.policy_names:
+            if name in self.running:
+                # Still busy with an earlier tick; don't pile up work behind it.
+                continue
+            keys[name] = inputs_key(getattr(policies, name), candles, price, self.params.get(name, {}))
+            cached = self.cache.get((name,))
+            if keys[name] is not None and cached is not None and cached[0] == keys[name]:
+                self.hits[name] += 1
+                self.signals[name] = cached[1]
+                continue
+            submitted[name] = submit(name)
+
+        done, not_done = futures.wait(list(submitted.values()), timeout=self.deadline)
+        for name, future in submitted.items():
+            if future in done:
+                self.signals[name] = self.collect(name, future, keys[name])
+            else:
+                self.running[name] = future
+                self.running_keys[name] = keys[name]
+
+        for name in self.policy_names:
+            if name in self.running and self.running[name] not in done:
+                self.misses[name] += 1
+                logger.warning("Policy %s missed its %ss deadline, reusing last signal %s (%d misses)",
+                               name, self.deadline, self.signals[name], self.misses[name])
+        return dict(self.signals)
+
+    def release_shared(self):
+        """Collect finished stragglers and free shared memory nothing reads from anymore."""
+        for name, future in list(self.running.items()):
+            if future.done():
+                # Late, but still fresher than the signal we have been reusing
+                self.signals[name] = self.collect(name, future, self.running_keys.pop(name, None))
+                del self.running[name]
+        if self.running:
+            # A straggler may still be reading any of the blocks.
+            return
+        for block in self.shared:
+            block.close()
+            block.unlink()
+        self.shared = []
+
+    def call(self, name, candles, price, *args, **kwargs):
+        """Run a policy (or helper such as price_limit) here, reusing its last result if its inputs haven't moved."""
+        from market_maker import policies
+        policy = getattr(policies, name)
+        key = inputs_key(policy, candles, price, kwargs, args)
+        cached = self.cache.get((name,) + args)
+        if key is not None and cached is not None and cached[0] == key:
+            self.hits[name] += 1
+            return cached[1]
+        result = policy(candles, price, *args, **kwargs)
+        self.computed[name] += 1
+        if key is not None:
+            self.cache[(name,) + args] = (key, result)
+        return result
+
+    def collect(self, name, future, key):
+        """The signal from a finished future, cached under `key` if the policy ran without an error."""
+        signal = future_signal(future)
+        self.computed[name] += 1
+        if key is not None and future.exception() is None:
+            self.cache[(name,)] = (key, signal)
+        return signal
+
+    def report(self):
+        """One line with the policy runs the signal cache saved since startup."""
+        names = sorted(set(self.hits) | set(self.computed))
+        total = sum(self.hits.values()) + sum(self.computed.values())
+        return 'Signal cache hits: %d of %d evaluations (%s)' % (
+            sum(self.hits.values()), total,
+            ', '.join('%s %d/%d' % (name, self.hits[name], self.hits[name] + self.computed[name]) for name in names))
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+        self.running = {}
+        self.release_shared()
+
+
+def inputs_key(policy, candles, price, params, args=()):
+    """What a declared policy's result depends on: the length and last closed bar of each series it reads, plus
+    price if it uses it, and its arguments. None for an undeclared policy or series without timestamps."""
+    binSizes = getattr(policy, 'binSizes', None)
+    if binSizes is None:
+        return None
+    bars = []
+    for binSize in binSizes:
+        try:
+            timestamps = candles[binSize]['timestamp']
+        except (KeyError, ValueError):
+            return None
+        bars.append((len(timestamps), int(timestamps[-1]) if len(timestamps) else None))
+    return tuple(bars), price if policy.usesPrice else None, args, repr(sorted(params.items()))
+
+
+def future_signal(future):
+    try:
+        return future.result()
+    except Exception as e:
+        logger.exception(e)
+        return 0
+
+
+def share_candles(candles):
+    """Copy candle columns into one shared memory block. Returns the block and a layout to rebuild them."""
+    import numpy as np
+    columns = []
+    size = 0
+    for binSize, series in candles.items():
+        for column in ('close', 'volume'):
+            values = np.ascontiguousarray(series[column], dtype='f8')
+            columns.append((binSize, column, size, len(values), values))
+            size += values.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    layout = []
+    for binSize, column, offset, length, values in columns:
+        np.ndarray((length,), dtype='f8', buffer=block.buf, offset=offset)[:] = values
+        layout.append((binSize, column, offset, length))
+    return block, layout
+
+
+def run_shared_policy(name, blockName, layout, price, params):
+    """Worker entry point: map the shared candle columns and run one policy."""
+    import numpy as np
+    from market_maker import policies
+    block = shared_memory.SharedMemory(name=blockName)
+    candles = collections.defaultdict(dict)
+    try:
+        for binSize, column, offset, length in layout:
+            candles[binSize][column] = np.ndarray((length,), dtype='f8', buffer=block.buf, offset=offset)
+        return getattr(policies, name)(candles, price, **params)
+    finally:
+        # The views must be gone before the block can be closed
+        candles.clear()
+        block.close()
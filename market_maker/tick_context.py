@@ -0,0 +1,43 @@
+"""Per-tick memoization of the values ExchangeInterface derives from the WS tables."""
+from __future__ import absolute_import
+import collections
+
+
+class TickContext(object):
+
+    """Caches each getter's result, keyed by name and arguments, for the rest of the tick.
+
+    A value is stored with the generation counters of the WS tables it was computed from (see
+    BitMEXWebsocket.generation), and is recomputed as soon as any of them moves, so a cached value is never older
+    than the tables it came from. Callers get the same object back each time and must not modify it.
+    """
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.cache = {}
+        # Calls answered from the cache (table scans saved) and calls that had to compute, per getter
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    def reset(self):
+        """Start of a tick: forget everything, so values that also depend on settings are recomputed."""
+        self.cache = {}
+
+    def get(self, name, tables, compute, *args):
+        key = (name,) + args
+        generations = tuple(self.ws.generation(table) for table in tables)
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == generations:
+            self.hits[name] += 1
+            return cached[1]
+        value = compute()
+        self.cache[key] = (generations, value)
+        self.misses[name] += 1
+        return value
+
+    def report(self):
+        """One line with the calls saved per getter since startup."""
+        parts = ['%s %d/%d' % (name, self.hits[name], self.hits[name] + self.misses[name])
+                 for name in sorted(set(self.hits) | set(self.misses))]
+        return 'Tick cache hits: %d of %d calls (%s)' % (
+            sum(self.hits.values()), sum(self.hits.values()) + sum(self.misses.values()), ', '.join(parts))
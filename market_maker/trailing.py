@@ -0,0 +1,184 @@
+"""Trails our take-profit and stop orders behind the WS price, instead of once per order loop tick."""
+from __future__ import absolute_import
+import logging
+import threading
+import time
+
+from market_maker.settings import settings
+
+logger = logging.getLogger('root')
+
+# WS tables that move the price, or the orders and position the triggers are worked out from
+TABLES = ('quote', 'trade', 'instrument', 'orderBook10', 'order', 'position')
+
+
+def trailing_amend(order, position_price, mid, config=settings):
+    """Return the price/stopPx change that trails a take-profit or stop order behind `mid`, or None."""
+    # kong dan zhi ying
+    if order.get('ordType') == 'Limit' and order.get('side') == 'Buy':
+        sell_limit = mid - config.ORDER_LIMIT_STEP
+        if sell_limit < order.get('price'):
+            return {'price': sell_limit-10}
+    # kong dan zhi sun
+    if order.get('ordType') == 'Stop' and order.get('side') == 'Buy':
+        move_con = position_price - mid
+        if move_con >= config.ORDER_MOVE_CONDITION and \
+           order.get('stopPx') - mid > config.ORDER_STOP_STEP:
+            return {'stopPx': mid + config.ORDER_STOP_STEP}
+    # duo dan zhi ying
+    if order.get('ordType') == 'Limit' and order.get('side') == 'Sell':
+        buy_limit = mid + config.ORDER_LIMIT_STEP
+        if buy_limit > order.get('price'):
+            return {'price': buy_limit+10}
+    # duo dan zhi sun
+    if order.get('ordType') == 'Stop' and order.get('side') == 'Sell':
+        move_con = mid - position_price
+        if move_con >= config.ORDER_MOVE_CONDITION and \
+           mid - order.get('stopPx') > config.ORDER_STOP_STEP:
+            return {'stopPx': mid - config.ORDER_STOP_STEP}
+    return None
+
+
+def triggers(orders, position_price, config=settings):
+    """The mids at which trailing_amend starts moving any of `orders`: (buy orders when mid <= this,
+    sell orders when mid >= this). Either is None if there's nothing on that side to trail."""
+    below, above = None, None
+    for order in orders:
+        ordType, side = order.get('ordType'), order.get('side')
+        if ordType == 'Limit' and order.get('price') is not None:
+            price = order['price'] + config.ORDER_LIMIT_STEP if side == 'Buy' else \
+                order['price'] - config.ORDER_LIMIT_STEP
+        elif ordType == 'Stop' and order.get('stopPx') is not None:
+            if side == 'Buy':
+                price = min(position_price - config.ORDER_MOVE_CONDITION, order['stopPx'] - config.ORDER_STOP_STEP)
+            else:
+                price = max(position_price + config.ORDER_MOVE_CONDITION, order['stopPx'] + config.ORDER_STOP_STEP)
+        else:
+            continue
+        if side == 'Buy':
+            below = price if below is None else max(below, price)
+        elif side == 'Sell':
+            above = price if above is None else min(above, price)
+    return below, above
+
+
+class TrailingStops(object):
+
+    """Amends our take-profit and stop orders as soon as the WS price crosses a trailing step.
+
+    The trigger prices are worked out from our open orders and the position whenever either changes, so each
+    price update on the WS thread is a couple of comparisons. Once the mid is `TRAILING_HYSTERESIS` past a trigger,
+    this thread sends the amends trailing_amend asks for, at most once every `TRAILING_MIN_INTERVAL` seconds.
+    """
+
+    def __init__(self, bitmex):
+        self.bitmex = bitmex
+        self.ws = bitmex.ws
+        self.symbol = bitmex.symbol
+        # What the triggers were worked out from: our order index and the position table generation
+        self.source = None
+        self.position_price = None
+        self.triggers = (None, None)
+        # orderID -> amend sent, until the WS shows it on the order
+        self.sent = {}
+        self.last_amend = 0
+        self.amends = 0
+        # crossed() runs on both the WS thread and ours
+        self.lock = threading.Lock()
+        self.wanted = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='TrailingStops')
+        self.thread.daemon = True
+        self.thread.start()
+        self.ws.add_listener(TABLES, self.on_update)
+
+    def on_update(self, table):
+        """WS thread: wake the amend thread if the price is past a trigger."""
+        if not self.stopped.is_set() and self.crossed() is not None:
+            self.wanted.set()
+
+    def crossed(self):
+        """The current mid if it's far enough past a trigger to trail something, else None."""
+        with self.lock:
+            orders = self.ws.own_orders
+            source = (orders, self.ws.generation('position'))
+            if self.source is None or source[0] is not self.source[0] or source[1] != self.source[1]:
+                self.update_triggers(orders)
+                self.source = source
+            below, above = self.triggers
+        if below is None and above is None:
+            return None
+        mid = self.ws.get_ticker(self.symbol)['mid']
+        hysteresis = settings.TRAILING_HYSTERESIS
+        if (below is not None and mid <= below - hysteresis) or (above is not None and mid >= above + hysteresis):
+            return mid
+        return None
+
+    def update_triggers(self, orders):
+        position = self.ws.position(self.symbol)
+        if not position.get('isOpen'):
+            self.position_price = None
+            self.triggers = (None, None)
+            return
+        self.position_price = position['avgEntryPrice']
+        # Until the WS confirms an amend, trail from what we sent rather than amend the same order again.
+        for orderID, amend in list(self.sent.items()):
+            order = orders.orders.get(orderID)
+            if order is None or all(order.get(key) == value for key, value in amend.items()):
+                del self.sent[orderID]
+        self.triggers = triggers([self.pending(order) for order in orders.open], self.position_price)
+
+    def pending(self, order):
+        amend = self.sent.get(order['orderID'])
+        if amend is None:
+            return order
+        order = dict(order)
+        order.update(amend)
+        return order
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wanted.wait()
+            self.wanted.clear()
+            wait = self.last_amend + settings.TRAILING_MIN_INTERVAL - time.time()
+            if wait > 0 and self.stopped.wait(wait):
+                break
+            if self.stopped.is_set():
+                break
+            try:
+                self.amend()
+            except Exception as e:
+                logger.warning("Unable to trail stop orders: %s", e)
+
+    def amend(self):
+        mid = self.crossed()
+        if mid is None:
+            return
+        amends = []
+        for order in self.ws.own_orders.open:
+            amend = trailing_amend(self.pending(order), self.position_price, mid)
+            if amend:
+                amends.append(dict(amend, orderID=order['orderID']))
+        if not amends:
+            return
+        self.last_amend = time.time()
+        with self.lock:
+            for amend in amends:
+                self.sent[amend['orderID']] = {key: value for key, value in amend.items() if key != 'orderID'}
+            # Work the triggers out again with the amends applied, so the next update doesn't re-send them.
+            self.source = None
+        logger.info("Trailing at mid %s: %s", mid, amends)
+        try:
+            self.bitmex.amend_bulk_orders(amends)
+        except Exception:
+            with self.lock:
+                for amend in amends:
+                    self.sent.pop(amend['orderID'], None)
+                self.source = None
+            raise
+        self.amends += len(amends)
+
+    def stop(self):
+        self.stopped.set()
+        self.wanted.set()
+        self.thread.join(self.bitmex.timeout + 1)
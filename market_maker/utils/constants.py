@@ -1,9 +1,18 @@
 import subprocess
 # Constants
 XBt_TO_XBT = 100000000
-VERSION = 'v1.1'
-try:
-    VERSION = str(subprocess.check_output(["git", "describe", "--tags"], stderr=subprocess.DEVNULL).rstrip())
-except Exception as e:
-    # git not available, ignore
-    pass
+DEFAULT_VERSION = 'v1.1'
+
+
+def __getattr__(name):
+    # VERSION shells out to git, so it's only worked out the first time someone reads it.
+    if name == 'VERSION':
+        global VERSION
+        VERSION = DEFAULT_VERSION
+        try:
+            VERSION = str(subprocess.check_output(["git", "describe", "--tags"], stderr=subprocess.DEVNULL).rstrip())
+        except Exception as e:
+            # git not available, ignore
+            pass
+        return VERSION
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
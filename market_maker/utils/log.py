@@ -1,16 +1,144 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 from market_maker.settings import settings
 
+# One background writer for every logger set up here, started on first use
+listener = None
+listenerLock = threading.Lock()
 
-def setup_custom_logger(name, log_level=settings.LOG_LEVEL):
-    logging.basicConfig(filename='bitmex.log',
-                        format='%(asctime)s - %(pathname)s[line:%(lineno)d] - %(levelname)s: %(message)s')
-    formatter = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
 
-    handler = logging.StreamHandler()
-    handler.setFormatter(formatter)
-    
+def setup_custom_logger(name, log_level=settings.LOG_LEVEL):
+    """Send `name`'s records to the background writer. Safe to call again, e.g. on every reconnect."""
     logger = logging.getLogger(name)
     logger.setLevel(log_level)
-    logger.addHandler(handler)
+    if not any(isinstance(h, BackgroundHandler) for h in logger.handlers):
+        handler = BackgroundHandler(get_listener())
+        handler.addFilter(RateLimitFilter(settings.LOG_RATE_LIMITS or {}))
+        logger.addHandler(handler)
+        # Records would otherwise reach the writer a second time through the root logger.
+        logger.propagate = False
     return logger
+
+
+def get_listener():
+    global listener
+    with listenerLock:
+        if listener is None:
+            listener = QueueListener(queue.SimpleQueue(), *make_handlers(), respect_handler_level=True)
+            listener.pid = os.getpid()
+            listener.start()
+            atexit.register(stop_listener)
+        return listener
+
+
+def make_handlers(console=None):
+    formatter = logging.Formatter(fmt='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+    console = logging.StreamHandler(console)
+    console.setFormatter(formatter)
+    handlers = [console]
+    if settings.LOG_FILE:
+        logfile = logging.FileHandler(settings.LOG_FILE)
+        if settings.LOG_FORMAT == 'json':
+            logfile.setFormatter(JsonFormatter())
+        else:
+            logfile.setFormatter(logging.Formatter(
+                fmt='%(asctime)s - %(pathname)s[line:%(lineno)d] - %(levelname)s: %(message)s'))
+        handlers.append(logfile)
+    return handlers
+
+
+def stop_listener():
+    """Write out everything still queued and stop the writer thread."""
+    global listener
+    with listenerLock:
+        if listener is not None and listener.pid == os.getpid():
+            listener.stop()
+        listener = None
+
+
+class BackgroundHandler(QueueHandler):
+
+    """Hands records to the writer thread without formatting them.
+
+    The message and its arguments are only formatted on the writer thread, so log with arguments
+    (`logger.info('orders: %s', orders)`) rather than formatting the string yourself. Arguments must not be mutated
+    after the call; the WS tables are replaced rather than modified, so passing them is safe.
+    """
+
+    def __init__(self, listener):
+        QueueHandler.__init__(self, listener.queue)
+        self.listener = listener
+        self.forked = None
+
+    def prepare(self, record):
+        if record.exc_info:
+            # The traceback has to be rendered while its frames still exist.
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if os.getpid() != self.listener.pid:
+            # A forked worker (e.g. STRATEGY_EXECUTOR = 'process') has no writer thread, so it writes directly.
+            # Its inherited streams may have been locked by the writer thread at the fork, so it opens its own.
+            if self.forked is None or self.forked[0] != os.getpid():
+                self.forked = (os.getpid(), make_handlers(os.fdopen(os.dup(2), 'w')))
+            for handler in self.forked[1]:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+        else:
+            self.queue.put_nowait(record)
+
+
+class RateLimitFilter(logging.Filter):
+
+    """Drops INFO and DEBUG records beyond a per-module rate, given as {module: messages per second}."""
+
+    def __init__(self, limits):
+        logging.Filter.__init__(self)
+        self.limits = limits
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        rate = self.limits.get(record.module)
+        if not rate or record.levelno > logging.INFO:
+            return True
+        now = time.time()
+        with self.lock:
+            tokens, last, suppressed = self.buckets.get(record.module, (rate, now, 0))
+            tokens = min(rate, tokens + (now - last) * rate)
+            if tokens < 1:
+                self.buckets[record.module] = (tokens, now, suppressed + 1)
+                return False
+            self.buckets[record.module] = (tokens - 1, now, 0)
+        if suppressed:
+            record.msg = str(record.msg) + ' (%d earlier messages suppressed)' % suppressed
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+
+    """One JSON object per record. The unformatted message and its arguments are kept as `event` and `data`."""
+
+    def format(self, record):
+        event = {
+            'time': record.created,
+            'level': record.levelname,
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.args:
+            event['event'] = str(record.msg)
+            event['data'] = record.args
+        if record.exc_text:
+            event['exception'] = record.exc_text
+        return json.dumps(event, default=repr)
@@ -0,0 +1,205 @@
+"""Latency histograms for the stages between market data arriving and our orders being acknowledged.
+
+Stages are recorded with `observe(name, seconds)` or `with timer(name):` from any thread, then read back as
+Prometheus text (`serve(port)` exposes /metrics) or as a one-line `summary()` for the log. Running totals such as
+bytes received are kept with `add(name, amount)`.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Each power of two is split into 2 ** SUB_BUCKET_BITS buckets, so a value is kept to within about 3%.
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+# Submitted orders waiting for their WS acknowledgement are forgotten after this many seconds
+ACK_TIMEOUT = 60
+
+histograms = {}
+histogramsLock = threading.Lock()
+pending = {}
+pendingLock = threading.Lock()
+counters = {}
+countersLock = threading.Lock()
+
+
+class Histogram(object):
+
+    """HDR-style histogram of durations in microseconds, with log-linear buckets and a fixed relative error."""
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        value = max(int(seconds * 1e6), 0)
+        index = bucket_index(value)
+        with self.lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.sum += seconds
+            self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound, in seconds, of the bucket holding the q-th quantile."""
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = q * self.count
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= rank:
+                    return min(bucket_upper(index), self.max) / 1e6
+            return self.max / 1e6
+
+
+def bucket_index(value):
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - 1 - SUB_BUCKET_BITS
+    return ((shift + 1) << SUB_BUCKET_BITS) + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_upper(index):
+    if index < SUB_BUCKETS:
+        return index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    return ((((index & (SUB_BUCKETS - 1)) | SUB_BUCKETS) + 1) << shift) - 1
+
+
+def histogram(name, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    found = histograms.get(key)
+    if found is None:
+        with histogramsLock:
+            found = histograms.setdefault(key, Histogram())
+    return found
+
+
+def observe(name, seconds, **labels):
+    histogram(name, **labels).record(seconds)
+
+
+def add(name, amount=1, **labels):
+    """Add to a running total, e.g. add('ws_bytes', len(message), table='quote')."""
+    key = (name, tuple(sorted(labels.items())))
+    with countersLock:
+        counters[key] = counters.get(key, 0) + amount
+
+
+def total(name, **labels):
+    """A running total summed over every label set matching `labels`."""
+    labels = set(labels.items())
+    return sum(value for (counter, keyLabels), value in list(counters.items())
+               if counter == name and labels <= set(keyLabels))
+
+
+class timer(object):
+
+    """`with timer('strategy_evaluation'):` records how long the block took."""
+
+    def __init__(self, name, **labels):
+        self.histogram = histogram(name, **labels)
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.time() - self.start)
+
+
+#
+# Order acknowledgements: time from sending a request to the order showing up on the WS
+#
+def expect_ack(key, sent=None):
+    """Start the clock for an order, keyed by clOrdID (new orders) or orderID (amends and cancels)."""
+    now = time.time()
+    with pendingLock:
+        if len(pending) > 1000:
+            for stale in [k for k, t in pending.items() if now - t > ACK_TIMEOUT]:
+                del pending[stale]
+        pending[key] = sent or now
+
+
+def acknowledge(key, received):
+    """Called for every order row on the WS. Records the ack latency the first time `key` appears."""
+    if key not in pending:
+        return
+    with pendingLock:
+        sent = pending.pop(key, None)
+    if sent is not None:
+        observe('order_ack', received - sent)
+
+
+#
+# Reporting
+#
+def prometheus():
+    """All histograms in the Prometheus text exposition format, as summaries in seconds."""
+    lines = []
+    described = set()
+    for (name, labels), hist in sorted(list(histograms.items())):
+        metric = 'market_maker_%s_seconds' % name
+        if metric not in described:
+            lines.append('# TYPE %s summary' % metric)
+            described.add(metric)
+        for q in QUANTILES:
+            lines.append('%s%s %.6f' % (metric, format_labels(labels + (('quantile', str(q)),)), hist.quantile(q)))
+        lines.append('%s_sum%s %.6f' % (metric, format_labels(labels), hist.sum))
+        lines.append('%s_count%s %d' % (metric, format_labels(labels), hist.count))
+    for (name, labels), value in sorted(list(counters.items())):
+        metric = 'market_maker_%s_total' % name
+        if metric not in described:
+            lines.append('# TYPE %s counter' % metric)
+            described.add(metric)
+        lines.append('%s%s %s' % (metric, format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, v) for k, v in labels)
+
+
+def summary():
+    """One line with the median and p99 of every stage, in milliseconds."""
+    parts = []
+    for (name, labels), hist in sorted(list(histograms.items())):
+        if hist.count:
+            label = name + ''.join('[%s]' % v for k, v in labels)
+            parts.append('%s p50=%.1fms p99=%.1fms n=%d' %
+                         (label, hist.quantile(0.5) * 1e3, hist.quantile(0.99) * 1e3, hist.count))
+    return 'Latency: ' + ('; '.join(parts) if parts else 'no samples yet')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """Serve /metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,110 @@
+"""Sampling profiler for the order-management loop, switched on and off while the bot runs.
+
+While enabled, a daemon thread samples the main thread's stack every PROFILE_INTERVAL seconds, but only inside
+the stages wrapped in `with profiler.section(name):`. Samples are kept as collapsed stacks
+(`stage;outer (file.py:line);inner (file.py:line) count`), the format flamegraph.pl and speedscope read, and the
+output file is rewritten at the end of every tick.
+"""
+import os
+import sys
+import threading
+
+
+class Profiler(object):
+
+    def __init__(self, output, interval=0.005, flag_file=None):
+        self.output = output
+        self.interval = interval
+        self.flag_file = flag_file
+        # Set by `toggle` (e.g. from a SIGUSR2 handler); the flag file enables profiling while it exists.
+        self.requested = False
+        self.enabled = False
+        self.stacks = {}
+        self.ticks = 0
+        # (thread id, stage name, frame the stage was entered from) while a stage is running
+        self.current = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def toggle(self, *args):
+        """Signal handler: flip profiling on or off. Takes effect at the next tick."""
+        self.requested = not self.requested
+
+    def wanted(self):
+        return self.requested or bool(self.flag_file and os.path.exists(self.flag_file))
+
+    def tick(self):
+        """Called once per loop: start or stop sampling as requested, and write out what has been collected."""
+        if self.enabled:
+            self.ticks += 1
+            self.flush()
+        wanted = self.wanted()
+        if wanted and not self.enabled:
+            self.start()
+        elif self.enabled and not wanted:
+            self.stop()
+
+    def start(self):
+        self.stacks = {}
+        self.ticks = 0
+        self.stopped.clear()
+        self.enabled = True
+        self.thread = threading.Thread(target=self.sample, name='Profiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.enabled = False
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def section(self, name):
+        return Section(self, name)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            current = self.current
+            if current is None:
+                continue
+            thread_id, name, caller = current
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None and frame is not caller:
+                code = frame.f_code
+                names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            if frame is None:
+                # The stage ended between reading `current` and taking the stack.
+                continue
+            names.append(name)
+            stack = ';'.join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def flush(self):
+        if not self.stacks:
+            return
+        lines = ['%s %d\n' % (stack, count) for stack, count in sorted(list(self.stacks.items()))]
+        temp = self.output + '.tmp'
+        with open(temp, 'w') as f:
+            f.writelines(lines)
+        os.replace(temp, self.output)
+
+
+class Section(object):
+
+    """Marks the calling thread as being in stage `name` while the block runs."""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.profiler.current = (threading.get_ident(), self.name, sys._getframe(1))
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.current = None
@@ -0,0 +1,105 @@
+"""Calls back when watched files change, using inotify where the platform has it and polling mtimes elsewhere."""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+
+logger = logging.getLogger('root')
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+# Editors either rewrite a file in place or write a new one and rename it over the old.
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT = struct.Struct('iIII')
+# Events that arrive within this many seconds of each other are one change, e.g. truncate then write.
+SETTLE = 0.05
+
+
+class FileWatcher(object):
+
+    """Runs `callback(path)` from a daemon thread after each change to one of `paths`."""
+
+    def __init__(self, paths, callback, interval=1):
+        self.paths = set(os.path.abspath(path) for path in paths if os.path.exists(path))
+        self.callback = callback
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.inotify = inotify_init(self.paths)
+        self.mode = 'inotify' if self.inotify is not None else 'polling'
+        self.thread = threading.Thread(target=self.watch if self.inotify else self.poll, name='FileWatcher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def notify(self, changed):
+        for path in sorted(changed):
+            try:
+                self.callback(path)
+            except Exception as e:
+                logger.exception(e)
+
+    def watch(self):
+        fd, directories = self.inotify
+        try:
+            while not self.stopped.is_set():
+                if not select.select([fd], [], [], self.interval)[0]:
+                    continue
+                changed = set()
+                # Keep reading until the burst of events for one save is over.
+                while select.select([fd], [], [], SETTLE)[0]:
+                    buffer = os.read(fd, 4096)
+                    offset = 0
+                    while offset < len(buffer):
+                        wd, mask, cookie, length = EVENT.unpack_from(buffer, offset)
+                        name = buffer[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+                        offset += EVENT.size + length
+                        path = os.path.join(directories[wd], os.fsdecode(name))
+                        if path in self.paths:
+                            changed.add(path)
+                self.notify(changed)
+        finally:
+            os.close(fd)
+
+    def poll(self):
+        mtimes = {path: os.path.getmtime(path) for path in self.paths}
+        while not self.stopped.wait(self.interval):
+            changed = set()
+            for path in self.paths:
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    # Mid-rename; picked up on the next pass.
+                    continue
+                if mtime != mtimes[path]:
+                    mtimes[path] = mtime
+                    changed.add(path)
+            self.notify(changed)
+
+
+def inotify_init(paths):
+    """(inotify fd, {watch descriptor: directory}) watching the directories holding `paths`, or None."""
+    if not hasattr(os, 'O_CLOEXEC'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = init(os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    directories = {}
+    for directory in set(os.path.dirname(path) for path in paths):
+        wd = add_watch(fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            os.close(fd)
+            return None
+        directories[wd] = directory
+    return fd, directories
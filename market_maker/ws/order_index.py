@@ -0,0 +1,113 @@
+"""Our open orders, indexed by side and price, kept up to date from the WS order table."""
+import bisect
+
+SIDES = ('Buy', 'Sell')
+
+
+class OrderIndex(object):
+
+    """Open orders (leavesQty > 0) whose clOrdID starts with `prefix`.
+
+    Orders with a limit price are also kept per side in a list sorted by (price, orderID), so the best own bid and
+    ask are O(1), and their total leavesQty per price level is a dict lookup. Like the WS tables it is never
+    changed once published: `updated` returns a new index, which the WS thread swaps in.
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        # orderID -> row, in the order the exchange sent them
+        self.orders = {}
+        self.prices = {side: [] for side in SIDES}
+        self.levels = {side: {} for side in SIDES}
+        # Sides whose price list and level dict belong to this index; the others are shared with the one it was
+        # updated from, and are copied before the first change.
+        self.owned = set(SIDES)
+        # self.orders.values() as a list, built by `open` on first use
+        self.openList = None
+
+    def updated(self, rows=(), removed=()):
+        """A copy with `rows` inserted or replaced, and the orders with the orderIDs in `removed` taken out.
+
+        Rows for other prefixes are ignored and rows with no leavesQty left are dropped. Returns this index
+        itself when nothing in it changes, and shares the side nobody touched with it otherwise."""
+        rows = [row for row in rows if str(row.get('clOrdID')).startswith(self.prefix)]
+        removed = [orderID for orderID in removed if orderID in self.orders]
+        if not rows and not removed:
+            return self
+        index = OrderIndex(self.prefix)
+        index.orders = dict(self.orders)
+        index.prices = dict(self.prices)
+        index.levels = dict(self.levels)
+        index.owned = set()
+        for orderID in removed:
+            index.remove(orderID)
+        for row in rows:
+            index.remove(row['orderID'], keepSlot=True)
+            if row.get('leavesQty', 0) > 0:
+                index.add(row)
+            else:
+                del index.orders[row['orderID']]
+        return index
+
+    def writable(self, side):
+        """The price list and level dict of `side`, copied first if they are still shared."""
+        if side not in self.owned:
+            self.prices[side] = list(self.prices[side])
+            self.levels[side] = dict(self.levels[side])
+            self.owned.add(side)
+        return self.prices[side], self.levels[side]
+
+    def add(self, row):
+        self.orders[row['orderID']] = row
+        side, price = row.get('side'), row.get('price')
+        if side in self.prices and price is not None:
+            prices, levels = self.writable(side)
+            bisect.insort(prices, (price, row['orderID']))
+            levels[price] = levels.get(price, 0) + row['leavesQty']
+
+    def remove(self, orderID, keepSlot=False):
+        """Take an order out of the price index. With keepSlot, leave it in `orders` to be replaced in place."""
+        row = self.orders.get(orderID)
+        if row is None:
+            if keepSlot:
+                # New order: reserve its place at the end.
+                self.orders[orderID] = None
+            return
+        if not keepSlot:
+            del self.orders[orderID]
+        side, price = row.get('side'), row.get('price')
+        if side in self.prices and price is not None:
+            prices, levels = self.writable(side)
+            i = bisect.bisect_left(prices, (price, orderID))
+            if i < len(prices) and prices[i] == (price, orderID):
+                del prices[i]
+            levels[price] -= row['leavesQty']
+            if levels[price] <= 0:
+                del levels[price]
+
+    #
+    # Lookups
+    #
+    def best(self, side):
+        """Our highest buy or lowest sell, or None."""
+        prices = self.prices[side]
+        if not prices:
+            return None
+        return self.orders[prices[-1 if side == 'Buy' else 0][1]]
+
+    def level_count(self, side):
+        return len(self.levels[side])
+
+    def quantity_at(self, side, price):
+        return self.levels[side].get(price, 0)
+
+    @property
+    def open(self):
+        """Open orders as a list, for open_orders(). Callers must not modify it."""
+        if self.openList is None:
+            # Racing readers may both build it; either list is right.
+            self.openList = list(self.orders.values())
+        return self.openList
+
+    def __len__(self):
+        return len(self.orders)
@@ -0,0 +1,193 @@
+"""Compact rows for the WS tables we keep.
+
+A row parsed from JSON is a dict holding every key string and value. These records keep the fields BitMEX
+documents for each table in `__slots__` instead. They're still read like dicts (`row['price']`,
+`row.get('stopPx')`, `in`, `dict(row)`), and for new code as attributes (`row.price`). A field the exchange sends
+that isn't declared here goes into `extra`, so nothing is dropped.
+
+Records are copy-on-write like the rest of the WS data: the WS thread calls `copy()` and `update()` and publishes
+the copy, and never changes a row other threads can see.
+"""
+import sys
+
+
+class Record(object):
+
+    __slots__ = ('extra',)
+    FIELDS = ()
+    # Fields whose values repeat on every row (symbol, side). Interning keeps one copy of each string.
+    INTERNED = frozenset(('symbol', 'side'))
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.FIELD_SET = frozenset(cls.FIELDS)
+
+    def __init__(self, row=None):
+        self.extra = None
+        if row:
+            self.update(row)
+
+    def update(self, row):
+        fields = self.FIELD_SET
+        for key, value in row.items():
+            if key in fields:
+                if key in self.INTERNED and type(value) is str:
+                    value = sys.intern(value)
+                setattr(self, key, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def copy(self):
+        other = self.__class__.__new__(self.__class__)
+        for key in self.FIELDS:
+            try:
+                setattr(other, key, getattr(self, key))
+            except AttributeError:
+                pass
+        other.extra = dict(self.extra) if self.extra else None
+        return other
+
+    #
+    # dict-compatible access
+    #
+    def __getitem__(self, key):
+        if key in self.FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def get(self, key, default=None):
+        if key in self.FIELD_SET:
+            return getattr(self, key, default)
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __contains__(self, key):
+        if key in self.FIELD_SET:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def keys(self):
+        keys = [key for key in self.FIELDS if hasattr(self, key)]
+        if self.extra:
+            keys.extend(self.extra)
+        return keys
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+class Order(Record):
+    FIELDS = ('orderID', 'clOrdID', 'clOrdLinkID', 'account', 'symbol', 'side', 'simpleOrderQty', 'orderQty',
+              'price', 'displayQty', 'stopPx', 'pegOffsetValue', 'pegPriceType', 'currency', 'settlCurrency',
+              'ordType', 'timeInForce', 'execInst', 'contingencyType', 'exDestination', 'ordStatus', 'triggered',
+              'workingIndicator', 'ordRejReason', 'simpleLeavesQty', 'leavesQty', 'simpleCumQty', 'cumQty', 'avgPx',
+              'multiLegReportingType', 'text', 'transactTime', 'timestamp')
+    __slots__ = FIELDS
+
+
+class Position(Record):
+    FIELDS = ('account', 'symbol', 'currency', 'underlying', 'quoteCurrency', 'commission', 'initMarginReq',
+              'maintMarginReq', 'riskLimit', 'leverage', 'crossMargin', 'deleveragePercentile', 'rebalancedPnl',
+              'prevRealisedPnl', 'prevUnrealisedPnl', 'prevClosePrice', 'openingTimestamp', 'openingQty',
+              'openingCost', 'openingComm', 'openOrderBuyQty', 'openOrderBuyCost', 'openOrderBuyPremium',
+              'openOrderSellQty', 'openOrderSellCost', 'openOrderSellPremium', 'execBuyQty', 'execBuyCost',
+              'execSellQty', 'execSellCost', 'execQty', 'execCost', 'execComm', 'currentTimestamp', 'currentQty',
+              'currentCost', 'currentComm', 'realisedCost', 'unrealisedCost', 'grossOpenCost', 'grossOpenPremium',
+              'grossExecCost', 'isOpen', 'markPrice', 'markValue', 'riskValue', 'homeNotional', 'foreignNotional',
+              'posState', 'posCost', 'posCost2', 'posCross', 'posInit', 'posComm', 'posLoss', 'posMargin',
+              'posMaint', 'posAllowance', 'taxableMargin', 'initMargin', 'maintMargin', 'sessionMargin',
+              'targetExcessMargin', 'varMargin', 'realisedGrossPnl', 'realisedTax', 'realisedPnl',
+              'unrealisedGrossPnl', 'longBankrupt', 'shortBankrupt', 'taxBase', 'indicativeTaxRate',
+              'indicativeTax', 'unrealisedTax', 'unrealisedPnl', 'unrealisedPnlPcnt', 'unrealisedRoePcnt',
+              'simpleQty', 'simpleCost', 'simpleValue', 'simplePnl', 'simplePnlPcnt', 'avgCostPrice',
+              'avgEntryPrice', 'breakEvenPrice', 'marginCallPrice', 'liquidationPrice', 'bankruptPrice',
+              'timestamp', 'lastPrice', 'lastValue')
+    __slots__ = FIELDS
+
+
+class Instrument(Record):
+    FIELDS = ('symbol', 'rootSymbol', 'state', 'typ', 'listing', 'front', 'expiry', 'settle', 'relistInterval',
+              'inverseLeg', 'sellLeg', 'buyLeg', 'optionStrikePcnt', 'optionStrikeRound', 'optionStrikePrice',
+              'optionMultiplier', 'positionCurrency', 'underlying', 'quoteCurrency', 'underlyingSymbol',
+              'reference', 'referenceSymbol', 'calcInterval', 'publishInterval', 'publishTime', 'maxOrderQty',
+              'maxPrice', 'lotSize', 'tickSize', 'multiplier', 'settlCurrency', 'underlyingToPositionMultiplier',
+              'underlyingToSettleMultiplier', 'quoteToSettleMultiplier', 'isQuanto', 'isInverse', 'initMargin',
+              'maintMargin', 'riskLimit', 'riskStep', 'limit', 'capped', 'taxed', 'deleverage', 'makerFee',
+              'takerFee', 'settlementFee', 'insuranceFee', 'fundingBaseSymbol', 'fundingQuoteSymbol',
+              'fundingPremiumSymbol', 'fundingTimestamp', 'fundingInterval', 'fundingRate',
+              'indicativeFundingRate', 'rebalanceTimestamp', 'rebalanceInterval', 'openingTimestamp',
+              'closingTimestamp', 'sessionInterval', 'prevClosePrice', 'limitDownPrice', 'limitUpPrice',
+              'bankruptLimitDownPrice', 'bankruptLimitUpPrice', 'prevTotalVolume', 'totalVolume', 'volume',
+              'volume24h', 'prevTotalTurnover', 'totalTurnover', 'turnover', 'turnover24h', 'homeNotional24h',
+              'foreignNotional24h', 'prevPrice24h', 'vwap', 'highPrice', 'lowPrice', 'lastPrice',
+              'lastPriceProtected', 'lastTickDirection', 'lastChangePcnt', 'bidPrice', 'midPrice', 'askPrice',
+              'impactBidPrice', 'impactMidPrice', 'impactAskPrice', 'hasLiquidity', 'openInterest', 'openValue',
+              'fairMethod', 'fairBasisRate', 'fairBasis', 'fairPrice', 'markMethod', 'markPrice',
+              'indicativeTaxRate', 'indicativeSettlePrice', 'optionUnderlyingPrice', 'settledPrice', 'timestamp',
+              # Worked out from tickSize when the row is published, see ws_thread.setTickLog
+              'tickLog')
+    __slots__ = FIELDS
+
+
+class Trade(Record):
+    FIELDS = ('timestamp', 'symbol', 'side', 'size', 'price', 'tickDirection', 'trdMatchID', 'grossValue',
+              'homeNotional', 'foreignNotional')
+    __slots__ = FIELDS
+
+
+class Quote(Record):
+    FIELDS = ('timestamp', 'symbol', 'bidSize', 'bidPrice', 'askPrice', 'askSize')
+    __slots__ = FIELDS
+
+
+class OrderBookL2(Record):
+    FIELDS = ('symbol', 'id', 'side', 'size', 'price', 'timestamp')
+    __slots__ = FIELDS
+
+
+RECORDS = {
+    'order': Order,
+    'position': Position,
+    'instrument': Instrument,
+    'trade': Trade,
+    'quote': Quote,
+    'orderBookL2': OrderBookL2,
+}
+
+
+def make_rows(table, data):
+    """Rows for `table` from a message's data: records where we have a class for the table, else the dicts."""
+    record = RECORDS.get(table)
+    if record is None:
+        return data
+    return [record(row) for row in data]
@@ -0,0 +1,50 @@
+"""The best bid, ask and last price per symbol, kept from the WS messages that move them."""
+from market_maker.utils.math import toNearest
+
+
+class TopOfBook(object):
+
+    """The freshest prices for one symbol, published as a ticker dict already rounded to tickSize.
+
+    The WS thread feeds it bid/ask from `quote` and `orderBook10`, and the last price from `trade` and
+    `instrument`, which updates less eagerly than the quote. Each change publishes a new `ticker` dict with the
+    arrival time and a sequence number; it is never modified afterwards, so readers can hold on to it.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.tickSize = None
+        self.bid = None
+        self.ask = None
+        self.last = None
+        self.seq = 0
+        # None until the instrument's tickSize is known
+        self.ticker = None
+
+    def update(self, received, bid=None, ask=None, last=None, tickSize=None):
+        """Take whichever of the prices a message carried, and republish if any of them moved."""
+        changed = False
+        if bid is not None and bid != self.bid:
+            self.bid, changed = bid, True
+        if ask is not None and ask != self.ask:
+            self.ask, changed = ask, True
+        if last is not None and last != self.last:
+            self.last, changed = last, True
+        if tickSize is not None and tickSize != self.tickSize:
+            self.tickSize, changed = tickSize, True
+        if changed and self.tickSize is not None:
+            self.publish(received)
+
+    def publish(self, received):
+        tickSize = self.tickSize
+        bid = self.bid or self.last or 0
+        ask = self.ask or self.last or 0
+        self.seq += 1
+        self.ticker = {
+            'last': toNearest(float(self.last or 0), tickSize),
+            'buy': toNearest(float(bid), tickSize),
+            'sell': toNearest(float(ask), tickSize),
+            'mid': toNearest((bid + ask) / 2.0, tickSize),
+            'timestamp': received,
+            'seq': self.seq,
+        }
@@ -0,0 +1,168 @@
+"""The WebSocket connection under BitMEXWebsocket, with a choice of client library (settings.WS_TRANSPORT)."""
+import asyncio
+import logging
+import ssl
+import threading
+
+import websocket
+
+try:
+    # Optional (pip install websockets): C frame parsing, and permessage-deflate when the server offers it.
+    from websockets.asyncio.client import connect as websockets_connect
+    from websockets.exceptions import ConnectionClosed
+except ImportError:
+    websockets_connect = None
+
+logger = logging.getLogger('root')
+
+
+class Transport(object):
+
+    """One WebSocket connection, read on its own thread.
+
+    Messages are handed to `on_message` as text, on that thread. `on_open` is called once connected, and
+    `on_close` once the connection is gone, whether it was closed by us, the server or an error (which
+    `on_error` gets first). `header` is a list of "Name: value" lines sent with the handshake.
+    """
+
+    name = None
+
+    def __init__(self, url, header, on_open, on_message, on_close, on_error):
+        self.url = url
+        self.header = header
+        self.on_open = on_open
+        self.on_message = on_message
+        self.on_close = on_close
+        self.on_error = on_error
+        self.thread = None
+
+    def start(self):
+        """Connect on a new thread and return; on_open tells when the connection is up."""
+        raise NotImplementedError
+
+    def connected(self):
+        raise NotImplementedError
+
+    def send(self, text):
+        raise NotImplementedError
+
+    def close(self):
+        """Close the connection if it's open. Safe to call from any thread, more than once."""
+        raise NotImplementedError
+
+
+class WebSocketClientTransport(Transport):
+
+    """websocket-client's WebSocketApp. It uses wsaccel's compiled masking and UTF-8 check when installed.
+
+    Without wsaccel, websocket-client checks every text frame's UTF-8 in pure Python, a loop over each byte. The
+    frames are decoded here instead, which checks them just as strictly in C.
+    """
+
+    name = 'websocket-client'
+    skip_utf8_validation = True
+
+    def start(self):
+        self.app = websocket.WebSocketApp(self.url,
+                                          on_message=self.__on_message,
+                                          on_close=lambda ws, *args: self.on_close(),
+                                          on_open=lambda ws: self.on_open(),
+                                          on_error=lambda ws, error: self.on_error(error),
+                                          header=self.header)
+        ssl_defaults = ssl.get_default_verify_paths()
+        sslopt = {'ca_certs': ssl_defaults.cafile}
+        self.thread = threading.Thread(target=lambda: self.app.run_forever(
+            sslopt=sslopt, skip_utf8_validation=self.skip_utf8_validation))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __on_message(self, ws, message):
+        self.on_message(message.decode('utf-8') if isinstance(message, bytes) else message)
+
+    def connected(self):
+        return bool(self.app.sock and self.app.sock.connected)
+
+    def send(self, text):
+        self.app.send(text)
+
+    def close(self):
+        self.app.close()
+
+
+class WebsocketsTransport(Transport):
+
+    """The `websockets` asyncio client, run on an event loop of its own.
+
+    It offers permessage-deflate, which BitMEX's JSON compresses well under, and parses frames in C.
+    """
+
+    name = 'websockets'
+
+    def __init__(self, *args, **kwargs):
+        super(WebsocketsTransport, self).__init__(*args, **kwargs)
+        if websockets_connect is None:
+            raise ImportError("WS_TRANSPORT = 'websockets' needs the websockets package (pip install websockets).")
+        self.loop = None
+        self.socket = None
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, name='websockets')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+
+    async def serve(self):
+        headers = [tuple(part.strip() for part in line.split(':', 1)) for line in self.header]
+        try:
+            # No size limit: partials of the larger tables can run to megabytes.
+            async with websockets_connect(self.url, additional_headers=headers, compression='deflate',
+                                          max_size=None, ping_interval=None) as socket:
+                self.socket = socket
+                logger.debug("WS extensions: %s", [e.name for e in socket.protocol.extensions])
+                self.on_open()
+                async for message in socket:
+                    self.on_message(message)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            self.on_error(e)
+        finally:
+            self.socket = None
+            self.on_close()
+
+    def connected(self):
+        return self.socket is not None
+
+    def send(self, text):
+        socket = self.socket
+        if socket is None:
+            raise websocket.WebSocketConnectionClosedException("Connection is already closed.")
+        asyncio.run_coroutine_threadsafe(socket.send(text), self.loop).result()
+
+    def close(self):
+        socket = self.socket
+        if socket is None:
+            return
+        try:
+            # Not waited for: this is also called from the loop's own thread, by on_close.
+            asyncio.run_coroutine_threadsafe(socket.close(), self.loop)
+        except RuntimeError:
+            # The loop has already stopped.
+            pass
+
+
+TRANSPORTS = {transport.name: transport for transport in (WebSocketClientTransport, WebsocketsTransport)}
+
+
+def make_transport(name, *args, **kwargs):
+    """The Transport for settings.WS_TRANSPORT."""
+    if name not in TRANSPORTS:
+        raise ValueError("Unknown WS_TRANSPORT %r; choose one of %s." % (name, ', '.join(sorted(TRANSPORTS))))
+    return TRANSPORTS[name](*args, **kwargs)
@@ -1,22 +1,33 @@
 import sys
-import websocket
 import threading
+import calendar
 import traceback
-import ssl
-from time import sleep
+from time import sleep, time
 import json
 import decimal
 import logging
+from datetime import datetime
 from market_maker.settings import settings
 from market_maker.auth.APIKeyAuth import generate_nonce, generate_signature
+from market_maker.utils import encoding, metrics
 from market_maker.utils.log import setup_custom_logger
 from market_maker.utils.math import toNearest
+from market_maker.ws.order_index import OrderIndex
+from market_maker.ws.records import make_rows
+from market_maker.ws.top_of_book import TopOfBook
+from market_maker.ws.transport import make_transport
 from future.utils import iteritems
 from future.standard_library import hooks
 with hooks():  # Python 2/3 compat
     from urllib.parse import urlparse, urlunparse
 
 
+# Tables whose updates can start a tick, for tick-to-order latency
+MARKET_TABLES = ['quote', 'trade', 'instrument', 'orderBook10', 'orderBookL2']
+# Tables whose messages move the top of book, see TopOfBook
+TOP_TABLES = ['quote', 'orderBook10', 'trade', 'instrument']
+
+
 # Connects to BitMEX websocket for streaming realtime data.
 # The Marketmaker still interacts with this as if it were a REST Endpoint, but now it can get
 # much more realtime data without heavily polling the API.
@@ -37,11 +48,15 @@ class BitMEXWebsocket():
     def __del__(self):
         self.exit()
 
-    def connect(self, endpoint="", symbol="XBTN15", shouldAuth=True):
-        '''Connect to the websocket and initialize data stores.'''
+    def connect(self, endpoint="", symbol="XBTN15", shouldAuth=True, wait=True, orderIDPrefix=''):
+        '''Connect to the websocket and initialize data stores.
+
+        With wait=False this returns once connected; call wait_for_partials() before reading any data.
+        Orders whose clOrdID starts with orderIDPrefix are indexed in `own_orders`.'''
 
         self.logger.debug("Connecting WebSocket.")
         self.symbol = symbol
+        self.own_orders = OrderIndex(orderIDPrefix)
         self.shouldAuth = shouldAuth
 
         # We can subscribe right in the connection querystring, so let's build that.
@@ -67,28 +82,52 @@ class BitMEXWebsocket():
         self.__connect(wsURL)
         self.logger.info('Connected to WS. Waiting for data images, this may take a moment...')
 
-        # Connected. Wait for partials
-        self.__wait_for_symbol(symbol)
+        if wait:
+            self.wait_for_partials()
+
+    def wait_for_partials(self):
+        '''Block until the images of every subscribed table have arrived.'''
+        self.__wait_for_symbol(self.symbol)
         if self.shouldAuth:
             self.__wait_for_account()
+        if self.exited:
+            self.logger.error("WS closed before the data images arrived. Exiting.")
+            sys.exit()
         self.logger.info('Got all market data. Starting.')
 
     #
     # Data methods
     #
+    def snapshot(self):
+        '''Return a consistent view of every table.
+
+        Tables are copy-on-write: the WS thread never mutates a published list or row, it publishes
+        new ones instead. Grab this once per tick and read from it to avoid torn state.'''
+        return self.data
+
+    def generation(self, table):
+        '''Return a counter that increases every time `table` is republished.'''
+        return self.generations.get(table, 0)
+
+    def add_listener(self, tables, callback):
+        '''Call `callback(table)` on the WS thread each time one of `tables` is republished. Keep it quick.'''
+        self.listeners = self.listeners + [(frozenset(tables), callback)]
+
     def get_instrument(self, symbol):
         instruments = self.data['instrument']
         matchingInstruments = [i for i in instruments if i['symbol'] == symbol]
         if len(matchingInstruments) == 0:
             raise Exception("Unable to find instrument or index with symbol: " + symbol)
-        instrument = matchingInstruments[0]
-        # Turn the 'tickSize' into 'tickLog' for use in rounding
-        # http://stackoverflow.com/a/6190291/832202
-        instrument['tickLog'] = decimal.Decimal(str(instrument['tickSize'])).as_tuple().exponent * -1
-        return instrument
+        # 'tickLog' is set by the WS thread when the row is published
+        return matchingInstruments[0]
 
     def get_ticker(self, symbol):
-        '''Return a ticker object. Generated from instrument.'''
+        '''Return a ticker object: the top of book kept from quote and orderBook10 messages.
+
+        Indices have no quotes; their ticker, and any symbol's before its first quote, comes from the instrument.'''
+        top = self.tops.get(symbol)
+        if top is not None and top.ticker is not None:
+            return top.ticker
 
         instrument = self.get_instrument(symbol)
 
@@ -122,6 +161,8 @@ class BitMEXWebsocket():
         return self.data.get('orderBook10')
 
     def open_orders(self, clOrdIDPrefix):
+        if clOrdIDPrefix == self.own_orders.prefix:
+            return self.own_orders.open
         orders = self.data['order']
         # Filter to only open orders (leavesQty > 0) and those that we actually placed
         return [o for o in orders if str(o['clOrdID']).startswith(clOrdIDPrefix) and o['leavesQty'] > 0]
@@ -162,7 +203,15 @@ class BitMEXWebsocket():
 
     def exit(self):
         self.exited = True
+        self.stopping.set()
+        # Wake anyone still waiting on the connection or the partials
+        self.connected.set()
+        with self.arrived:
+            self.arrived.notify_all()
         self.ws.close()
+        if self.recording:
+            self.recording.close()
+            self.recording = None
 
     #
     # Private methods
@@ -172,29 +221,27 @@ class BitMEXWebsocket():
         '''Connect to the websocket in a thread.'''
         self.logger.debug("Starting thread")
 
-        ssl_defaults = ssl.get_default_verify_paths()
-        sslopt_ca_certs = {'ca_certs': ssl_defaults.cafile}
-        self.ws = websocket.WebSocketApp(wsURL,
-                                         on_message=self.__on_message,
-                                         on_close=self.__on_close,
-                                         on_open=self.__on_open,
-                                         on_error=self.__on_error,
-                                         header=self.__get_auth()
-                                         )
+        if settings.WS_RECORD_FILE:
+            self.recording = open(settings.WS_RECORD_FILE, 'a')
+
+        self.ws = make_transport(settings.WS_TRANSPORT, wsURL, self.__get_auth(),
+                                 on_open=self.__on_open,
+                                 on_message=self.__on_message,
+                                 on_close=self.__on_close,
+                                 on_error=self.__on_error)
 
         setup_custom_logger('websocket', log_level=settings.LOG_LEVEL)
-        self.wst = threading.Thread(target=lambda: self.ws.run_forever(sslopt=sslopt_ca_certs))
-        self.wst.daemon = True
-        self.wst.start()
+        self.ws.start()
         self.logger.info("Started thread")
+        pinger = threading.Thread(target=self.__ping, name='WSPing')
+        pinger.daemon = True
+        pinger.start()
 
         # Wait for connect before continuing
         conn_timeout = 5
-        while (not self.ws.sock or not self.ws.sock.connected) and conn_timeout and not self._error:
-            sleep(1)
-            conn_timeout -= 1
+        self.connected.wait(conn_timeout)
 
-        if not conn_timeout or self._error:
+        if not self.ws.connected() or self._error:
             self.logger.error("Couldn't connect to WS! Exiting.")
             self.exit()
             sys.exit()
@@ -218,25 +265,37 @@ class BitMEXWebsocket():
     def __wait_for_account(self):
         '''On subscribe, this data will come down. Wait for it.'''
         # Wait for the keys to show up from the ws
-        while not {'margin', 'position', 'order'} <= set(self.data):
-            sleep(0.1)
+        with self.arrived:
+            self.arrived.wait_for(lambda: {'margin', 'position', 'order'} <= set(self.data) or self.exited)
 
     def __wait_for_symbol(self, symbol):
         '''On subscribe, this data will come down. Wait for it.'''
-        while not {'instrument', 'trade', 'quote'} <= set(self.data):
-            sleep(0.1)
+        with self.arrived:
+            self.arrived.wait_for(lambda: {'instrument', 'trade', 'quote'} <= set(self.data) or self.exited)
 
     def __send_command(self, command, args):
         '''Send a raw command.'''
         self.ws.send(json.dumps({"op": command, "args": args or []}))
 
-    def __on_message(self, ws, message):
+    def __on_message(self, message):
         '''Handler for parsing WS messages.'''
-        message = json.loads(message)
-        self.logger.debug(json.dumps(message))
+        received = time()
+        if message == 'pong':
+            self.__on_pong(received)
+            return
+        if self.recording:
+            self.recording.write('%.6f %s\n' % (received, message))
+        # The raw text, rather than re-serializing the parsed message
+        self.logger.debug('%s', message)
+        size = len(message)
+        message = encoding.loads(message)
+        parsed = time()
+        metrics.observe('ws_parse', parsed - received)
 
         table = message['table'] if 'table' in message else None
         action = message['action'] if 'action' in message else None
+        metrics.add('ws_bytes', size, table=table or 'control')
+        metrics.add('ws_messages', table=table or 'control')
         try:
             if 'subscribe' in message:
                 if message['success']:
@@ -251,11 +310,26 @@ class BitMEXWebsocket():
                     self.error("API Key incorrect, please check and restart.")
             elif action:
 
-                if table not in self.data:
-                    self.data[table] = []
-
                 if table not in self.keys:
                     self.keys[table] = []
+                self.received[table] = received
+                if table in MARKET_TABLES and action != 'partial' and message['data']:
+                    # Before __project, which may drop the timestamp
+                    self.__measure_lag(message['data'][-1].get('timestamp'), received)
+                if table in self.fields and (action == 'partial' or table in self.data):
+                    if not self.__project(table, action, message):
+                        # Nothing we keep changed
+                        return
+                if table in MARKET_TABLES:
+                    self.market_received = received
+                elif table == 'order' and action != 'partial':
+                    for row in message['data']:
+                        metrics.acknowledge(row.get('clOrdID'), received)
+                        metrics.acknowledge(row.get('orderID'), received)
+
+                # Never touch a published table or row in place; readers on other threads may be iterating
+                # it. Build the new version and publish it in one step instead.
+                rows = self.data.get(table, [])
 
                 # There are four possible actions from the WS:
                 # 'partial' - full table image
@@ -263,27 +337,46 @@ class BitMEXWebsocket():
                 # 'update'  - update row
                 # 'delete'  - delete row
                 if action == 'partial':
-                    self.logger.debug("%s: partial" % table)
-                    self.data[table] += message['data']
+                    self.logger.debug("%s: partial", table)
+                    partial = make_rows(table, message['data'])
+                    rows = rows + partial
+                    changed = partial
+                    if table == 'order':
+                        ownOrders = self.own_orders.updated(partial)
                     # Keys are communicated on partials to let you know how to uniquely identify
                     # an item. We use it for updates.
                     self.keys[table] = message['keys']
+                    if table == 'instrument':
+                        for item in partial:
+                            setTickLog(item)
                 elif action == 'insert':
-                    self.logger.debug('%s: inserting %s' % (table, message['data']))
-                    self.data[table] += message['data']
+                    self.logger.debug('%s: inserting %s', table, message['data'])
+                    inserted = make_rows(table, message['data'])
+                    rows = rows + inserted
+                    changed = inserted
+                    if table == 'order':
+                        ownOrders = self.own_orders.updated(inserted)
+                    if table == 'instrument':
+                        for item in inserted:
+                            setTickLog(item)
 
                     # Limit the max length of the table to avoid excessive memory usage.
                     # Don't trim orders because we'll lose valuable state if we do.
-                    if table not in ['order', 'orderBookL2'] and len(self.data[table]) > BitMEXWebsocket.MAX_TABLE_LEN:
-                        self.data[table] = self.data[table][(BitMEXWebsocket.MAX_TABLE_LEN // 2):]
+                    if table not in ['order', 'orderBookL2'] and len(rows) > BitMEXWebsocket.MAX_TABLE_LEN:
+                        rows = rows[(BitMEXWebsocket.MAX_TABLE_LEN // 2):]
 
                 elif action == 'update':
-                    self.logger.debug('%s: updating %s' % (table, message['data']))
+                    self.logger.debug('%s: updating %s', table, message['data'])
+                    rows = list(rows)
+                    updated = []
                     # Locate the item in the collection and update it.
                     for updateData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], updateData)
-                        if not item:
-                            continue  # No item found to update. Could happen before push
+                        index = findIndexByKeys(self.keys[table], rows, updateData)
+                        if index is None:
+                            # No item found to update. Could happen before push
+                            self.logger.debug('%s: no row to update for %s', table, updateData)
+                            continue
+                        item = rows[index]
 
                         # Log executions
                         if table == 'order':
@@ -292,54 +385,235 @@ class BitMEXWebsocket():
                                 contExecuted = updateData['cumQty'] - item['cumQty']
                                 if contExecuted > 0:
                                     instrument = self.get_instrument(item['symbol'])
+                                    # Market and triggered stop orders have no limit price
+                                    price = item['price'] if item['price'] is not None else updateData.get('avgPx')
                                     self.logger.info("Execution: %s %d Contracts of %s at %.*f" %
                                              (item['side'], contExecuted, item['symbol'],
-                                              instrument['tickLog'], item['price']))
+                                              instrument['tickLog'], price or 0))
 
-                        # Update this item.
+                        # Update a copy of this item.
+                        item = item.copy()
                         item.update(updateData)
+                        if table == 'instrument' and 'tickSize' in updateData:
+                            setTickLog(item)
+                        updated.append(item)
 
                         # Remove canceled / filled orders
                         if table == 'order' and item['leavesQty'] <= 0:
-                            self.data[table].remove(item)
+                            del rows[index]
+                        else:
+                            rows[index] = item
+                    if table == 'order':
+                        ownOrders = self.own_orders.updated(updated)
+                    changed = updated
 
                 elif action == 'delete':
-                    self.logger.debug('%s: deleting %s' % (table, message['data']))
+                    self.logger.debug('%s: deleting %s', table, message['data'])
+                    rows = list(rows)
                     # Locate the item in the collection and remove it.
                     for deleteData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], deleteData)
-                        self.data[table].remove(item)
+                        index = findIndexByKeys(self.keys[table], rows, deleteData)
+                        if index is None:
+                            self.logger.debug('%s: no row to delete for %s', table, deleteData)
+                            continue
+                        del rows[index]
+                    changed = []
+                    if table == 'order':
+                        ownOrders = self.own_orders.updated(removed=[row['orderID'] for row in message['data']])
                 else:
                     raise Exception("Unknown action: %s" % action)
+
+                if table == 'order':
+                    self.own_orders = ownOrders
+                self.__publish(table, rows)
+                if table in TOP_TABLES:
+                    self.__update_tops(table, changed, received)
+                metrics.observe('ws_apply', time() - parsed, table=table)
+                for tables, callback in self.listeners:
+                    if table in tables:
+                        callback(table)
         except:
             self.logger.error(traceback.format_exc())
 
-    def __on_open(self, ws):
+    def __on_open(self):
         self.logger.debug("Websocket Opened.")
+        self.connected.set()
 
-    def __on_close(self, ws):
+    def __on_close(self):
         self.logger.info('Websocket Closed')
         self.exit()
 
-    def __on_error(self, ws, error):
+    def __on_error(self, error):
         if not self.exited:
             self.error(error)
 
+    def __publish(self, table, rows):
+        '''Swap in a new version of a table. Rebinding is atomic, so readers see either the old or new one.'''
+        data = dict(self.data)
+        data[table] = rows
+        generations = dict(self.generations)
+        generations[table] = generations.get(table, 0) + 1
+        self.data = data
+        self.generations = generations
+        if generations[table] == 1:
+            with self.arrived:
+                self.arrived.notify_all()
+
+    def __project(self, table, action, message):
+        '''Drop the fields of `table` we don't read (settings.WS_FIELDS) before the rows are stored.
+
+        Update rows left with nothing but their keys are dropped. Returns False if no rows are left.'''
+        if action == 'partial':
+            # The keys are always kept, so updates can still be matched to rows.
+            self.fields[table] = self.fields[table] | frozenset(message['keys'])
+        fields = self.fields[table]
+        keyCount = len(self.keys[table]) if action == 'update' else -1
+        rows = []
+        for row in message['data']:
+            row = {key: value for key, value in row.items() if key in fields}
+            if len(row) > keyCount:
+                rows.append(row)
+        if len(rows) < len(message['data']):
+            metrics.add('ws_rows_dropped', len(message['data']) - len(rows), table=table)
+        message['data'] = rows
+        return bool(rows) or action != 'update'
+
+    def __measure_lag(self, timestamp, received):
+        '''How far behind the exchange's timestamp a market message arrived.
+
+        Measured against the smallest offset seen since connecting, so a skewed local clock (or the simulator's
+        replayed timestamps) doesn't count as lag; what's left is the backlog between BitMEX and us. The floor is
+        capped at MAX_CLOCK_SKEW, or a lag present since connecting would become the floor and never show.'''
+        if not timestamp:
+            return
+        offset = received - exchange_time(timestamp)
+        if self.lag_floor is None or offset < self.lag_floor:
+            self.lag_floor = offset
+        floor = self.lag_floor
+        if settings.MAX_CLOCK_SKEW is not None:
+            floor = min(floor, settings.MAX_CLOCK_SKEW)
+        self.lag = offset - floor
+        metrics.observe('ws_lag', self.lag)
+
+    def __ping(self):
+        '''Send BitMEX's text "ping" every WS_PING_INTERVAL seconds, one at a time; __on_pong times the reply.'''
+        while not self.stopping.wait(settings.WS_PING_INTERVAL or 1):
+            if not settings.WS_PING_INTERVAL or self.ping_sent is not None:
+                continue
+            self.ping_sent = time()
+            try:
+                self.ws.send('ping')
+            except Exception as e:
+                self.logger.warning("Unable to ping the WS: %s", e)
+
+    def __on_pong(self, received):
+        if self.ping_sent is None:
+            return
+        self.rtt = received - self.ping_sent
+        self.ping_sent = None
+        metrics.observe('ws_ping_rtt', self.rtt)
+
+    def freshness(self):
+        '''Seconds since the last message on each table.'''
+        now = time()
+        return {table: now - received for table, received in self.received.items()}
+
+    def ping_pending(self):
+        '''Seconds the outstanding ping has gone unanswered, or 0.'''
+        sent = self.ping_sent
+        return time() - sent if sent is not None else 0
+
+    def traffic(self):
+        '''One line with the WS bytes, messages and parse time per minute since the last call.'''
+        now = time()
+        totals = (metrics.total('ws_bytes'), metrics.total('ws_messages'), metrics.total('ws_rows_dropped'),
+                  metrics.histogram('ws_parse').sum)
+        (since, previous), self.traffic_totals = self.traffic_totals, (now, totals)
+        perMinute = [(value - before) * 60.0 / max(now - since, 1e-9) for value, before in zip(totals, previous)]
+        return ('WS per minute: %.1f KB in %.0f messages, %.0f update rows dropped, %.1fms parsing; '
+                'ping %s, lag %.0fms') % (perMinute[0] / 1e3, perMinute[1], perMinute[2], perMinute[3] * 1e3,
+                                          '%.0fms' % (self.rtt * 1e3) if self.rtt is not None else 'n/a',
+                                          self.lag * 1e3)
+
+    def __update_tops(self, table, rows, received):
+        '''Fold the prices in a quote, orderBook10, trade or instrument message into each symbol's TopOfBook.'''
+        latest = {}
+        for row in rows:
+            latest[row['symbol']] = row
+        for symbol, row in latest.items():
+            if symbol[0] == '.':
+                continue
+            top = self.tops.get(symbol)
+            if top is None:
+                top = self.tops[symbol] = TopOfBook(symbol)
+            if table == 'quote':
+                top.update(received, bid=row.get('bidPrice'), ask=row.get('askPrice'))
+            elif table == 'orderBook10':
+                bids, asks = row.get('bids'), row.get('asks')
+                top.update(received, bid=bids[0][0] if bids else None, ask=asks[0][0] if asks else None)
+            elif table == 'trade':
+                top.update(received, last=row.get('price'))
+            else:
+                top.update(received, last=row.get('lastPrice'), tickSize=row.get('tickSize'))
+
     def __reset(self):
         self.data = {}
+        # symbol -> TopOfBook, for get_ticker
+        self.tops = {}
+        # table -> the fields we keep, see __project
+        self.fields = {table: frozenset(fields) for table, fields in (settings.WS_FIELDS or {}).items()}
+        # (time, totals) as of the last traffic() report
+        self.traffic_totals = (time(), (0, 0, 0, 0.0))
+        self.own_orders = OrderIndex()
+        self.generations = {}
+        self.listeners = []
         self.keys = {}
         self.exited = False
         self._error = None
-
-
-def findItemByKeys(keys, table, matchData):
-    for item in table:
+        self.recording = None
+        # Arrival time of the latest market data message
+        self.market_received = None
+        # table -> arrival time of its latest message, see freshness()
+        self.received = {}
+        # Seconds the latest market message arrived behind its exchange timestamp, see __measure_lag
+        self.lag = 0
+        self.lag_floor = None
+        # Ping round trip in seconds, and when the unanswered ping was sent
+        self.rtt = None
+        self.ping_sent = None
+        self.stopping = threading.Event()
+        # Set once the socket is open; notified when a table's first image arrives
+        self.connected = threading.Event()
+        self.arrived = threading.Condition()
+
+
+def findIndexByKeys(keys, table, matchData):
+    for index, item in enumerate(table):
         matched = True
         for key in keys:
             if item[key] != matchData[key]:
                 matched = False
         if matched:
-            return item
+            return index
+
+
+# (hour prefix, epoch seconds) of the last timestamp parsed by exchange_time
+hourCache = (None, 0)
+
+
+def exchange_time(timestamp):
+    '''Epoch seconds of a BitMEX timestamp like 2020-01-01T00:00:00.000Z. Only the hour goes through strptime.'''
+    global hourCache
+    hour = timestamp[:13]
+    if hour != hourCache[0]:
+        hourCache = (hour, calendar.timegm(datetime.strptime(hour, '%Y-%m-%dT%H').timetuple()))
+    return hourCache[1] + int(timestamp[14:16]) * 60 + float(timestamp[17:].rstrip('Z'))
+
+
+def setTickLog(instrument):
+    # Turn the 'tickSize' into 'tickLog' for use in rounding
+    # http://stackoverflow.com/a/6190291/832202
+    instrument['tickLog'] = decimal.Decimal(str(instrument['tickSize'])).as_tuple().exponent * -1
 
 if __name__ == "__main__":
     # create console handler and set level to debug
@@ -354,6 +628,6 @@ if __name__ == "__main__":
     ws = BitMEXWebsocket()
     ws.logger = logger
     ws.connect("https://testnet.bitmex.com/api/v1")
-    while(ws.ws.sock.connected):
+    while(ws.ws.connected()):
         sleep(1)
 
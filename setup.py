@@ -20,7 +20,14 @@ setup(name='bitmex-market-maker',
           'websocket-client',
           'future'
       ],
-      packages=['market_maker', 'market_maker.auth', 'market_maker.utils', 'market_maker.ws'],
+      extras_require={
+          # Faster order body encoding, see market_maker/utils/encoding.py
+          'fast': ['orjson'],
+          # WS_TRANSPORT = 'websockets', see market_maker/ws/transport.py
+          'websockets': ['websockets>=13'],
+      },
+      packages=['market_maker', 'market_maker.auth', 'market_maker.utils', 'market_maker.ws',
+                'market_maker.sim'],
       entry_points={
           'console_scripts': ['marketmaker = market_maker:run']
       }
@@ -0,0 +1,63 @@
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+
+###
+# records-benchmark.py
+#
+# Memory and read cost of a full orderBookL2 partial kept as parsed JSON dicts versus the __slots__ records from
+# market_maker/ws/records.py. Run from the repository root:
+#
+#   python test/records-benchmark.py --levels 10000
+###
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from market_maker.ws.records import make_rows
+
+
+def partial_message(levels):
+    """An orderBookL2 partial with `levels` price levels on each side, as the exchange sends it."""
+    rows = []
+    for i in range(levels):
+        for side, price in (('Sell', 9000.5 + i * 0.5), ('Buy', 9000.0 - i * 0.5)):
+            rows.append({'symbol': 'XBTUSD', 'id': 8799000000 - int(price * 100), 'side': side,
+                         'size': 100 + i % 977, 'price': price, 'timestamp': '2020-01-01T00:00:00.000Z'})
+    return json.dumps({'table': 'orderBookL2', 'action': 'partial', 'keys': ['symbol', 'id', 'side'],
+                       'data': rows})
+
+
+def measure(build):
+    tracemalloc.start()
+    rows = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return rows, size
+
+
+def main():
+    levels = int(sys.argv[sys.argv.index('--levels') + 1]) if '--levels' in sys.argv else 10000
+    raw = partial_message(levels)
+
+    dicts, dictBytes = measure(lambda: json.loads(raw)['data'])
+    records, recordBytes = measure(lambda: make_rows('orderBookL2', json.loads(raw)['data']))
+    assert [dict(r) for r in records] == dicts
+
+    print("orderBookL2 partial, %d rows" % len(dicts))
+    print("  %-8s %10s %10s %12s %12s" % ('', 'MB', 'bytes/row', 'row[] ns', 'attr ns'))
+    for name, rows, size in (('dicts', dicts, dictBytes), ('records', records, recordBytes)):
+        number = 20
+        item = timeit.timeit(lambda: [row['price'] for row in rows], number=number)
+        attr = timeit.timeit(lambda: [row.price for row in rows], number=number) if name == 'records' else None
+        print("  %-8s %10.1f %10.0f %12.1f %12s" % (name, size / 1e6, size / len(rows),
+                                                    item / number / len(rows) * 1e9,
+                                                    '%.1f' % (attr / number / len(rows) * 1e9) if attr else '-'))
+    print("  parse+build: dicts %.1fms, records %.1fms" % (
+        timeit.timeit(lambda: json.loads(raw)['data'], number=5) / 5 * 1e3,
+        timeit.timeit(lambda: make_rows('orderBookL2', json.loads(raw)['data']), number=5) / 5 * 1e3))
+
+
+if __name__ == '__main__':
+    main()
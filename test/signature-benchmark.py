@@ -0,0 +1,42 @@
+import os
+import sys
+import timeit
+
+###
+# signature-benchmark.py
+#
+# Signatures per second from generate_signature (re-keys the HMAC and re-parses the URL every call) against a
+# Signer (keyed once, HMAC copied per message), for the requests the bot sends most. Run from the repository root:
+#
+#   python test/signature-benchmark.py
+###
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from market_maker.auth.APIKeyAuth import generate_signature
+from market_maker.auth.Signer import Signer
+
+SECRET = 'chNOOS4KvNXR_Xq4k4c9qsfoKWvnDecLATCRlcBwyKDYnWgO'
+REQUESTS = [
+    ('GET', 'https://www.bitmex.com/api/v1/order?filter=%7B%22ordStatus.isTerminated%22%3A+false%7D&count=500', b''),
+    ('POST', 'https://www.bitmex.com/api/v1/order/bulk',
+     b'{"orders":[{"symbol":"XBTUSD","side":"Buy","orderQty":100,"price":9000.5,"clOrdID":"mm_bitmex_AAAAAAA"},'
+     b'{"symbol":"XBTUSD","side":"Sell","orderQty":100,"price":9001.5,"clOrdID":"mm_bitmex_AAAAAAB"}]}'),
+    ('PUT', 'https://www.bitmex.com/api/v1/order/bulk', b'{"orders":[{"orderID":"de709f12","price":9000.0}]}'),
+]
+
+
+def main(number=20000):
+    signer = Signer(SECRET)
+    for verb, url, body in REQUESTS:
+        assert signer.sign(verb, url, 1518064238, body) == generate_signature(SECRET, verb, url, 1518064238, body)
+
+    print("%-6s %12s %12s %8s" % ('verb', 'function/s', 'Signer/s', 'speedup'))
+    for verb, url, body in REQUESTS:
+        old = timeit.timeit(lambda: generate_signature(SECRET, verb, url, 1518064238, body), number=number)
+        new = timeit.timeit(lambda: signer.sign(verb, url, 1518064238, body), number=number)
+        print("%-6s %12.0f %12.0f %7.1fx" % (verb, number / old, number / new, old / new))
+
+
+if __name__ == '__main__':
+    main()
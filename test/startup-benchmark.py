@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer
+
+###
+# startup-benchmark.py
+#
+# Measures how long the bot takes from process start to its first quote, against the local simulator
+# (market_maker/sim) so the numbers don't depend on the network. Run from the repository root:
+#
+#   python test/startup-benchmark.py --runs 5
+###
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CHILD = """
+import json, os, time
+t0 = float(os.environ['BENCH_T0'])
+marks = {'interpreter': time.time() - t0}
+from market_maker import market_maker
+marks['import'] = time.time() - t0
+exchange = market_maker.ExchangeInterface(dry_run=True)
+marks['ws_ready'] = time.time() - t0
+exchange.get_ticker()
+marks['first_quote'] = time.time() - t0
+exchange.preloaded_candles.result()
+marks['candles'] = time.time() - t0
+print(json.dumps(marks))
+os._exit(0)
+"""
+
+SETTINGS = """
+BASE_URL = "http://127.0.0.1:%d/api/v1/"
+API_KEY = "key"
+API_SECRET = "secret"
+WATCHED_FILES = ['settings.py']
+CANDLE_STORE_DIR = %r
+"""
+
+
+def write_recording(path, minutes=3 * 1440):
+    """Three days of one quote and one trade per minute, enough for a few candles of every binSize."""
+    start = datetime(2020, 1, 1)
+    price = 9000.0
+    with open(path, 'w') as f:
+        for i in range(minutes):
+            stamp = (start + timedelta(minutes=i)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+            price += (i % 7 - 3) * 0.5
+            quote = {'table': 'quote', 'action': 'insert', 'data': [
+                {'symbol': 'XBTUSD', 'bidPrice': price - 0.5, 'askPrice': price, 'bidSize': 100, 'askSize': 100,
+                 'timestamp': stamp}]}
+            trade = {'table': 'trade', 'action': 'insert', 'data': [
+                {'symbol': 'XBTUSD', 'price': price, 'size': 100, 'side': 'Buy', 'timestamp': stamp}]}
+            f.write('%.6f %s\n' % (i * 60, json.dumps(quote)))
+            f.write('%.6f %s\n' % (i * 60, json.dumps(trade)))
+
+
+def start_simulator(recording):
+    from market_maker.sim.server import ExchangeSimulator, SimulatorHandler
+    # Replay the whole recording at once so every candle is available from the start.
+    simulator = ExchangeSimulator(recording, speed=1e9)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SimulatorHandler)
+    server.daemon_threads = True
+    server.simulator = simulator
+    simulator.replay()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--candle-store', action='store_true', help='Use the on-disk candle store')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    recording = os.path.join(workdir, 'recording.txt')
+    write_recording(recording)
+    port = start_simulator(recording)
+    with open(os.path.join(workdir, 'settings.py'), 'w') as f:
+        f.write(SETTINGS % (port, os.path.join(workdir, 'candles') if args.candle_store else None))
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    results = []
+    for run in range(args.runs):
+        env['BENCH_T0'] = repr(time.time())
+        output = subprocess.check_output([sys.executable, '-c', CHILD], cwd=workdir, env=env,
+                                         stderr=subprocess.DEVNULL)
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    print("Median over %d runs, seconds since process start:" % args.runs)
+    for mark in ('interpreter', 'import', 'ws_ready', 'first_quote', 'candles'):
+        values = sorted(result[mark] for result in results)
+        print("  %-12s %.3f" % (mark, values[len(values) // 2]))
+
+
+if __name__ == '__main__':
+    main()
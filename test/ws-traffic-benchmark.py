@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+###
+# ws-traffic-benchmark.py
+#
+# Replays a WS recording (settings.WS_RECORD_FILE format) through BitMEXWebsocket's message handler and reports
+# bytes, parse time and total handling time per minute of recording, with and without the WS_FIELDS projection
+# and with the json and orjson parsers. Without a recording, a minute of XBTUSD-like traffic is generated.
+# Run from the repository root:
+#
+#   python test/ws-traffic-benchmark.py [recording.txt]
+###
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from market_maker.settings import settings
+from market_maker.utils import encoding, metrics
+from market_maker.ws.ws_thread import BitMEXWebsocket
+
+# Fields BitMEX sends on XBTUSD instrument updates besides prices, which the bot doesn't read
+INSTRUMENT_NOISE = ['fairBasis', 'fairBasisRate', 'fundingRate', 'indicativeFundingRate', 'openInterest',
+                    'openValue', 'totalVolume', 'volume', 'volume24h', 'totalTurnover', 'turnover', 'turnover24h',
+                    'homeNotional24h', 'foreignNotional24h', 'impactBidPrice', 'impactMidPrice', 'impactAskPrice',
+                    'lastPriceProtected', 'lastTickDirection', 'lastChangePcnt', 'vwap', 'prevPrice24h']
+
+
+class Replay(BitMEXWebsocket):
+
+    """A BitMEXWebsocket fed by hand, with no connection to close."""
+
+    def exit(self):
+        pass
+
+
+def generate(seconds=60):
+    """(receive time, raw message) for `seconds` of quote, trade, orderBook10 and instrument traffic."""
+    rng = random.Random(1)
+    stamp = lambda t: time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t)) + '.%03dZ' % int(t % 1 * 1000)
+    instrument = dict({key: 0 for key in INSTRUMENT_NOISE}, symbol='XBTUSD', state='Open', tickSize=0.5,
+                      multiplier=-100000000, initMargin=0.01, isQuanto=False, isInverse=True,
+                      underlyingToSettleMultiplier=-100000000, quoteToSettleMultiplier=None, lastPrice=9000.0,
+                      markPrice=9000.0, indicativeSettlePrice=9000.0, bidPrice=8999.5, askPrice=9000.0,
+                      midPrice=8999.75, timestamp=stamp(0))
+    messages = [(0.0, {'table': 'instrument', 'action': 'partial', 'keys': ['symbol'], 'data': [instrument]})]
+    price = 9000.0
+    t = 0.0
+    while t < seconds:
+        t += rng.expovariate(60)
+        kind = rng.random()
+        if kind < 0.35:
+            price += rng.choice((-0.5, 0, 0.5))
+            messages.append((t, {'table': 'quote', 'action': 'insert', 'data': [
+                {'timestamp': stamp(t), 'symbol': 'XBTUSD', 'bidSize': rng.randint(1, 10 ** 5),
+                 'bidPrice': price - 0.5, 'askPrice': price, 'askSize': rng.randint(1, 10 ** 5)}]}))
+        elif kind < 0.55:
+            messages.append((t, {'table': 'trade', 'action': 'insert', 'data': [
+                {'timestamp': stamp(t), 'symbol': 'XBTUSD', 'side': 'Buy', 'size': rng.randint(1, 5000),
+                 'price': price, 'tickDirection': 'ZeroPlusTick', 'trdMatchID': '%032x' % rng.getrandbits(128),
+                 'grossValue': 1000000, 'homeNotional': 0.01, 'foreignNotional': 100}]}))
+        elif kind < 0.85:
+            messages.append((t, {'table': 'orderBook10', 'action': 'update', 'data': [
+                {'symbol': 'XBTUSD', 'timestamp': stamp(t),
+                 'bids': [[price - 0.5 * (i + 1), rng.randint(1, 10 ** 5)] for i in range(10)],
+                 'asks': [[price + 0.5 * i, rng.randint(1, 10 ** 5)] for i in range(10)]}]}))
+        else:
+            change = {key: rng.random() * 1e6 for key in rng.sample(INSTRUMENT_NOISE, rng.randint(1, 6))}
+            if rng.random() < 0.2:
+                change.update(markPrice=price, fairPrice=price, indicativeSettlePrice=price)
+            messages.append((t, {'table': 'instrument', 'action': 'update',
+                                 'data': [dict(change, symbol='XBTUSD', timestamp=stamp(t))]}))
+    messages.insert(1, (0.0, {'table': 'orderBook10', 'action': 'partial', 'keys': ['symbol'], 'data': []}))
+    return [(received, json.dumps(message)) for received, message in messages]
+
+
+def read(path):
+    with open(path) as f:
+        for line in f:
+            received, raw = line.rstrip('\n').split(' ', 1)
+            yield float(received), raw
+
+
+def replay(messages, fields, parser):
+    metrics.counters.clear()
+    metrics.histograms.clear()
+    settings.WS_FIELDS = fields
+    ws = Replay()
+    ws.symbol = 'XBTUSD'
+    handle = ws._BitMEXWebsocket__on_message
+    saved, encoding.orjson = encoding.orjson, (encoding.orjson if parser == 'orjson' else None)
+    start = time.process_time()
+    for received, raw in messages:
+        handle(raw)
+    elapsed = time.process_time() - start
+    encoding.orjson = saved
+    return elapsed, metrics.histogram('ws_parse').sum, metrics.total('ws_rows_dropped'), ws.generation('instrument')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WS bytes and parse cost per minute of a recording')
+    parser.add_argument('recording', nargs='?', help='WS_RECORD_FILE to replay (default: generated traffic)')
+    args = parser.parse_args()
+    messages = list(read(args.recording)) if args.recording else generate()
+    minutes = max(messages[-1][0] - messages[0][0], 1) / 60.0
+    size = sum(len(raw) for received, raw in messages)
+    print("%d messages, %.1f KB per minute" % (len(messages) / minutes, size / 1e3 / minutes))
+    print("  %-10s %-8s %12s %12s %14s %16s" % ('fields', 'parser', 'parse ms/min', 'total ms/min',
+                                               'dropped rows', 'instrument pubs'))
+    parsers = ('json', 'orjson') if encoding.orjson is not None else ('json',)
+    for name, fields in (('all', {}), ('WS_FIELDS', settings.WS_FIELDS)):
+        for parserName in parsers:
+            elapsed, parse, dropped, publishes = replay(messages, fields, parserName)
+            print("  %-10s %-8s %12.1f %12.1f %14d %16d" % (name, parserName, parse * 1e3 / minutes,
+                                                           elapsed * 1e3 / minutes, dropped, publishes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+###
+# ws-transport-benchmark.py
+#
+# Streams WS frames as fast as a local server can write them to each WS_TRANSPORT in turn, and reports frames per
+# second and client CPU per frame. The server runs in its own process, so only the client's framing and decoding
+# are measured. Frames come from a WS_RECORD_FILE recording, or are generated quote and orderBook10 messages.
+# Run from the repository root:
+#
+#   python test/ws-transport-benchmark.py [recording.txt] [--frames 100000]
+###
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from market_maker.sim.server import WS_GUID
+from market_maker.ws import transport
+
+try:
+    import wsaccel
+except ImportError:
+    wsaccel = None
+
+
+class ValidatingWebSocketClientTransport(transport.WebSocketClientTransport):
+
+    """websocket-client left to check UTF-8 itself, as BitMEXWebsocket did before the transports."""
+
+    name = 'websocket-client (own UTF-8 check)'
+    skip_utf8_validation = False
+
+
+def generate(count):
+    rng = random.Random(1)
+    price = 9000.0
+    messages = []
+    for i in range(count):
+        price += rng.choice((-0.5, 0, 0.5))
+        if i % 2:
+            messages.append({'table': 'quote', 'action': 'insert', 'data': [
+                {'timestamp': '2020-01-01T00:00:00.000Z', 'symbol': 'XBTUSD', 'bidSize': rng.randint(1, 10 ** 5),
+                 'bidPrice': price - 0.5, 'askPrice': price, 'askSize': rng.randint(1, 10 ** 5)}]})
+        else:
+            messages.append({'table': 'orderBook10', 'action': 'update', 'data': [
+                {'symbol': 'XBTUSD', 'timestamp': '2020-01-01T00:00:00.000Z',
+                 'bids': [[price - 0.5 * (j + 1), rng.randint(1, 10 ** 5)] for j in range(10)],
+                 'asks': [[price + 0.5 * j, rng.randint(1, 10 ** 5)] for j in range(10)]}]})
+    return [json.dumps(message) for message in messages]
+
+
+def frame(text):
+    payload = text.encode('utf8')
+    length = len(payload)
+    if length < 126:
+        return struct.pack('!BB', 0x81, length) + payload
+    elif length < 65536:
+        return struct.pack('!BBH', 0x81, 126, length) + payload
+    return struct.pack('!BBQ', 0x81, 127, length) + payload
+
+
+def serve(port, stream, ready):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            accept = base64.b64encode(hashlib.sha1((self.headers['Sec-WebSocket-Key'] + WS_GUID).encode()).digest())
+            self.send_response(101, 'Switching Protocols')
+            self.send_header('Upgrade', 'websocket')
+            self.send_header('Connection', 'Upgrade')
+            self.send_header('Sec-WebSocket-Accept', accept.decode())
+            self.end_headers()
+            self.wfile.flush()
+            self.connection.sendall(stream)
+            # Close frame, then wait for the client's
+            self.connection.sendall(b'\x88\x02\x03\xe8')
+            self.rfile.read(2)
+            self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    ready.set()
+    server.serve_forever()
+
+
+def measure(transportClass, url, count):
+    done = threading.Event()
+    received = [0]
+    times = {}
+
+    def on_message(message):
+        if not received[0]:
+            times['first'] = (time.time(), time.process_time())
+        received[0] += 1
+
+    def on_close():
+        times['last'] = (time.time(), time.process_time())
+        done.set()
+
+    # A short count shows failures; websocket-client also reports the server's normal close as an error.
+    ws = transportClass(url, [], on_open=lambda: None, on_message=on_message, on_close=on_close,
+                        on_error=lambda error: None)
+    ws.start()
+    done.wait(600)
+    if received[0] < count:
+        print('  %-36s only got %d of %d frames' % (transportClass.name, received[0], count))
+        return
+    wall = times['last'][0] - times['first'][0]
+    cpu = times['last'][1] - times['first'][1]
+    print('  %-36s %10.0f %14.1f' % (transportClass.name, count / wall, cpu / count * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Frames/sec and CPU per frame of each WS transport')
+    parser.add_argument('recording', nargs='?', help='WS_RECORD_FILE to take the frames from')
+    parser.add_argument('--frames', type=int, default=100000)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.recording:
+        with open(args.recording) as f:
+            recorded = [line.rstrip('\n').split(' ', 1)[1] for line in f]
+        messages = [recorded[i % len(recorded)] for i in range(args.frames)]
+    else:
+        messages = generate(args.frames)
+    stream = b''.join(frame(message) for message in messages)
+    print('%d frames, %.0f bytes each on average; wsaccel %s' % (
+        len(messages), len(stream) / float(len(messages)), 'installed' if wsaccel else 'not installed'))
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(args.port, stream, ready))
+    server.daemon = True
+    server.start()
+    ready.wait()
+    url = 'ws://127.0.0.1:%d/realtime' % args.port
+    print('  %-36s %10s %14s' % ('transport', 'frames/s', 'CPU us/frame'))
+    transports = [ValidatingWebSocketClientTransport, transport.WebSocketClientTransport]
+    if transport.websockets_connect is not None:
+        transports.append(transport.WebsocketsTransport)
+    else:
+        print('  (websockets is not installed)')
+    for transportClass in transports:
+        measure(transportClass, url, len(messages))
+    server.terminate()
+
+
+if __name__ == '__main__':
+    main()